@@ -0,0 +1,164 @@
+import os
+import glob
+import json
+import argparse
+import sys
+import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine'))
+from action_lexicon import ACTION_CLASSES
+
+KEY = ["strategy", "run"]
+
+
+def classify_actions(text):
+    # text: Series of phrases -> long frame (index of text, cls) of matched action classes
+    text = text.fillna("").astype(str).str.lower().str.replace("_", " ", regex=False)
+    hits = pd.DataFrame({cls: text.str.contains(pattern, regex=True) for cls, pattern in ACTION_CLASSES.items()}, index=text.index)
+    hits = hits.stack()
+    hits = hits[hits].reset_index()
+    hits.columns = ["row", "cls", "hit"]
+    return hits[["row", "cls"]]
+
+
+def load_ground_truth(qae_file):
+    df = pd.read_parquet(qae_file, columns=["segment_id", "question", "answer"])
+    df = df[df["question"].str.contains(r"\baction\b", case=False, regex=True)].reset_index(drop=True)
+    cls = classify_actions(df["answer"])
+    gt = pd.DataFrame({"segment_id": df["segment_id"].to_numpy()[cls["row"]], "cls": cls["cls"].to_numpy()})
+    return gt.drop_duplicates(), df["segment_id"].unique()
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [value]
+
+
+def _rule_id(step):
+    # reasoning_path entries are dicts ({"id": N, ...}) or rule id numbers
+    if isinstance(step, dict):
+        step = step.get("id", step.get("rule_id"))
+    try:
+        return int(step)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_results(result_dir, symbolic_path=None):
+    """
+    Loads every experiment result file (`<N-strategy>/*.json`) and the it_check output
+    into two long frames: one row per predicted action and one row per rule on the reasoning path.
+    """
+    actions, paths = [], []
+    files = [(os.path.basename(os.path.dirname(p)), p) for p in sorted(glob.glob(os.path.join(result_dir, "[0-9]-*", "*.json")))]
+    if symbolic_path and os.path.exists(symbolic_path):
+        files.append(("symbolic", symbolic_path))
+
+    for strategy, path in files:
+        run = os.path.splitext(os.path.basename(path))[0]
+        with open(path, "r") as f:
+            try:
+                data = json.load(f)
+            except json.JSONDecodeError:
+                print(f"Skipping unreadable result file: {path}")
+                continue
+        for seg_id, res in data.items():
+            if not isinstance(res, dict):
+                continue
+            if "actions_to_take" in res:
+                # it_check output: the fired rules are the reasoning path
+                steps = res["actions_to_take"]
+                acts = [d.get("action") for d in steps]
+            else:
+                steps = _as_list(res.get("reasoning_path"))
+                acts = _as_list(res.get("action"))
+            actions.extend((strategy, run, seg_id, a) for a in acts if a)
+            paths.extend((strategy, run, seg_id, r) for r in map(_rule_id, steps) if r is not None)
+
+    actions = pd.DataFrame(actions, columns=KEY + ["segment_id", "action"])
+    paths = pd.DataFrame(paths, columns=KEY + ["segment_id", "rule_id"]).drop_duplicates()
+    return actions, paths
+
+
+def load_store_results(store_root):
+    # same long frames as load_results, read from the typed columns of the result store
+    from result_store import ResultStore
+    df = ResultStore(store_root).read(columns=["actions", "rule_ids"])
+    df = df.rename(columns={"stage": "strategy"})
+    actions = df[KEY + ["segment_id", "actions"]].explode("actions").dropna(subset=["actions"]).rename(columns={"actions": "action"})
+    paths = df[KEY + ["segment_id", "rule_ids"]].explode("rule_ids").dropna(subset=["rule_ids"]).rename(columns={"rule_ids": "rule_id"})
+    paths["rule_id"] = paths["rule_id"].astype(int)
+    return actions.reset_index(drop=True), paths.drop_duplicates().reset_index(drop=True)
+
+
+def jaccard(left, right, on, by):
+    # per-group Jaccard of two long frames, computed with one merge and three groupbys
+    inter = left.merge(right, on=on).groupby(by).size().rename("inter")
+    n_left = left.groupby(by).size().rename("n_left")
+    n_right = right.groupby([c for c in by if c in right.columns]).size().rename("n_right")
+    scores = pd.concat([n_left, inter], axis=1).fillna({"inter": 0}).reset_index()
+    scores = scores.merge(n_right.reset_index(), how="left").fillna({"n_right": 0})
+    scores["jaccard"] = scores["inter"] / (scores["n_left"] + scores["n_right"] - scores["inter"])
+    return scores
+
+
+def action_metrics(actions, gt, gt_segments):
+    cls = classify_actions(actions["action"])
+    pred = actions.iloc[cls["row"]][KEY + ["segment_id"]].assign(cls=cls["cls"].to_numpy()).drop_duplicates()
+    pred = pred[pred["segment_id"].isin(gt_segments)]
+
+    scores = jaccard(pred, gt, on=["segment_id", "cls"], by=KEY + ["segment_id"])
+    # segments whose actions fall in no class are answered but wrong, they count as no match
+    answered = actions[actions["segment_id"].isin(gt_segments)][KEY + ["segment_id"]].drop_duplicates()
+    scores = answered.merge(scores, on=KEY + ["segment_id"], how="left").fillna({"inter": 0, "jaccard": 0.0})
+    scores["match"] = scores["inter"] > 0
+    answered = answered.groupby(KEY)["segment_id"].nunique().rename("segments")
+    table = scores.groupby(KEY).agg(action_match=("match", "mean"), action_jaccard=("jaccard", "mean"))
+    table = pd.concat([answered, table], axis=1)
+    table["coverage"] = table["segments"] / len(gt_segments)
+    return table
+
+
+def rule_path_metrics(paths, reference="symbolic"):
+    # overlap of each strategy's reasoning path with the rules fired by the symbolic engine
+    ref = paths[paths["strategy"] == reference][["segment_id", "rule_id"]].drop_duplicates()
+    pred = paths[paths["strategy"] != reference]
+    if ref.empty or pred.empty:
+        return pd.DataFrame(columns=["rule_overlap", "rule_recall"], index=pd.MultiIndex.from_tuples([], names=KEY))
+    scores = jaccard(pred, ref, on=["segment_id", "rule_id"], by=KEY + ["segment_id"])
+    scores = scores[scores["n_right"] > 0]
+    scores["recall"] = scores["inter"] / scores["n_right"]
+    return scores.groupby(KEY).agg(rule_overlap=("jaccard", "mean"), rule_recall=("recall", "mean"))
+
+
+def evaluate(result_dir, qae_file, symbolic_path=None, store=None):
+    gt, gt_segments = load_ground_truth(qae_file)
+    if store:
+        actions, paths = load_store_results(store)
+    else:
+        actions, paths = load_results(result_dir, symbolic_path)
+    table = action_metrics(actions, gt, gt_segments)
+    table = table.join(rule_path_metrics(paths), how="left")
+    return table.sort_values("action_match", ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--result_dir', default='.')
+    parser.add_argument('--symbolic', default='../reasoningEngine/result.json')
+    parser.add_argument('--qae_file', type=str, default='../dataset/LingoQA/val.parquet')
+    parser.add_argument('--save_path', type=str, default=None)
+    parser.add_argument('--store', type=str, default=None, help='read the results from this Parquet result store instead of the JSON files')
+    args = parser.parse_args()
+
+    table = evaluate(args.result_dir, args.qae_file, args.symbolic, args.store)
+    with pd.option_context("display.float_format", "{:.3f}".format, "display.width", 200):
+        print(table.to_string())
+    if args.save_path:
+        table.to_csv(args.save_path)
+
+
+if __name__ == '__main__':
+    main()
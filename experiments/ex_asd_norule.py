@@ -1,12 +1,19 @@
 import os
 import json
 import re
-import google.generativeai as genai
-import PIL.Image
-from dotenv import load_dotenv
 import argparse
 import pandas as pd
 from datetime import datetime
+import sys
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine'))
+import time
+import metrics
+import uploads
+import llm_client
+import routing
+from result_store import ResultStore, BatchWriter
+from prompt_format import estimate_tokens
+from metrics import tracer
 
 
 def main():
@@ -14,12 +21,16 @@ def main():
         with open(log_path, 'a') as log_file:
             log_file.write(message + '\n')
         print(message)
-    def generate_answer(query, img, model_name):
+    def generate_answer(query, img, model_name, video=None, scene_description=None):
         try:
-            model = genai.GenerativeModel(model_name) 
-            response = model.generate_content([query, img])
-            clean_text = response.text.strip('`').lstrip('json\n')
-            return json.loads(clean_text)
+            if routing.router:
+                return routing.router.generate([query, img], video, strategy, scene_description)
+            model = llm_client.model(model_name)
+            with tracer.span('llm', video, strategy, model=model_name):
+                response = model.generate_content([query, img])
+            with tracer.span('response_parse', video, strategy):
+                clean_text = response.text.strip('`').lstrip('json\n')
+                return json.loads(clean_text)
 
         except Exception as e:
             print_log( f"An error occurred: {e}")
@@ -37,9 +48,6 @@ def main():
         "explanation": "The ego should drive carefully and slowly because it is approaching a crossing. The traffic light is green therefore it can move forward.",
         "summary": "The best action is to ..., because ..."
     }    
-    load_dotenv()
-    os.getenv("GOOGLE_API_KEY")
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--image_dir', default='../images/path')
@@ -47,18 +55,37 @@ def main():
     parser.add_argument('--scene_path', default='scene.json')
     parser.add_argument('--model_name', default="gemini-2.5-flash")
     parser.add_argument('--save_path', type=str, default=None)
+    parser.add_argument('--trace_path', type=str, default=None, help='append stage spans to this JSON-lines file')
+    parser.add_argument('--metrics_port', type=int, default=None, help='serve Prometheus metrics on this port')
+    parser.add_argument('--upload_registry', type=str, default=None, help='upload each image once and reuse the handles stored in this JSON file')
+    parser.add_argument('--upload_local_dir', type=str, default=None, help='use a local stand-in for the Files API, for offline runs')
+    parser.add_argument('--deadline', type=float, default=120.0, help='seconds before a model request is given up')
+    parser.add_argument('--stand_in', type=str, default=None, help='JSON options of a local stand-in model, e.g. \'{"slow_rate": 0.1, "fail_rate": 0.05}\'')
+    parser.add_argument('--cascade', nargs='+', default=None, help='models to try cheapest first, e.g. gemini-2.5-flash gemini-2.5-pro, instead of --model_name')
+    parser.add_argument('--min_confidence', type=float, default=0.7, help='self-reported confidence below which the cascade escalates')
+    parser.add_argument('--cascade_samples', type=int, default=1, help='answers drawn from each cheaper model, escalate when they disagree')
+    parser.add_argument('--result_store', type=str, default=None, help='also append the results to this Parquet result store')
     args = parser.parse_args()
+    metrics.configure(args.trace_path, args.metrics_port)
+    uploads.configure(args.upload_registry, args.upload_local_dir)
+    llm_client.configure(args.deadline, args.stand_in)
+    routing.configure(args.cascade, args.min_confidence, args.cascade_samples, routing.RULES_PATH)
 
     image_dir = args.image_dir
     save_path = args.save_path
     qae_file = args.qae_file
     model_name = args.model_name
+    if args.cascade:
+        # named after its models, so cascade runs get their own result files
+        model_name = 'cascade-' + '_'.join(m.split('-')[-1] for m in args.cascade)
     scene_path = args.scene_path
     
     scenefilename = (os.path.basename(scene_path)).split('.')[0]
     modelsuffix = model_name.split('-')[-1]
     save_path = f'4-asd_norule/lingoqa_{scenefilename}_rulelmm_{modelsuffix}_1001_newquery.json'    
+    strategy = os.path.dirname(save_path)
     log_path = save_path.replace('.json', '.log')
+    writer = BatchWriter(ResultStore(args.result_store), strategy, model_name, os.path.splitext(os.path.basename(save_path))[0]) if args.result_store else None
 
     # get all images with ground truth qae
     df = pd.read_parquet(qae_file)
@@ -80,28 +107,43 @@ def main():
                 video_name = video + '.jpg'
                 video_path = os.path.join(image_dir, video_name)
                 try:
-                    img = PIL.Image.open(video_path)
+                    with tracer.span('image_load', video, strategy):
+                        img = uploads.image_part(video_path)
                 except FileNotFoundError:
                     print_log( f"Error: The image file was not found at '{video_path}'.")
                     exit() 
                 scene_description = scene[video]
 
+                prompt_start = time.perf_counter()
                 query = f"""You are a driving assistant. Answer the question: "What is the best action for the ego car?" 
                 Use the video (5 frames) and the scene description {scene_description},  
                 Output JSON in this format: {jsonformat}. Here is an example: {example}
                 """
+                tracer.record('prompt_build', time.perf_counter() - prompt_start, video, strategy, tokens=estimate_tokens(query))
 
                 print_log(f"{datetime.now():%Y-%m-%d %H:%M:%S} Generating answer for video: {video}")
-                result = generate_answer(query, img, model_name) # json
+                result = generate_answer(query, img, model_name, video, scene_description) # json
                 print_log(f"{datetime.now():%Y-%m-%d %H:%M:%S} Answer generated for video: {video}")
                 result_item = {video: result}
 
                 # save to json file
                 result_data.update(result_item)
 
-                with open(save_path, "w") as f_log:
-                    json.dump(result_data, f_log, indent=4)
+                with tracer.span('result_write', video, strategy):
+                    with open(save_path, "w") as f_log:
+                        json.dump(result_data, f_log, indent=4)
+                if writer:
+                    writer.add(video, result)
                 print_log( f'{video} is done.')
 
+    if writer:
+        writer.flush()
+    uploads.print_summary()
+    llm_client.print_summary()
+    routing.print_summary()
+    tracer.print_summary()
+    tracer.close()
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,22 @@
+import re
+
+# keyword lexicon shared by predicted action phrases and the free-text LingoQA answers, used by routing.py and evaluate.py
+ACTION_CLASSES = {
+    "stop": r"\bstop(?:s|ped|ping)?\b|\bwait|give way|give_way|\bhalt",
+    "slow_down": r"slow|reduc|decelerat|\bbrak|careful|cautio",
+    "maintain_speed": r"maintain|keep(?:s|ing)? (?:its |the |my |our )?(?:current )?speed|continu|carry on|carries on|proceed|moving forward|drive(?:s)? through",
+    "start": r"\bstart|accelerat|move off|moves off|pull(?:s|ing)? away|move_off",
+    "turn_left": r"turn(?:s|ing)? left|left turn",
+    "turn_right": r"turn(?:s|ing)? right|right turn",
+    "change_lane": r"change(?:s)? lane|changing lane|into the (?:left|right) lane|to the (?:left|right) lane|overtak",
+}
+_CLASS_PATTERNS = {cls: re.compile(pattern) for cls, pattern in ACTION_CLASSES.items()}
+
+
+def action_classes(actions):
+    # set of ACTION_CLASSES keys matched by any of the action phrases
+    classes = set()
+    for action in actions:
+        text = str(action).lower().replace('_', ' ')
+        classes |= {cls for cls, pattern in _CLASS_PATTERNS.items() if pattern.search(text)}
+    return classes
@@ -0,0 +1,209 @@
+import json
+import time
+import argparse
+from collections import Counter
+from reason_engine import DrivingLogicEngine, VOCABULARY_PATH
+
+ASD_KEYS = ['situation', 'control_device', 'road_user', 'intention']
+
+
+def parts(statement):
+    return [i.strip() for i in statement.strip('()').split(',')]
+
+
+def default_perturbations(scene, vocabulary):
+    """
+    Single edits of a scene: drop each tuple, switch the current state of each control device
+    and road user to every other status of the vocabulary, and change the intention.
+
+    A perturbation is a list of (ASD key, old tuple, new tuple) edits, old None adds a tuple,
+    new None drops it.
+    """
+    status = vocabulary['status']
+    perturbations = []
+    for key in ASD_KEYS:
+        for statement in scene.get(key, []):
+            perturbations.append([(key, statement, None)])
+            p = parts(statement)
+            if key == 'control_device' and len(p) == 4:
+                options = status['control_device_status']
+            elif key == 'road_user' and len(p) == 4:
+                options = status['road_user_status']
+            elif key == 'intention' and len(p) == 2:
+                options = vocabulary['ego_intention']
+            else:
+                continue
+            for value in options:
+                if value != p[-1]:
+                    perturbations.append([(key, statement, f"({', '.join(p[:-1] + [value])})")])
+    return perturbations
+
+
+class WhatIf:
+
+    def __init__(self, engine, rulebook=None):
+        """
+        Counterfactual evaluation of scene edits against one compiled rulebook.
+
+        Every ASD tuple is compiled once into a bitmask over the facts that can change the actions
+        (axiom ids, then the priority facts without one). A variant of a scene is the OR of the
+        masks of its tuples, so an edit flips bits instead of rebuilding fact strings, and all
+        variants of a scene are matched together with RuleIndex.match_batch().
+        """
+        self.engine = engine
+        self.compiled = engine.rulebooks[rulebook or engine.rulebook]
+        self.bit = dict(self.compiled['axiom_condition_id'])
+        self.n_axioms = len(self.bit)
+        self.priorities = self.compiled['priorities']
+        for fact in self.priorities['facts']:
+            self.bit.setdefault(fact, len(self.bit))
+        self.fact = {b: f for f, b in self.bit.items()}
+        self.priority_bits = {self.bit[f]: f for f in self.priorities['facts']}
+        self.masks = {}
+
+    def tuple_mask(self, key, statement):
+        if (key, statement) not in self.masks:
+            scene = {k: [] for k in ASD_KEYS}
+            scene[key] = [statement]
+            facts, _ = self.engine.build_facts(scene)
+            mask = 0
+            for fact in facts:
+                if fact in self.bit:
+                    mask |= 1 << self.bit[fact]
+            self.masks[key, statement] = mask
+        return self.masks[key, statement]
+
+    def scene_mask(self, statements):
+        mask = 0
+        for key, statement in statements:
+            mask |= self.tuple_mask(key, statement)
+        return mask
+
+    def facts_of(self, mask):
+        return [self.fact[b] for b in range(mask.bit_length()) if mask >> b & 1]
+
+    def evaluate(self, scene, perturbations):
+        """
+        Actions of the scene and of every perturbed variant of it.
+
+        Returns:
+            dict: 'actions' of the scene, and per perturbation its 'removed' and 'added' driving
+            facts, 'actions', and the actions it 'gained' and 'lost'. Perturbations with edits of
+            the wrong arity get an 'error' instead.
+        """
+        base = [(key, s) for key in ASD_KEYS for s in scene.get(key, [])]
+        masks, errors = [self.scene_mask(base)], {}
+        for i, perturbation in enumerate(perturbations):
+            statements = list(base)
+            try:
+                for key, old, new in perturbation:
+                    if old is not None:
+                        statements.remove((key, old))
+                    if new is not None:
+                        statements.append((key, new))
+                masks.append(self.scene_mask(statements))
+            except ValueError as e:
+                # an old tuple missing from the scene or a new one the engine cannot parse
+                errors[i] = str(e)
+                masks.append(masks[0])
+
+        # transpose the variant masks into one bitset of variants per axiom
+        columns = {}
+        for v, mask in enumerate(masks):
+            while mask:
+                low = mask & -mask
+                b = low.bit_length() - 1
+                columns[b] = columns.get(b, 0) | 1 << v
+                mask ^= low
+        answers = [[] for _ in masks]
+        axiom_columns = {b: c for b, c in columns.items() if b < self.n_axioms}
+        for rule_id, action, fires in self.compiled['rule_index'].match_batch(axiom_columns, (1 << len(masks)) - 1):
+            while fires:
+                low = fires & -fires
+                answers[low.bit_length() - 1].append({'rule_id': rule_id, 'action': action})
+                fires ^= low
+
+        actions = []
+        for v, ans in enumerate(answers):
+            priority_facts = {f for b, f in self.priority_bits.items() if masks[v] >> b & 1}
+            actions.append({a['action'] for a in self.engine.resolve_priorities(ans, priority_facts, self.priorities)})
+
+        variants = []
+        for i, perturbation in enumerate(perturbations):
+            if i in errors:
+                variants.append({'perturbation': perturbation, 'error': errors[i]})
+                continue
+            variants.append({
+                'perturbation': perturbation,
+                'removed': self.facts_of(masks[0] & ~masks[i + 1]),
+                'added': self.facts_of(masks[i + 1] & ~masks[0]),
+                'actions': sorted(actions[i + 1]),
+                'gained': sorted(actions[i + 1] - actions[0]),
+                'lost': sorted(actions[0] - actions[i + 1]),
+            })
+        return {'actions': sorted(actions[0]), 'variants': variants}
+
+    def what_if(self, scene, perturbations):
+        """
+        Minimal fact changes that flip each action of the scene on or off.
+
+        Returns:
+            dict: evaluate() output plus 'flips', action -> list of {'perturbation', 'removed', 'added'}
+            whose fact change does not contain the fact change of another flip of that action.
+        """
+        result = self.evaluate(scene, perturbations)
+        flips = {}
+        for variant in result['variants']:
+            for action in variant.get('gained', []) + variant.get('lost', []):
+                flips.setdefault(action, []).append(variant)
+        result['flips'] = {}
+        for action, variants in sorted(flips.items()):
+            kept, seen = [], []
+            for variant in sorted(variants, key=lambda v: len(v['removed']) + len(v['added'])):
+                change = {('-', f) for f in variant['removed']} | {('+', f) for f in variant['added']}
+                if any(s <= change for s in seen):
+                    continue
+                seen.append(change)
+                kept.append({k: variant[k] for k in ('perturbation', 'removed', 'added')})
+            result['flips'][action] = kept
+        return result
+
+
+def main():
+    # sensitivity of the symbolic actions to single edits, over every scene of an ASD file
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scene', default='lingoqa_gtasd.json')
+    parser.add_argument('--rules', default='uk_rules.json')
+    parser.add_argument('--vocabulary', default=VOCABULARY_PATH)
+    parser.add_argument('--save_path', type=str, default=None)
+    args = parser.parse_args()
+
+    with open(args.scene, 'r') as f:
+        scenes = json.load(f)
+    with open(args.rules, 'r') as f:
+        rules = json.load(f)
+    with open(args.vocabulary, 'r') as f:
+        vocabulary = json.load(f)
+
+    engine = DrivingLogicEngine(rules, False, vocabulary=args.vocabulary)
+    what_if = WhatIf(engine)
+    start = time.perf_counter()
+    results, n_variants, flipping = {}, 0, Counter()
+    for seg_id, scene in scenes.items():
+        perturbations = default_perturbations(scene, vocabulary)
+        results[seg_id] = what_if.what_if(scene, perturbations)
+        n_variants += len(perturbations)
+        for action, changes in results[seg_id]['flips'].items():
+            flipping[action] += len(changes)
+    seconds = time.perf_counter() - start
+
+    print(f"{len(scenes)} scenes, {n_variants} variants evaluated in {seconds:.2f}s")
+    for action, n in flipping.most_common():
+        print(f"\t{action}: {n} minimal fact changes")
+    if args.save_path:
+        with open(args.save_path, 'w') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
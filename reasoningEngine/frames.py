@@ -0,0 +1,113 @@
+import os
+import argparse
+import numpy as np
+import PIL.Image
+
+# the segment JPEGs put five frames side by side, separated by white columns of GAP pixels
+N_FRAMES = 5
+GAP = 11
+
+
+def frame_bounds(width, n_frames=N_FRAMES, gap=GAP):
+    # (x0, x1) column range of every frame in a composite of the given width
+    frame_width, rest = divmod(width - (n_frames - 1) * gap, n_frames)
+    if frame_width <= 0 or rest:
+        raise ValueError(f"width {width} is not {n_frames} frames with {gap}px gaps")
+    return [(i * (frame_width + gap), i * (frame_width + gap) + frame_width) for i in range(n_frames)]
+
+
+def split_frames(composite, n_frames=N_FRAMES, gap=GAP):
+    # views into the composite array, no pixels are copied
+    return [composite[:, x0:x1] for x0, x1 in frame_bounds(composite.shape[1], n_frames, gap)]
+
+
+def downscale(frame, factor):
+    # nearest neighbour by striding, still a view
+    return frame[::factor, ::factor]
+
+
+def crop(frame, top, left, height, width):
+    return frame[top:top + height, left:left + width]
+
+
+def distinct_frames(frames, threshold=2.0, factor=16):
+    """
+    Indices of the frames that differ from the previously kept frame by more than `threshold`
+    mean absolute difference (0-255 scale), compared on `factor`-times downscaled views.
+    """
+    kept = [0]
+    previous = downscale(frames[0], factor).astype(np.int16)
+    for i in range(1, len(frames)):
+        current = downscale(frames[i], factor).astype(np.int16)
+        if np.abs(current - previous).mean() > threshold:
+            kept.append(i)
+            previous = current
+    return kept
+
+
+def to_image(frame):
+    # PIL image of one frame, e.g. for a per-frame model request
+    return PIL.Image.fromarray(np.ascontiguousarray(frame))
+
+
+class FrameStore:
+
+    def __init__(self, root, n_frames=N_FRAMES, gap=GAP):
+        """
+        Decodes each composite JPEG once into an uint8 HxWx3 array saved as `root/<segment_id>.npy`.
+        Later calls map that file read-only instead of decoding the JPEG again, so the pages are
+        shared by every process reading the same store.
+
+        Args:
+            root (str): cache directory.
+            n_frames (int): frames per composite.
+            gap (int): width of the separator columns in pixels.
+        """
+        self.root = root
+        self.n_frames = n_frames
+        self.gap = gap
+        self.decoded = 0
+        self.mapped = 0
+        os.makedirs(root, exist_ok=True)
+
+    def cache_path(self, image_path):
+        return os.path.join(self.root, os.path.splitext(os.path.basename(image_path))[0] + '.npy')
+
+    def composite(self, image_path):
+        cache = self.cache_path(image_path)
+        if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(image_path):
+            with PIL.Image.open(image_path) as img:
+                array = np.asarray(img.convert('RGB'))
+            # written next to the target and renamed, a reader never maps a half written file
+            tmp = f"{cache}.{os.getpid()}.tmp.npy"
+            np.save(tmp, array)
+            os.replace(tmp, cache)
+            self.decoded += 1
+        else:
+            self.mapped += 1
+        return np.load(cache, mmap_mode='r')
+
+    def frames(self, image_path):
+        return split_frames(self.composite(image_path), self.n_frames, self.gap)
+
+    def frame(self, image_path, index):
+        return self.frames(image_path)[index]
+
+
+def main():
+    # decode every composite of a directory into the store ahead of the experiments
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--image_dir', default='../dataset/LingoQA/videos')
+    parser.add_argument('--store', default='../dataset/LingoQA/frames')
+    args = parser.parse_args()
+
+    store = FrameStore(args.store)
+    for name in sorted(os.listdir(args.image_dir)):
+        if name.endswith('.jpg'):
+            frames = store.frames(os.path.join(args.image_dir, name))
+            print(f"{name}: {len(frames)} frames of {frames[0].shape[1]}x{frames[0].shape[0]}, distinct {distinct_frames(frames)}")
+    print(f"{store.decoded} decoded, {store.mapped} already in {args.store}")
+
+
+if __name__ == '__main__':
+    main()
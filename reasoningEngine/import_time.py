@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# packages the symbolic path must not load
+HEAVY = {'pandas', 'numpy', 'pyarrow', 'PIL', 'google', 'grpc', 'dotenv'}
+
+# (directory the module is imported from, module), as the scripts are run
+TARGETS = {
+    'reason_engine': ('reasoningEngine', 'reason_engine'),
+    'reason_service': ('reasoningEngine', 'reason_service'),
+    'reasoning_cache': ('reasoningEngine', 'reasoning_cache'),
+    'it_check': ('reasoningEngine', 'it_check'),
+    'llm_client': ('reasoningEngine', 'llm_client'),
+    'uploads': ('reasoningEngine', 'uploads'),
+    'result_store': ('reasoningEngine', 'result_store'),
+    'naive': ('experiments', 'naive'),
+    'ex_asd_rulelmm': ('experiments', 'ex_asd_rulelmm'),
+    'evaluate': ('experiments', 'evaluate'),
+    'genasd_gemini': ('scene_generation', 'genasd_gemini'),
+    'generate_scene': (os.path.join('scene_generation', 'models'), 'generate_scene'),
+}
+# modules that must import without any HEAVY package, --check fails otherwise
+SYMBOLIC = ['reason_engine', 'reason_service', 'reasoning_cache', 'it_check', 'generate_scene']
+
+
+def measure(directory, module):
+    """
+    Imports `module` in a fresh interpreter started in `directory`.
+
+    Returns:
+        tuple: (wall seconds of the process, seconds spent importing as reported by -X importtime without site,
+        set of top-level packages imported)
+    """
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=os.path.join(ROOT, directory), capture_output=True, text=True,
+    )
+    wall = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr.strip().splitlines()[-1]}")
+    total, packages = 0, set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        packages.add(name.strip().split('.')[0])
+        # nested imports are indented, only the top-level ones add up to the total, site is interpreter startup
+        if not name.startswith('  ') and name.strip() != 'site':
+            total += int(cumulative)
+    return wall, total / 1e6, packages
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--targets', nargs='+', default=list(TARGETS), choices=list(TARGETS))
+    parser.add_argument('--repeat', type=int, default=5, help='runs per target, the median is reported')
+    parser.add_argument('--check', action='store_true', help='exit with an error if a symbolic module loads a heavy package')
+    args = parser.parse_args()
+
+    print(f"{'target':<18}{'wall ms':>10}{'import ms':>12}  heavy packages")
+    failed = []
+    for name in args.targets:
+        runs = [measure(*TARGETS[name]) for _ in range(args.repeat)]
+        heavy = sorted(runs[0][2] & HEAVY)
+        print(f"{name:<18}{statistics.median(r[0] for r in runs) * 1e3:>10.1f}{statistics.median(r[1] for r in runs) * 1e3:>12.1f}  {', '.join(heavy) or '-'}")
+        if name in SYMBOLIC and heavy:
+            failed.append(name)
+
+    if args.check and failed:
+        sys.exit(f"heavy packages imported by {', '.join(failed)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,41 +1,112 @@
-import os, sys
+import os
 import json
 import argparse
-# import google.generativeai as genai
-import PIL.Image
-from dotenv import load_dotenv
-from reason_engine import DrivingLogicEngine
+from reason_engine import DrivingLogicEngine, PRIORITIES_PATH
+import metrics
+import uploads
+import llm_client
+from reasoning_cache import ReasoningCache, canonical_hash
+from provenance import reasoning_path
+from json_stream import iter_items, ItemWriter
+from metrics import tracer
 
 it_check_example = {
     "it_check": "satisfied or unsatisfied based on the CORRECT intention",
     "explanation": "The ego car should stop, because the front car is too close to the ego car."
 }
 
-def generate(query, img, model_name):
+# intentions that cannot hold together with an action that tells the ego to go
+HALTING_INTENTIONS = {"stop", "park"}
+# the only actions that contradict an intention: explicit stops and explicit go-aheads.
+# Prohibitions ("not_enter_box_junction") demand neither
+STOP_PREFIX = "stop_"
+GO_ACTIONS = {"start", "move_off", "proceed", "proceed_to_turn_left", "proceed_to_turn_right"}
+# slowing down agrees with stopping and with moving on, so it neither covers nor contradicts an intention
+SLOWING_ACTIONS = {
+    "reduce_speed", "maintain_speed", "drive_carefully_and_slowly", "slow_down_and_not_overtaking",
+    "drive_at_slow speed_brake_and_accelerate_gently", "drive_at_slow_speed_brake_and_accelerate_gently",
+}
+# rule added when no other rule applies, it says nothing about the scene
+DEFAULT_RULE = '70'
+
+
+def generate(query, img, model, seg_id=None):
     try:
-        model = genai.GenerativeModel(model_name) 
-        response = model.generate_content([query, img])
-        clean_text = response.text.strip('`').lstrip('json\n')
-        return json.loads(clean_text)
+        with tracer.span('llm', seg_id, 'intention_check'):
+            response = model.generate_content([query, img])
+        with tracer.span('response_parse', seg_id, 'intention_check'):
+            clean_text = response.text.strip('`').lstrip('json\n')
+            return json.loads(clean_text)
 
     except Exception as e:
         print(f"An error occurred: {e}")
 
-def main():
 
-    # load_dotenv()
-    # os.getenv("GOOGLE_API_KEY")
-    # genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+def gate_intention(it, actions_to_take, it_relation, default_rule=DEFAULT_RULE):
+    """
+    Decides from the symbolic actions alone whether an intention needs a visual check. The
+    default rule says nothing about the scene and slowing actions fit any intention, both are ignored.
+
+    Returns:
+        str: 'covered' if an action is the intention or one of its synonyms, 'contradicted' if an
+        action explicitly stops the ego while it intends to move, or lets it go while it intends
+        to stop or park, otherwise 'check'.
+    """
+    actions = [d['action'] for d in actions_to_take if str(d['rule_id']) != str(default_rule) and d['action'] not in SLOWING_ACTIONS]
+    if any(action == it or action in it_relation.get(it, []) for action in actions):
+        return 'covered'
+    if it in HALTING_INTENTIONS:
+        opposite = any(action in GO_ACTIONS for action in actions)
+    else:
+        opposite = any(action.startswith(STOP_PREFIX) for action in actions)
+    return 'contradicted' if opposite else 'check'
+
+
+def gated_result(it, gate, action_list):
+    if gate == 'covered':
+        return {"it_check": "satisfied", "explanation": f"The intention {it} is covered by the symbolic actions {action_list}.", "gate": gate}
+    return {"it_check": "unsatisfied", "explanation": f"The intention {it} contradicts the symbolic actions {action_list}.", "gate": gate}
+
+
+def check_intentions(pending, img, model, seg_id=None):
+    # one request for all intentions of a segment that still need a visual check
+    with tracer.span('prompt_build', seg_id, 'intention_check'):
+        query = f"Please check if each of the original intentions {pending} of the ego car is satisfied based on the visual information from five continuous frames of a driving video. Please give the answer in json format, with one entry per intention, and each entry should include the answer ('satisfied' or 'unsatisfied') and the explanation. For example: {{{repr(pending[0])}: {it_check_example}}}"
+    it_result = generate(query, img, model, seg_id) # json
+    if not isinstance(it_result, dict):
+        it_result = {}
+    checks = {}
+    for it in pending:
+        check = it_result.get(it)
+        if not isinstance(check, dict):
+            check = {"it_check": None, "explanation": "No answer from the model."}
+        check["gate"] = 'check'
+        checks[it] = check
+    return checks
+
+def main():
 
     parser = argparse.ArgumentParser()
-    parser.add_argument('--save_it_path', type=str, default='result.json')
+    parser.add_argument('--save_it_path', type=str, default='result.json', help='JSON, or JSON lines when it ends with .jsonl')
     parser.add_argument('--intention_relation', type=str, default='synonym_action.json')
     parser.add_argument('--image_dir', default='../dataset/LingoQA/videos')
-    parser.add_argument('--scene', default='lingoqa_gtasd.json')
-    parser.add_argument('--rules', type=str, default='uk_rules.json')
+    parser.add_argument('--scene', default='lingoqa_gtasd.json', help='{segment_id: ASD} JSON, or JSON lines of such objects (.jsonl)')
+    parser.add_argument('--rules', type=str, nargs='+', default=['uk_rules.json'], help='one or more rulebooks, the first one drives actions_to_take and the intention check')
+    parser.add_argument('--priorities', type=str, nargs='+', default=[PRIORITIES_PATH], help="priority resolution of each --rules file in order, 'none' for none; rulebooks without an entry get none")
+    parser.add_argument('--vocabulary', type=str, default='../vocabulary.json')
     parser.add_argument('--verbose', action='store_true')
     parser.add_argument('--model_name', default="gemini-2.5-flash")
     parser.add_argument('--intention', type=bool, default=False)
+    parser.add_argument('--trace_path', type=str, default=None, help='append stage spans to this JSON-lines file')
+    parser.add_argument('--metrics_port', type=int, default=None, help='serve Prometheus metrics on this port')
+    parser.add_argument('--upload_registry', type=str, default=None, help='upload each image once and reuse the handles stored in this JSON file')
+    parser.add_argument('--upload_local_dir', type=str, default=None, help='use a local stand-in for the Files API, for offline runs')
+    parser.add_argument('--deadline', type=float, default=120.0, help='seconds before a model request is given up')
+    parser.add_argument('--stand_in', type=str, default=None, help='JSON options of a local stand-in model, e.g. \'{"slow_rate": 0.1, "fail_rate": 0.05}\'')
+    parser.add_argument('--cache', type=str, default=None, help='reuse the outputs of unchanged segments stored in this JSON file')
+    parser.add_argument('--reasoning_path', action='store_true', help='add the rules, conditions and ASD tuples behind every action, in the reasoning_path format of the experiments')
+    parser.add_argument('--resume', action='store_true', help='keep the segments a crashed run already wrote to <save_it_path>.partial and compute the rest')
+    parser.add_argument('--result_store', type=str, default=None, help='also append the results to this Parquet result store')
 
     args = parser.parse_args()
 
@@ -46,63 +117,129 @@ def main():
     image_dir = args.image_dir
     verbose = args.verbose
     model_name = args.model_name
-    rule_path = args.rules
+    rule_paths = args.rules
     intention = args.intention
+    vocab_path = args.vocabulary
+    metrics.configure(args.trace_path, args.metrics_port)
+    uploads.configure(args.upload_registry, args.upload_local_dir)
+    llm_client.configure(args.deadline, args.stand_in)
 
 
-    with open(scene_path, 'r') as f:
-        scenes = json.load(f)
     with open(intention_relation, 'r') as f:
         it_relation = json.load(f)
-    with open(rule_path, 'r') as f:
-        rules = json.load(f)
-    
-    key_intention_actions = [v for k, v in it_relation.items()]
-    key_intention = [k for k, v in it_relation.items()]
-    syno_actions = key_intention_actions + key_intention
-
-    engine = DrivingLogicEngine(rules, verbose)
-    result = {}
-    for seg_id, scene in scenes.items():
-        result[seg_id] = {}
-        actions_to_take, intend_action = engine.reasoning(seg_id, scene)
+    rulebooks = {}
+    for rule_path in rule_paths:
+        with open(rule_path, 'r') as f:
+            rulebooks[os.path.splitext(os.path.basename(rule_path))[0]] = json.load(f)
+    names = list(rulebooks)
+    rule_names = {int(rule['id']): rule.get('UKRuleid') for rule in rulebooks[names[0]]}
+
+    priorities = [None if p == 'none' else p for p in args.priorities]
+    # the UK priorities name UK rule ids, they must not leak into other rulebooks
+    priorities += [None] * (len(names) - len(priorities))
+    engine = DrivingLogicEngine(rulebooks[names[0]], verbose, vocabulary=vocab_path, rulebook=names[0], priorities=priorities[0])
+    for name, rulebook_priorities in zip(names[1:], priorities[1:]):
+        engine.add_rulebook(name, rulebooks[name], rulebook_priorities)
+    run = os.path.splitext(os.path.basename(save_it_path))[0]
+    writer = None
+    if args.result_store:
+        # pandas and pyarrow are only loaded for runs that write to the store
+        from result_store import ResultStore, BatchWriter
+        writer = BatchWriter(ResultStore(args.result_store), 'symbolic', names[0], run)
+
+    cache = None
+    if args.cache:
+        # outputs with an intention check also depend on the model and the synonym table
+        inputs = {'intention': model_name, 'relation': canonical_hash(it_relation)} if intention else None
+        if args.reasoning_path:
+            inputs = {**(inputs or {}), 'reasoning_path': True}
+        cache = ReasoningCache(args.cache, [engine.rules_hash(name, rule_names=args.reasoning_path) for name in names], inputs=inputs)
+
+    if intention:
+        model = llm_client.model(model_name) # reused for every segment
+
+    # scenes are parsed one at a time and every output goes straight to the sinks, memory stays flat
+    sink = ItemWriter(save_it_path, resume=args.resume)
+    if sink.done:
+        print(f"Resuming: {len(sink.done)} segments recovered from the previous run")
+    n_gated, n_requests = 0, 0
+    for seg_id, scene in iter_items(scene_path):
+        if seg_id in sink.done:
+            continue
+        cached = cache.get(seg_id, scene) if cache else None
+        if cached is not None:
+            sink.add(seg_id, cached)
+            if writer:
+                writer.add(seg_id, cached)
+            continue
+
+        result = {seg_id: {}}
+        if args.reasoning_path:
+            # explain() is reasoning() that also records the derivation, the first rulebook is not run twice
+            actions_to_take, intend_action, provenance = engine.explain(seg_id, scene, names[0])
+            if len(names) > 1:
+                by_rulebook = {names[0]: actions_to_take, **engine.reasoning_all(seg_id, scene, names[1:])[0]}
+        elif len(names) > 1:
+            by_rulebook, intend_action = engine.reasoning_all(seg_id, scene, names)
+            actions_to_take = by_rulebook[names[0]]
+        else:
+            actions_to_take, intend_action = engine.reasoning(seg_id, scene)
         action_list = [d['action'] for d in actions_to_take]
         it_list = list(intend_action)
-        # if len(it_list) > 1:
-        #     print(f'Process break due to multiple intentions!')
-        #     break
-        # find the key intention from intention_relation
-        # key_intention = [k for k, v in it_relation.items() if any(x in v for x in action_list)]
-        for it in it_list:
-            # if it not in action_list and it not in syno_actions:
-            if intention: 
+        result[seg_id]["actions_to_take"] = actions_to_take
+        result[seg_id]["intention"] = [i for i in it_list]
+        if len(names) > 1:
+            result[seg_id]["rulebooks"] = by_rulebook
+        if args.reasoning_path:
+            result[seg_id]["reasoning_path"] = reasoning_path(provenance, scene, rule_names)
+
+        if intention and it_list:
+            checks = {}
+            pending = []
+            for it in it_list:
+                gate = gate_intention(it, actions_to_take, it_relation)
+                if gate == 'check':
+                    pending.append(it)
+                else:
+                    checks[it] = gated_result(it, gate, action_list)
+                    n_gated += 1
+
+            if pending:
                 # check the if intention satisfied
                 video_name = seg_id + '.jpg'
                 video_path = os.path.join(image_dir, video_name)
                 try:
-                    img = PIL.Image.open(video_path)
+                    with tracer.span('image_load', seg_id, 'intention_check'):
+                        img = uploads.image_part(video_path)
                 except FileNotFoundError:
                     print(f"Error: The image file was not found at '{video_path}'.")
                     exit() 
                 # check with LLM
-                query = f"Please check if the original intention {it} of the ego car is satisfied based on the visual information from five continuous frames of a driving video. Please give the answer in json format and the result should include the answer ('satisfied' or 'unsatisfied') and the explanation. For example: {it_check_example}"
-                
-                it_result = generate(query, img, model_name) # json
-                # if it_result["it_check"] == "satisfied":
-                    # actions_to_take.append(it)
-                result[seg_id]["actions_to_take"] = actions_to_take
-                result[seg_id]["intention_check"] = it_result
-                result[seg_id]["intention_check"]["intention"] = [i for i in it_list]
-                
-            else:
-                result[seg_id]["actions_to_take"] = actions_to_take
-                result[seg_id]["intention"] = [i for i in it_list]
-
-            with open(save_it_path, "w") as f_log:
-                json.dump(result, f_log, indent=4)
-    
-
-
+                checks.update(check_intentions(pending, img, model, seg_id))
+                n_requests += 1
+
+            result[seg_id]["intention_check"] = checks
+
+        # a segment whose check got no answer is recomputed next time
+        if cache and all(c.get("it_check") is not None for c in result[seg_id].get("intention_check", {}).values()):
+            cache.put(seg_id, scene, result[seg_id])
+        with tracer.span('result_write', seg_id, 'symbolic'):
+            sink.add(seg_id, result[seg_id])
+        if writer:
+            writer.add(seg_id, result[seg_id])
+
+    if intention:
+        print(f"Intention check: {n_gated} intentions decided by the symbolic actions, {n_requests} LLM requests")
+    sink.close()
+    if cache:
+        cache.save()
+        cache.print_summary()
+    if writer:
+        writer.flush()
+    uploads.print_summary()
+    llm_client.print_summary()
+    tracer.print_summary()
+    tracer.close()
 
 
 if __name__ == '__main__':
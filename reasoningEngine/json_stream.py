@@ -0,0 +1,145 @@
+import os
+import json
+
+_WHITESPACE = ' \t\n\r'
+
+
+def _iter_object(f, chunk_size):
+    # (key, value) of a top-level JSON object, parsing one value at a time from a buffered text file
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = f.read(chunk_size)
+        if not chunk:
+            eof = True
+        buf = buf[pos:] + chunk
+        pos = 0
+
+    def skip():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        skip()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise ValueError(f"expected one of {chars!r} in {f.name}")
+        pos += 1
+        return buf[pos - 1]
+
+    def decode():
+        nonlocal pos
+        skip()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+            # a number may continue in the next chunk
+            if end == len(buf) and not eof:
+                fill()
+                continue
+            pos = end
+            return value
+
+    fill()
+    expect('{')
+    skip()
+    if pos < len(buf) and buf[pos] == '}':
+        return
+    while True:
+        key = decode()
+        expect(':')
+        yield key, decode()
+        if expect(',}') == '}':
+            return
+
+
+def iter_items(path, chunk_size=1 << 16, jsonl=None, truncated=False):
+    """
+    Yields (segment_id, value) from a {segment_id: value} JSON file or a JSON-lines file of
+    {segment_id: value} objects, without loading the whole file: only the value being parsed
+    and one chunk of text are held in memory.
+
+    Args:
+        jsonl (bool): JSON lines, None to tell from the ".jsonl" extension.
+        truncated (bool): stop after the last complete item instead of raising when the file is
+            cut short, as the stream of a run that crashed is.
+    """
+    if jsonl is None:
+        jsonl = path.endswith('.jsonl')
+    with open(path, 'r') as f:
+        if jsonl:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                except ValueError:
+                    if truncated:
+                        return
+                    raise
+                yield from item.items()
+        elif truncated:
+            try:
+                yield from _iter_object(f, chunk_size)
+            except ValueError:
+                return
+        else:
+            yield from _iter_object(f, chunk_size)
+
+
+class ItemWriter:
+
+    def __init__(self, path, resume=False):
+        """
+        Writes (segment_id, value) items as they come, as one JSON object with the layout of
+        json.dump(..., indent=4), or as JSON lines when path ends with .jsonl. Each item is
+        flushed after it is written, nothing but the file handle is kept.
+
+        Items go to "<path>.partial", which close() moves to `path`, so `path` is never left
+        half-written. With `resume`, the complete items of the partial stream a crashed run left
+        behind are copied first and their keys kept in `done`, for the caller to skip.
+        """
+        self.path = path
+        self.jsonl = path.endswith('.jsonl')
+        self.partial = f"{path}.partial"
+        self.count = 0
+        self.done = set()
+        # the stream being recovered, kept until its items are copied so a second crash loses nothing
+        resumed = f"{path}.resume"
+        if resume and not os.path.exists(resumed) and os.path.exists(self.partial):
+            os.replace(self.partial, resumed)
+        self.f = open(self.partial, 'w')
+        if not self.jsonl:
+            self.f.write('{')
+        if resume and os.path.exists(resumed):
+            for key, value in iter_items(resumed, jsonl=self.jsonl, truncated=True):
+                self.add(key, value)
+                self.done.add(key)
+            os.remove(resumed)
+
+    def add(self, key, value):
+        if self.jsonl:
+            self.f.write(json.dumps({key: value}) + '\n')
+        else:
+            text = json.dumps(value, indent=4).replace('\n', '\n    ')
+            self.f.write(f"{',' if self.count else ''}\n    {json.dumps(key)}: {text}")
+        self.count += 1
+        self.f.flush()
+
+    def close(self):
+        if not self.jsonl:
+            self.f.write('\n}' if self.count else '}')
+        self.f.close()
+        os.replace(self.partial, self.path)
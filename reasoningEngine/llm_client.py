@@ -0,0 +1,276 @@
+import os
+import json
+import time
+import random
+import threading
+from collections import deque
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+
+def spawn(fn, *args, **kwargs):
+    # runs fn in a daemon thread, so an abandoned request never holds up interpreter exit
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class CircuitBreaker:
+
+    def __init__(self, window=20, threshold=0.5, min_calls=5, cooldown=30.0, probe_timeout=120.0):
+        """
+        Pauses dispatch when too many recent requests failed.
+
+        The breaker opens when at least `threshold` of the last `window` requests (and at least
+        `min_calls`) failed. While open, before_call() sleeps until `cooldown` seconds have passed,
+        then admits a single probe request half-open and holds the others back until it is
+        recorded: its success closes the breaker, its failure opens it again. A probe that records
+        nothing within `probe_timeout` seconds (e.g. it was cancelled) counts as failed.
+        """
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self.probe_timeout = probe_timeout
+        self.lock = threading.Condition()
+        self.results = deque(maxlen=window)
+        self.state = 'closed'
+        self.opened_at = None
+        self.opened = 0
+        # number of the current probe, a late result of an earlier one does not decide
+        self.probe = 0
+        self.probe_started = None
+
+    def before_call(self):
+        """
+        Returns:
+            int: the probe number for the half-open probe, whose result must be recorded with
+            record(ok, probe), else 0.
+        """
+        with self.lock:
+            while True:
+                if self.state == 'closed':
+                    return 0
+                if self.state == 'half_open':
+                    remaining = self.probe_started + self.probe_timeout - time.monotonic()
+                    if remaining > 0:
+                        self.lock.wait(remaining)
+                    else:
+                        self.open()
+                        self.lock.notify_all()
+                    continue
+                pause = self.opened_at + self.cooldown - time.monotonic()
+                if pause > 0:
+                    self.lock.wait(pause)
+                    continue
+                self.state = 'half_open'
+                self.probe += 1
+                self.probe_started = time.monotonic()
+                return self.probe
+
+    def record(self, ok, probe=0):
+        with self.lock:
+            self.results.append(ok)
+            if self.state == 'half_open':
+                # requests sent before the breaker opened do not decide, only the current probe does
+                if probe and probe == self.probe:
+                    if ok:
+                        self.state = 'closed'
+                        self.results.clear()
+                    else:
+                        self.open()
+                    self.lock.notify_all()
+                return
+            failures = self.results.count(False)
+            if self.state == 'closed' and len(self.results) >= self.min_calls and failures >= self.threshold * len(self.results):
+                self.open()
+                print(f"Circuit open: {failures} of the last {len(self.results)} requests failed, pausing dispatch for {self.cooldown}s")
+
+    def open(self):
+        # called with the lock held
+        self.state = 'open'
+        self.opened_at = time.monotonic()
+        self.opened += 1
+
+
+class HedgedModel:
+
+    def __init__(self, model, deadline=120.0, hedge_quantile=0.95, initial_hedge_delay=30.0, min_samples=5, breaker=None):
+        """
+        Wraps a model with generate_content(contents) in a per-request deadline, one hedged
+        duplicate request and a circuit breaker.
+
+        The duplicate is sent once the first request has been running longer than the
+        `hedge_quantile` latency of recent successful requests (initial_hedge_delay until
+        `min_samples` are known), or right away when the first request fails while the breaker
+        is closed. The first
+        successful response wins; the other request keeps running in its daemon thread and
+        its result is dropped.
+
+        Raises:
+            TimeoutError: no response within `deadline` seconds.
+        """
+        self.model = model
+        self.deadline = deadline
+        self.hedge_quantile = hedge_quantile
+        self.initial_hedge_delay = initial_hedge_delay
+        self.min_samples = min_samples
+        # a probe gets as long as any request before it counts as failed
+        self.breaker = breaker or CircuitBreaker(probe_timeout=deadline)
+        self.latencies = deque(maxlen=200)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.timeouts = 0
+        self.failures = 0
+
+    def hedge_delay(self):
+        with self.lock:
+            values = sorted(self.latencies)
+        if len(values) < self.min_samples:
+            return min(self.initial_hedge_delay, self.deadline / 2)
+        return values[min(len(values) - 1, int(self.hedge_quantile * len(values)))]
+
+    def submit(self, contents, kwargs):
+        return spawn(self.model.generate_content, contents, **kwargs)
+
+    def generate_content(self, contents, **kwargs):
+        probe = self.breaker.before_call()
+        start = time.monotonic()
+        deadline = start + self.deadline
+        hedge_at = start + self.hedge_delay()
+        with self.lock:
+            self.requests += 1
+        attempts = [self.submit(contents, kwargs)]
+        error = None
+        while True:
+            pending = [f for f in attempts if not f.done()]
+            failed = [f for f in attempts if f.done() and f.exception() is not None]
+            for i, f in enumerate(attempts):
+                if f.done() and f.exception() is None:
+                    with self.lock:
+                        self.latencies.append(time.monotonic() - start)
+                        self.hedge_wins += i
+                    self.breaker.record(True, probe)
+                    return f.result()
+            if failed:
+                error = failed[-1].exception()
+            now = time.monotonic()
+            # a failed first request is retried at once, unless the breaker is already counting failures
+            if len(attempts) == 1 and (now >= hedge_at or (failed and self.breaker.state == 'closed')):
+                attempts.append(self.submit(contents, kwargs))
+                with self.lock:
+                    self.hedged += 1
+                continue
+            if not pending or now >= deadline:
+                break
+            wake = deadline if len(attempts) > 1 else min(hedge_at, deadline)
+            wait(pending, timeout=max(0.0, wake - now), return_when=FIRST_COMPLETED)
+
+        self.breaker.record(False, probe)
+        with self.lock:
+            if any(not f.done() for f in attempts):
+                self.timeouts += 1
+            else:
+                self.failures += 1
+        if any(not f.done() for f in attempts):
+            raise TimeoutError(f"no response within {self.deadline}s")
+        raise error
+
+    def summary(self):
+        return {
+            'requests': self.requests, 'hedged': self.hedged, 'hedge_wins': self.hedge_wins,
+            'timeouts': self.timeouts, 'failures': self.failures, 'breaker_opened': self.breaker.opened,
+            'hedge_delay': self.hedge_delay(),
+        }
+
+
+class LocalResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class LocalModel:
+
+    def __init__(self, text='{}', latency=0.05, slow_rate=0.0, slow_latency=5.0, fail_rate=0.0, seed=None):
+        """
+        Local stand-in for a Gemini model: answers `text` (or text(contents) if callable) after
+        `latency` seconds, takes `slow_latency` for a `slow_rate` share of requests and raises
+        for a `fail_rate` share.
+        """
+        self.text = text
+        self.latency = latency
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.fail_rate = fail_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def generate_content(self, contents, **kwargs):
+        with self.lock:
+            self.calls += 1
+            draw = self.random.random()
+        if draw < self.fail_rate:
+            time.sleep(self.latency)
+            raise RuntimeError("stand-in failure")
+        time.sleep(self.slow_latency if draw < self.fail_rate + self.slow_rate else self.latency)
+        return LocalResponse(self.text(contents) if callable(self.text) else self.text)
+
+
+# shared by the scripts of one process
+settings = {'deadline': 120.0, 'stand_in': None}
+models = {}
+
+
+def configure(deadline=120.0, stand_in=None):
+    """
+    Args:
+        deadline (float): seconds before a request is given up.
+        stand_in (str): JSON keyword arguments for LocalModel, e.g. '{"slow_rate": 0.1, "fail_rate": 0.05}',
+            used instead of the Gemini API.
+    """
+    settings['deadline'] = deadline
+    settings['stand_in'] = json.loads(stand_in) if isinstance(stand_in, str) else stand_in
+    models.clear()
+
+
+def gemini():
+    # google.generativeai with the API key from the environment or .env, imported on first use only
+    import google.generativeai as genai
+    if not settings.get('api_configured'):
+        from dotenv import load_dotenv
+        load_dotenv()
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        settings['api_configured'] = True
+    return genai
+
+
+def model(model_name):
+    # one hedged model per name, so the latency window and the breaker carry across requests
+    if model_name not in models:
+        if settings['stand_in'] is not None:
+            base = LocalModel(**settings['stand_in'])
+        else:
+            base = gemini().GenerativeModel(model_name)
+        models[model_name] = HedgedModel(base, deadline=settings['deadline'])
+    return models[model_name]
+
+
+def print_summary(printer=print):
+    for name, m in models.items():
+        s = m.summary()
+        printer(
+            f"LLM {name}: {s['requests']} requests, {s['hedged']} hedged ({s['hedge_wins']} won by the hedge), "
+            f"{s['timeouts']} timeouts, {s['failures']} failures, breaker opened {s['breaker_opened']}x, "
+            f"hedge delay {s['hedge_delay']:.2f}s"
+        )
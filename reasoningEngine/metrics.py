@@ -0,0 +1,188 @@
+import json
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+STAGES = [
+    'image_load', 'prompt_build', 'llm', 'response_parse', 'vocab_validation',
+    'fact_building', 'rule_matching', 'priority_resolution', 'result_write',
+]
+
+# histogram bucket upper bounds in seconds, from sub-millisecond matching to slow LLM calls
+BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120]
+
+
+class Tracer:
+
+    def __init__(self, jsonl_path=None, window=10000):
+        """
+        Records timed spans per pipeline stage.
+
+        Every span carries a segment id and a strategy. Spans are appended to a JSON-lines file
+        when jsonl_path is set, and aggregated in memory into per (stage, strategy) histograms
+        and a window of recent durations for p50/p99.
+
+        Args:
+            jsonl_path (str): file the spans are appended to, None to keep them in memory only.
+            window (int): number of recent durations kept per (stage, strategy) for quantiles.
+        """
+        self.lock = threading.Lock()
+        self.window = window
+        self.jsonl = None
+        self.server = None
+        self.open(jsonl_path)
+        self.reset()
+
+    def open(self, jsonl_path):
+        if self.jsonl:
+            self.jsonl.close()
+        self.jsonl = open(jsonl_path, 'a', encoding='utf-8') if jsonl_path else None
+
+    def reset(self):
+        with self.lock:
+            self.durations = {}
+            self.counts = {}
+            self.sums = {}
+            self.errors = {}
+
+    @contextmanager
+    def span(self, stage, segment_id=None, strategy=None, **attrs):
+        start = time.time()
+        t0 = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(stage, time.perf_counter() - t0, segment_id, strategy, start=start, error=error, **attrs)
+
+    def record(self, stage, seconds, segment_id=None, strategy=None, start=None, error=False, **attrs):
+        key = (stage, strategy)
+        with self.lock:
+            if key not in self.counts:
+                self.durations[key] = deque(maxlen=self.window)
+                self.counts[key] = [0] * (len(BUCKETS) + 1)
+                self.sums[key] = 0.0
+                self.errors[key] = 0
+            self.durations[key].append(seconds)
+            self.counts[key][bisect_left(BUCKETS, seconds)] += 1
+            self.sums[key] += seconds
+            self.errors[key] += int(error)
+            if self.jsonl:
+                line = {
+                    'ts': start if start is not None else time.time() - seconds,
+                    'stage': stage, 'segment_id': segment_id, 'strategy': strategy,
+                    'duration_ms': round(seconds * 1000, 4), 'error': error,
+                }
+                line.update(attrs)
+                self.jsonl.write(json.dumps(line) + '\n')
+                self.jsonl.flush()
+
+    def quantile(self, stage, q, strategy=None):
+        with self.lock:
+            values = sorted(self.durations.get((stage, strategy), []))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def summary(self):
+        """
+        Returns:
+            dict: (stage, strategy) -> count, errors, total, p50 and p99 in seconds.
+        """
+        with self.lock:
+            keys = list(self.counts)
+        order = {s: i for i, s in enumerate(STAGES)}
+        keys.sort(key=lambda k: (order.get(k[0], len(STAGES)), k[0], str(k[1])))
+        return {
+            key: {
+                'count': sum(self.counts[key]),
+                'errors': self.errors[key],
+                'total': self.sums[key],
+                'p50': self.quantile(key[0], 0.5, key[1]),
+                'p99': self.quantile(key[0], 0.99, key[1]),
+            }
+            for key in keys
+        }
+
+    def print_summary(self, printer=print):
+        printer(f"{'stage':<22}{'strategy':<18}{'count':>8}{'p50 ms':>12}{'p99 ms':>12}{'total s':>10}")
+        for (stage, strategy), s in self.summary().items():
+            printer(f"{stage:<22}{str(strategy):<18}{s['count']:>8}{s['p50'] * 1000:>12.3f}{s['p99'] * 1000:>12.3f}{s['total']:>10.2f}")
+
+    def prometheus_text(self):
+        # Prometheus text exposition format: one histogram and p50/p99 gauges per (stage, strategy)
+        lines = [
+            '# HELP pipeline_stage_seconds Duration of neuro-symbolic pipeline stages.',
+            '# TYPE pipeline_stage_seconds histogram',
+        ]
+        quantiles = [
+            '# HELP pipeline_stage_quantile_seconds Recent p50/p99 duration of pipeline stages.',
+            '# TYPE pipeline_stage_quantile_seconds gauge',
+        ]
+        errors = [
+            '# HELP pipeline_stage_errors_total Spans that ended with an exception.',
+            '# TYPE pipeline_stage_errors_total counter',
+        ]
+        for (stage, strategy), s in self.summary().items():
+            labels = f'stage="{stage}",strategy="{strategy or ""}"'
+            with self.lock:
+                counts = list(self.counts[(stage, strategy)])
+            cumulative = 0
+            for bound, n in zip(BUCKETS, counts):
+                cumulative += n
+                lines.append(f'pipeline_stage_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'pipeline_stage_seconds_bucket{{{labels},le="+Inf"}} {s["count"]}')
+            lines.append(f'pipeline_stage_seconds_sum{{{labels}}} {s["total"]}')
+            lines.append(f'pipeline_stage_seconds_count{{{labels}}} {s["count"]}')
+            quantiles.append(f'pipeline_stage_quantile_seconds{{{labels},quantile="0.5"}} {s["p50"]}')
+            quantiles.append(f'pipeline_stage_quantile_seconds{{{labels},quantile="0.99"}} {s["p99"]}')
+            errors.append(f'pipeline_stage_errors_total{{{labels}}} {s["errors"]}')
+        return '\n'.join(lines + quantiles + errors) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        # /metrics endpoint on a daemon thread, for Prometheus to scrape during a run
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') != '/metrics':
+                    self.send_error(404)
+                    return
+                body = tracer.prometheus_text().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+    def close(self):
+        if self.server:
+            self.server.shutdown()
+            self.server = None
+        if self.jsonl:
+            self.jsonl.close()
+            self.jsonl = None
+
+
+# shared by the engine and the scripts of one process
+tracer = Tracer()
+
+
+def configure(jsonl_path=None, port=None):
+    tracer.open(jsonl_path)
+    if port:
+        tracer.serve(port)
+    return tracer
@@ -0,0 +1,45 @@
+import re
+
+# word pieces, digit runs and single symbols, roughly how BPE tokenizers split prompt text
+_PIECE = re.compile(r"[A-Za-z]+|\d+|[^\sA-Za-z\d]")
+
+
+def _unique(items):
+    return list(dict.fromkeys(items))
+
+
+def encode_vocabulary(vocabulary, prefix=''):
+    """
+    Compact prompt encoding of vocabulary.json: one line per list, nested sections joined
+    with '.', items separated by '|', in file order with duplicates dropped.
+
+    "road user.vehicle: car|van" replaces the repr {'road user': {'vehicle': ['car', 'van'], ...}}.
+    The output only depends on the vocabulary, so every prompt gets the same bytes.
+    """
+    lines = []
+    for key, value in vocabulary.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            lines.append(encode_vocabulary(value, f"{name}."))
+        elif isinstance(value, list):
+            lines.append(f"{name}: {'|'.join(_unique(str(v) for v in value))}")
+        else:
+            lines.append(f"{name}: {value}")
+    return '\n'.join(lines)
+
+
+def encode_rules(rules):
+    """
+    Compact prompt encoding of a rules json: a header line, then one line per rule
+    "id|UKRuleid|action|condition; condition". Conditions keep their "subject, relation, object" text
+    so the model can quote them in reasoning paths.
+    """
+    lines = ['id|UKRuleid|action|conditions']
+    for rule in rules:
+        lines.append(f"{rule['id']}|{rule.get('UKRuleid', '')}|{rule['action']}|{'; '.join(rule['conditions'])}")
+    return '\n'.join(lines)
+
+
+def estimate_tokens(text):
+    # approximate token count, long words count one token per 6 letters
+    return sum(1 + (len(p) - 1) // 6 for p in _PIECE.findall(text))
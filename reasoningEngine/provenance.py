@@ -0,0 +1,107 @@
+from array import array
+
+ASD_KEYS = ('situation', 'control_device', 'road_user', 'intention')
+
+# how an action came about: a rule expansion, a 'derived' action or the 'default' one of the rulebook's priorities
+MATCHED, DERIVED, DEFAULT = 0, 1, 2
+
+
+def asd_tuples(scene):
+    # the ASD tuples in the order source ids count them
+    return [t for key in ASD_KEYS for t in scene.get(key, [])]
+
+
+class Provenance:
+
+    __slots__ = ('rule_ids', 'actions', 'kinds', 'axiom_start', 'axiom_ids', 'source_start', 'source_ids', 'suppressed', 'relations', 'conditions', 'priority_facts')
+
+    def __init__(self, conditions, priority_facts=()):
+        """
+        Derivation of the actions of one scene, in CSR form like RuleIndex.
+
+        Action i is actions[i] of rule rule_ids[i], derived as kinds[i] (MATCHED, DERIVED or
+        DEFAULT). Its conditions are axiom_ids[axiom_start[i]:axiom_start[i+1]], ~id for a negated
+        one. For DERIVED they index priority_facts instead of the axiom table. The ASD tuples
+        behind them are source_ids[source_start[i]:source_start[i+1]], positions in
+        asd_tuples(scene). suppressed holds (relations index, winning rule, suppressed rule) triples.
+
+        Args:
+            conditions (dict): id -> axiom condition string of the rulebook, shared, not copied.
+            priority_facts (tuple): the 'facts' of the rulebook's priorities, shared, not copied.
+        """
+        self.rule_ids = array('i')
+        self.actions = []
+        self.kinds = array('b')
+        self.axiom_start = array('i', [0])
+        self.axiom_ids = array('i')
+        self.source_start = array('i', [0])
+        self.source_ids = array('i')
+        self.suppressed = array('i')
+        self.relations = []
+        self.conditions = conditions
+        self.priority_facts = priority_facts
+
+    def add(self, rule_id, action, kind, axiom_ids, source_ids):
+        self.rule_ids.append(int(rule_id))
+        self.actions.append(action)
+        self.kinds.append(kind)
+        self.axiom_ids.extend(axiom_ids)
+        self.axiom_start.append(len(self.axiom_ids))
+        self.source_ids.extend(sorted(set(source_ids)))
+        self.source_start.append(len(self.source_ids))
+
+    def suppress(self, relation, by_rule, rule_id):
+        if relation not in self.relations:
+            self.relations.append(relation)
+        self.suppressed.extend((self.relations.index(relation), int(by_rule), int(rule_id)))
+
+    def __len__(self):
+        return len(self.rule_ids)
+
+    def condition_strings(self, i):
+        strings = []
+        for cid in self.axiom_ids[self.axiom_start[i]:self.axiom_start[i + 1]]:
+            if self.kinds[i] == DERIVED:
+                strings.append(self.priority_facts[cid])
+            elif cid < 0:
+                strings.append(f'not {self.conditions[~cid]}')
+            else:
+                strings.append(self.conditions[cid])
+        return strings
+
+    def sources(self, i):
+        return list(self.source_ids[self.source_start[i]:self.source_start[i + 1]])
+
+
+def reasoning_path(provenance, scene=None, rule_names=None):
+    """
+    Renders a Provenance as the "reasoning_path" list the experiments ask the models for:
+    {"UKRuleid": "Rule X", "id": N, "conditions": [...], "action": "..."} per action, plus
+    "sources" (the ASD tuples) when the scene is given and "suppressed" (the rules it overrides).
+
+    Args:
+        scene (dict): the ASD the provenance was built from.
+        rule_names (dict): rule id -> UKRuleid.
+    """
+    tuples = asd_tuples(scene) if scene is not None else None
+    rule_names = rule_names or {}
+    suppressed = {}
+    triples = provenance.suppressed
+    for k in range(0, len(triples), 3):
+        suppressed.setdefault(triples[k + 1], []).append({'id': triples[k + 2], 'by': provenance.relations[triples[k]]})
+
+    path = []
+    for i in range(len(provenance)):
+        rule_id = provenance.rule_ids[i]
+        step = {
+            'UKRuleid': rule_names.get(rule_id),
+            'id': rule_id,
+            'conditions': provenance.condition_strings(i),
+            'action': provenance.actions[i],
+        }
+        if tuples is not None:
+            step['sources'] = [tuples[s] for s in provenance.sources(i)]
+        if rule_id in suppressed:
+            step['suppressed'] = suppressed.pop(rule_id)
+        path.append(step)
+    return path
@@ -1,44 +1,200 @@
 from itertools import product
 import os
-import argparse
 import json
-import re
+import hashlib
 import logging
 import sys
+import threading
 from datetime import datetime
+from rule_index import RuleIndex
+from provenance import Provenance, MATCHED, DERIVED, DEFAULT
+from metrics import tracer
+
+VOCABULARY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'vocabulary.json')
+# priority resolution of uk_rules.json, other rulebooks bring their own
+PRIORITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uk_priorities.json')
+
+# bumped whenever fact building, matching or priority resolution changes the outputs for the same rules
+ENGINE_VERSION = '4'
+
+# a rule condition "not road_user, status, overtake_ego" holds when the fact is absent (negation as failure)
+NEGATION = 'not '
+
+
+def split_condition(condition):
+    # expanded condition -> (positive atoms, negated atoms without the prefix)
+    positive = [c for c in condition if not c.startswith(NEGATION)]
+    negative = [c[len(NEGATION):] for c in condition if c.startswith(NEGATION)]
+    return positive, negative
+
+
+class Taxonomy:
+
+    def __init__(self, hierarchy, root):
+        """
+        Class hierarchy as a DAG, with the ancestor closure of every class stored as a bitset.
+
+        Args:
+            hierarchy (dict | list): nested dicts (class -> subclasses) and lists (leaf classes),
+                as in vocabulary.json["road user"]. A class may appear under several parents.
+            root (str): name of the top class.
+        """
+        self.parents = {}
+        self.add_class(root)
+        self.add_children(root, hierarchy)
+
+        self.classes = list(self.parents)
+        self.index = {c: i for i, c in enumerate(self.classes)}
+
+        # ancestors[c] has the bit of c and of every class above it
+        self.ancestors = {}
+        for c in self.classes:
+            self.closure(c, set())
+
+        self.descendants = {
+            c: [d for d in self.classes if self.is_a(d, c)] for c in self.classes
+        }
+
+    @classmethod
+    def from_vocabulary(cls, vocabulary=VOCABULARY_PATH, section="road user"):
+        if isinstance(vocabulary, str):
+            with open(vocabulary, 'r') as f:
+                vocabulary = json.load(f)
+        return cls(vocabulary[section], section.replace(' ', '_'))
+
+    def add_class(self, name, parent=None):
+        parents = self.parents.setdefault(name, set())
+        if parent is not None:
+            parents.add(parent)
+
+    def add_children(self, parent, children):
+        if isinstance(children, dict):
+            for name, grandchildren in children.items():
+                self.add_class(name, parent)
+                self.add_children(name, grandchildren)
+        elif isinstance(children, list):
+            for item in children:
+                if isinstance(item, str):
+                    self.add_class(item, parent)
+                else:
+                    self.add_children(parent, item)
+        elif isinstance(children, str):
+            self.add_class(children, parent)
+
+    def closure(self, name, visiting):
+        if name in self.ancestors:
+            return self.ancestors[name]
+        if name in visiting:
+            raise ValueError(f"Cycle in taxonomy at '{name}'")
+        visiting.add(name)
+        bits = 1 << self.index[name]
+        for parent in self.parents[name]:
+            bits |= self.closure(parent, visiting)
+        self.ancestors[name] = bits
+        return bits
+
+    def is_a(self, name, general):
+        # "name is a kind of general", every class is a kind of itself
+        if name not in self.index or general not in self.index:
+            return name == general
+        return bool(self.ancestors[name] >> self.index[general] & 1)
+
+    def as_dict(self):
+        # general class -> all classes it covers, only for classes that have subclasses
+        return {c: d for c, d in self.descendants.items() if len(d) > 1}
+
+
+def load_priorities(priorities):
+    """
+    Priority resolution of one rulebook, applied after matching:
+
+    - 'derived': actions {"rule_id", "action"} added when one of the "any" facts (if given) and
+      all of the "all" facts hold;
+    - 'default': the action added when none of the "unless" rules fired;
+    - 'overrides': when one of the "winners" rules fired, the "losers" rules are dropped.
+
+    Args:
+        priorities (str | dict | None): JSON path or content, None for no priority resolution.
+
+    Returns:
+        dict: the same with rule id sets, plus 'facts', the facts it reads in a fixed order.
+    """
+    if isinstance(priorities, str):
+        with open(priorities, 'r') as f:
+            priorities = json.load(f)
+    priorities = priorities or {}
+    derived = [
+        {'rule_id': str(d['rule_id']), 'action': d['action'], 'any': list(d.get('any', [])), 'all': list(d.get('all', []))}
+        for d in priorities.get('derived', [])
+    ]
+    default = priorities.get('default')
+    if default:
+        default = {'rule_id': str(default['rule_id']), 'action': default['action'], 'unless': {int(i) for i in default.get('unless', [])}}
+    overrides = [
+        {'name': o['name'], 'winners': {int(i) for i in o['winners']}, 'losers': {int(i) for i in o['losers']}}
+        for o in priorities.get('overrides', [])
+    ]
+    facts = tuple(sorted({f for d in derived for f in d['any'] + d['all']}))
+    return {'derived': derived, 'default': default, 'overrides': overrides, 'facts': facts}
+
 
 class DrivingLogicEngine:
 
-    def __init__(self, rules, verbose):
+    def __init__(self, rules, verbose, prune=True, vocabulary=VOCABULARY_PATH, rulebook='default', priorities=PRIORITIES_PATH, log_dir='logs'):
         """
         Initializes the engine with a list of taxonomy and rules.
 
+        Further rulebooks can be compiled next to the first one with add_rulebook(). All rulebooks
+        share one axiom table, so reasoning_all() builds the facts of a scene once and matches
+        them against every rulebook.
+
         Args:
-            taxonomy (dict[str, list[str]]): A list of dictionaries 
             rules: Read from json file.
+            prune (bool): Drop repeated expansions of the same rule at compile time. Unreachable,
+                duplicate and subsumed expansions are only reported, they stay in the index.
+            vocabulary (str | dict): vocabulary.json path or content, the road user classes form the taxonomy
+                and its slots decide which facts a scene can produce.
+            rulebook (str): name of the rulebook compiled from `rules`, used by reasoning().
+            priorities (str | dict | None): priority resolution of `rules`, see load_priorities().
+                The default is the one of uk_rules.json.
+            log_dir (str | None): directory of the per-run log file, None for an engine that logs
+                nothing and leaves the root logger alone, e.g. inside other scripts.
         """
-        self.taxonomy = {
-        "road_user": ["road_user", "car", "van", "bus", "truck", "motorcyclist", "cyclist", "pedestrian", "scooter"], 
-        "vehicle": ["vehicle", "car","van"], 
-        "large_vehicle": ["large_vehicle", "bus", "truck"],
-        "vulnerable_road_user": ["vulnerable_road_user", "cyclist", "motorcyclist", "pedestrian", "scooter"]
-} 
+        if isinstance(vocabulary, str):
+            with open(vocabulary, 'r') as f:
+                vocabulary = json.load(f)
+        self.class_hierarchy = Taxonomy.from_vocabulary(vocabulary)
+        self.fact_slots = self.vocabulary_slots(vocabulary)
+        self.taxonomy = self.class_hierarchy.as_dict()
         self.rules = rules 
-        self.organise()
+        self.prune = prune
+        self.rulebook = rulebook
+        self.rulebooks = {}
+        self.axiom_table = {}
+        self.reload_lock = threading.Lock()
+        self.organise(priorities=load_priorities(priorities))
         self.verbose = verbose
 
         # self.model_name = model_name
+        self.log_dir = log_dir
         self.logger, self.log_filepath = self.setup_logging()
      
         # if self.verbose:
         self.print_axiom_conditions()
         self.print_rules()
+        self.print_rule_analysis()
 
     def setup_logging(self):
+        if self.log_dir is None:
+            logger = logging.getLogger(f"{__name__}.{id(self)}")
+            logger.addHandler(logging.NullHandler())
+            logger.propagate = False
+            return logger, None
+
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         log_filename = f"{timestamp}.log"
         
-        log_dir = "logs"
+        log_dir = self.log_dir
         if not os.path.exists(log_dir):
             os.makedirs(log_dir)
         
@@ -67,14 +223,19 @@ class DrivingLogicEngine:
             
         return logger, log_filepath
 
-    def infer_actions(self, facts):
-        ans = []
+    def infer_actions(self, facts, scene_id=None, rulebook=None):
+        # one snapshot for the whole call, a concurrent reload swaps the compiled rulebook
+        compiled = self.rulebooks[rulebook or self.rulebook]
+        fact_cond = self.fact_ids(facts, compiled['axiom_condition_id'])
+        return self.match_rules(fact_cond, facts, compiled, scene_id)
+
+    def fact_ids(self, facts, axiom_condition_id):
         fact_cond = []
         for fact in facts: 
-            if fact in self.axiom_condition_id:
-                fact_cond.append(self.axiom_condition_id[fact])
+            if fact in axiom_condition_id:
+                fact_cond.append(axiom_condition_id[fact])
                 if self.verbose:
-                    self.logger.info(f"({fact})\t as axiom condition id {self.axiom_condition_id[fact]}")
+                    self.logger.info(f"({fact})\t as axiom condition id {axiom_condition_id[fact]}")
             elif self.verbose:
                 self.logger.info(f"({fact})\t\t not in axiom condition id list")
         self.fact_cond = fact_cond
@@ -82,121 +243,334 @@ class DrivingLogicEngine:
 
         if self.verbose:
             self.logger.info(f"\nFact conditions ids: {fact_cond}\n")
+        return fact_cond
 
-        action_dict_list = [self.rule_dict]
-        
-        # print('***start to search action***')
-        for fact_id in fact_cond:
-            # print(fact_id)
-            for d in action_dict_list:
-                if fact_id in d:
-                    action_dict_list.append(d[fact_id])
-        
-        for d in action_dict_list:
-            if 'action' in d:
-                ans.append(d)
+    def match_rules(self, fact_cond, facts, compiled, scene_id=None, strategy='symbolic'):
+        ans = []
+        with tracer.span('rule_matching', scene_id, strategy):
+            for rule_id, action in compiled['rule_index'].match(fact_cond):
+                ans.append({'rule_id': rule_id, 'action': action})
 
-        # if 'ego, at, junction' in facts and 
-        if ('traffic_light, was, red' in facts or 'traffic_light, was, amber' in facts) and 'traffic_light, is, green' in facts:
-            ans.append({'rule_id': '58', 'action': 'start'})
-        
-        # Hierachy
-        # the following rules have higher hierachy than rule 55: maintain speed
-        over_55 = {1,2,3,4,5,6,7,8,12,16,24,25,27,28,32,33,44,45,46,47,48,49,50,51,52,53,54, 58, 63}
-        
-        fired_rule = set([int(i['rule_id']) for i in ans])
+        with tracer.span('priority_resolution', scene_id, strategy):
+            ans = self.resolve_priorities(ans, facts, compiled['priorities'])
 
-        if len(over_55 & fired_rule) == 0:
-            ans.append({'rule_id': '70', 'action': 'maintain_speed'})
+        return ans
 
-        setA = {1, 8, 19, 20} # stop by traffic light
-        setB = {2, 14, 15, 16, 17, 37, 38} # proceed with turning light
+    def resolve_priorities(self, ans, facts, priorities, provenance=None):
+        # facts only needs `in`, any container of the priority facts that hold will do
+        # provenance, a Provenance, gets the (relation, winning rule, suppressed rule) of every override,
+        # and the actions added here are tagged with their 'kind' for explain()
+        for derived in priorities['derived']:
+            if (not derived['any'] or any(f in facts for f in derived['any'])) and all(f in facts for f in derived['all']):
+                item = {'rule_id': derived['rule_id'], 'action': derived['action']}
+                if provenance is not None:
+                    item.update(kind=DERIVED, derived=derived)
+                ans.append(item)
 
-        if any(int(item.get('rule_id')) in setA for item in ans):
-            ans = [item for item in ans if int(item.get('rule_id')) not in setB]
+        # Hierachy
+        fired_rule = set([int(i['rule_id']) for i in ans])
+
+        default = priorities['default']
+        if default and len(default['unless'] & fired_rule) == 0:
+            item = {'rule_id': default['rule_id'], 'action': default['action']}
+            if provenance is not None:
+                item['kind'] = DEFAULT
+            ans.append(item)
+        elif default and provenance is not None:
+            for rule_id in sorted(default['unless'] & fired_rule):
+                provenance.suppress('OVER_DEFAULT', rule_id, default['rule_id'])
+
+        for override in priorities['overrides']:
+            if any(int(item.get('rule_id')) in override['winners'] for item in ans):
+                if provenance is not None:
+                    winners = sorted(override['winners'] & fired_rule)
+                    for item in ans:
+                        if int(item['rule_id']) in override['losers']:
+                            for rule_id in winners:
+                                provenance.suppress(override['name'], rule_id, item['rule_id'])
+                ans = [item for item in ans if int(item.get('rule_id')) not in override['losers']]
 
-        
-                
         return ans
     
 
-    def organise(self):
-        axiom_conditions = set()
-        conditions_action = {}
-
-        self.rule_dict = {}
-        self.action_conditions = {}
-
-        # ---------- taxonomy expansion ----------
-        for rule in self.rules:
-            rule_id = int(rule['id'])
-            action = rule['action']
-            condition_list = rule['conditions']
+    def organise(self, rules=None, rulebook=None, priorities=None):
+        """
+        Compiles the rules of one rulebook into its matching index, reusing the taxonomy expansion
+        of every rule whose JSON is unchanged since the last compile of that rulebook.
 
-            candidate_conditions = []
-            valid = True
+        Axiom ids come from the table shared by all rulebooks. They are appended in order of first
+        use and never reassigned, so they are stable between runs over the same rules and across
+        reloads. The new index, axiom maps and analysis are published with a single assignment to
+        self.rulebooks, so a reasoning call running during a reload sees either the old or the new
+        rule set, never a mix.
 
-            for axiom_cond in condition_list:
-                mapped = self.taxonomy_reasoning(axiom_cond)
-                if not mapped:
-                    valid = False
-                    break
-                axiom_conditions.update(mapped)
-                candidate_conditions.append(mapped)
+        Args:
+            priorities (dict): load_priorities() result, None keeps the rulebook's current one
+                (none for a new rulebook).
 
-            if not valid:
+        Returns:
+            dict: rule ids added, removed and updated, and the number of unchanged rules.
+        """
+        rulebook = rulebook or self.rulebook
+        current = self.rulebooks.get(rulebook, {})
+        if rules is None:
+            rules = current.get('rules', self.rules)
+        if priorities is None:
+            priorities = current.get('priorities') or load_priorities(None)
+        previous = current.get('expansions', {})
+
+        # ---------- taxonomy expansion, only for new or changed rules ----------
+        rule_expansions = {}
+        changes = {'added': [], 'removed': [], 'updated': [], 'unchanged': 0}
+        for rule in rules:
+            rule_id = int(rule['id'])
+            signature = json.dumps(rule, sort_keys=True)
+            if rule_id in previous and previous[rule_id][0] == signature:
+                rule_expansions[rule_id] = previous[rule_id]
+                changes['unchanged'] += 1
                 continue
+            changes['updated' if rule_id in previous else 'added'].append(rule_id)
+            rule_expansions[rule_id] = (signature, rule['action'], self.expand_rule(rule['conditions']))
+        changes['removed'] = [rule_id for rule_id in previous if rule_id not in rule_expansions]
+
+        conditions_action = {
+            (rule_id, action): mapped_conditions
+            for rule_id, (_, action, mapped_conditions) in rule_expansions.items()
+            if mapped_conditions is not None
+        }
 
-            if candidate_conditions:
-                mapped_conditions = [list(p) for p in product(*candidate_conditions)]
-            else:
-                mapped_conditions = [[]]
+        # ---------- static analysis and pruning ----------
+        rule_analysis = self.analyse_rules(conditions_action, priorities)
+        if self.prune:
+            conditions_action = rule_analysis['kept']
 
-            conditions_action[(rule_id, action)] = mapped_conditions
-            self.action_conditions.setdefault(action, []).append({
+        # ---------- axiom id maps ----------
+        for condition_list in conditions_action.values():
+            for condition in condition_list:
+                for c in sum(split_condition(condition), []):
+                    if c not in self.axiom_table:
+                        self.axiom_table[c] = len(self.axiom_table)
+        axiom_condition_id = dict(self.axiom_table)
+        id_axiom_conditions = {idx: item for item, idx in axiom_condition_id.items()}
+
+        # ---------- build array-backed rule trie ----------
+        entries = []
+        action_conditions = {}
+        for (rule_id, action), condition_list in conditions_action.items():
+            id_lists, neg_id_lists = [], []
+            for condition in condition_list:
+                positive, negative = split_condition(condition)
+                id_lists.append(tuple(sorted(axiom_condition_id[c] for c in positive)))
+                neg_id_lists.append(tuple(sorted(axiom_condition_id[c] for c in negative)))
+            # conditions are kept as axiom id tuples, the strings live once in id_axiom_conditions
+            action_conditions.setdefault(action, []).append({
                 'rule_id': rule_id,
-                'conditions': mapped_conditions
+                'conditions': id_lists,
+                'negated': neg_id_lists,
             })
-
-        # ---------- axiom id maps ----------
-        self.axiom_condition_id = {
-            item: idx for idx, item in enumerate(axiom_conditions)
-        }
-        self.id_axiom_conditions = {
-            idx: item for idx, item in enumerate(axiom_conditions)
+            entries.extend((cond_id_list, rule_id, action, neg_id_list) for cond_id_list, neg_id_list in zip(id_lists, neg_id_lists))
+
+        rule_analysis['size_after'] = self.index_size(conditions_action)
+
+        compiled = {
+            'rules': rules,
+            'expansions': rule_expansions,
+            'axiom_condition_id': axiom_condition_id,
+            'id_axiom_conditions': id_axiom_conditions,
+            'rule_index': RuleIndex.build(entries),
+            'action_conditions': action_conditions,
+            'rule_analysis': rule_analysis,
+            'priorities': priorities,
         }
+        self.rulebooks = {**self.rulebooks, rulebook: compiled}
+        if rulebook == self.rulebook:
+            self.rules = rules
+        return changes
+
+    def reload(self, rules, rulebook=None):
+        # incremental recompile for a changed rule list, safe to call while other threads reason
+        with self.reload_lock:
+            changes = self.organise(rules, rulebook)
+        self.logger.info(
+            f"Rules reloaded{f' ({rulebook})' if rulebook else ''}: added {changes['added']}, removed {changes['removed']}, "
+            f"updated {changes['updated']}, {changes['unchanged']} unchanged"
+        )
+        return changes
+
+    def add_rulebook(self, name, rules, priorities=None):
+        # compile another rulebook against the shared axiom table, with its own priorities (load_priorities())
+        with self.reload_lock:
+            self.organise(rules, name, load_priorities(priorities))
+        compiled = self.rulebooks[name]
+        self.logger.info(
+            f"Rulebook {name}: {len(rules)} rules, {compiled['rule_index'].n_nodes} nodes, "
+            f"{len(compiled['axiom_condition_id'])} shared axioms"
+        )
+        return compiled
+
+    def expand_rule(self, condition_list):
+        # all taxonomy expansions of a rule's conditions, None if a condition cannot be expanded
+        candidate_conditions = []
+        negated = []
+        for axiom_cond in condition_list:
+            is_negated = axiom_cond.startswith(NEGATION)
+            mapped = self.taxonomy_reasoning(axiom_cond[len(NEGATION):] if is_negated else axiom_cond)
+            if not mapped:
+                return None
+            if is_negated:
+                # "not vehicle, ..." means no subclass of vehicle either, every expansion must be absent
+                negated.extend(NEGATION + m for m in mapped)
+            else:
+                candidate_conditions.append(mapped)
 
-        # ---------- build nested dict-only rule tree ----------
-        self.rule_dict = {}
+        if candidate_conditions:
+            return [list(p) + negated for p in product(*candidate_conditions)]
+        return [negated]
+
+    @property
+    def compiled(self):
+        return self.rulebooks[self.rulebook]
+
+    @property
+    def axiom_condition_id(self):
+        return self.compiled['axiom_condition_id']
+
+    @property
+    def id_axiom_conditions(self):
+        return self.compiled['id_axiom_conditions']
+
+    @property
+    def rule_index(self):
+        return self.compiled['rule_index']
+
+    @property
+    def action_conditions(self):
+        return self.compiled['action_conditions']
+
+    @property
+    def rule_analysis(self):
+        return self.compiled['rule_analysis']
+
+    def priority_role(self, rule_id, priorities):
+        # rules can only replace each other if priority resolution treats them the same way
+        sets = [priorities['default']['unless']] if priorities['default'] else []
+        sets += [s for o in priorities['overrides'] for s in (o['winners'], o['losers'])]
+        return tuple(rule_id in s for s in sets)
+
+    def index_size(self, conditions_action):
+        # number of expansions, of distinct trie prefixes they need and of axioms they use. Ids
+        # follow the sorted axiom strings, so before and after pruning are counted the same way,
+        # whatever the hash seed
+        axioms = sorted({c for condition_list in conditions_action.values() for condition in condition_list for c in sum(split_condition(condition), [])})
+        axiom_id = {c: i for i, c in enumerate(axioms)}
+        n_axioms = len(axiom_id)
+        paths = {tuple(sorted(axiom_id[c] for c in split_condition(condition)[0])) for condition_list in conditions_action.values() for condition in condition_list}
+        paths.discard(())
+        nodes = {p[:i + 1] for p in paths for i in range(len(p))}
+        expansions = sum(len(condition_list) for condition_list in conditions_action.values())
+        return {'expansions': expansions, 'nodes': len(nodes), 'axioms': n_axioms}
+
+    def analyse_rules(self, conditions_action, priorities):
+        """
+        Static analysis of the taxonomy-expanded rules before they are compiled.
+
+        Finds expansions with a fact no scene can produce (unreachable), expansions that repeat or
+        are implied by a smaller expansion with the same action and priority role (duplicate,
+        subsumed), and identical condition sets that lead to different actions (conflicting).
+        A fact is reachable when it is a (subject, relation, object) triple whose terms the
+        vocabulary slots or the rule conditions use in that position. These are findings, not
+        proofs, and a subsumed rule still reports its own rule id. Only an expansion that repeats
+        another expansion of the same rule is left out of 'kept'.
+
+        Returns:
+            dict: the kept expansions per (rule_id, action), the findings per category and the index size before pruning.
+        """
+        report = {'unreachable': [], 'duplicate': [], 'subsumed': [], 'conflicting': []}
+        report['size_before'] = self.index_size(conditions_action)
+
+        # the prompts show the rules and situation tuples reach the facts verbatim, so a model can
+        # write any term a rule uses in the same position; taxonomy classes come with the slots
+        slots = tuple(set(slot) for slot in self.fact_slots)
+        for condition_list in conditions_action.values():
+            for condition in condition_list:
+                for c in sum(split_condition(condition), []):
+                    parts = [p.strip() for p in c.split(',')]
+                    if len(parts) == len(slots):
+                        for slot, part in zip(slots, parts):
+                            slot.add(part)
 
+        expansions = []
         for (rule_id, action), condition_list in conditions_action.items():
             for condition in condition_list:
-                if not condition:
+                # an absent fact is always possible, only the positive conditions have to be derivable
+                missing = [c for c in split_condition(condition)[0] if not self.derivable(c, slots)]
+                if missing:
+                    report['unreachable'].append((rule_id, action, missing))
+                expansions.append((rule_id, action, frozenset(condition), condition))
+
+        # smaller condition sets first, so a subsuming expansion is always seen before the ones it implies
+        expansions.sort(key=lambda item: len(item[2]))
+        kept = []
+        by_conditions = {}
+        for rule_id, action, cond_set, condition in expansions:
+            repeated = False
+            for other_id, other_action, other_set, _ in by_conditions.get(cond_set, []):
+                if other_action != action:
+                    report['conflicting'].append((rule_id, other_id, sorted(cond_set)))
+                elif other_id == rule_id:
+                    repeated = True
+            if repeated:
+                continue
+            for other_id, other_action, other_set, _ in kept:
+                if other_action != action or other_id == rule_id or self.priority_role(other_id, priorities) != self.priority_role(rule_id, priorities):
                     continue
+                if other_set <= cond_set:
+                    report['duplicate' if other_set == cond_set else 'subsumed'].append((rule_id, other_id, sorted(cond_set)))
+                    break
+            by_conditions.setdefault(cond_set, []).append((rule_id, action, cond_set, condition))
+            kept.append((rule_id, action, cond_set, condition))
 
-                cond_id_list = sorted(
-                    self.axiom_condition_id[c] for c in condition
-                )
-
-                curr = self.rule_dict
-                for cid in cond_id_list[:-1]:
-                    if cid not in curr or not isinstance(curr[cid], dict):
-                        curr[cid] = {}
-                    curr = curr[cid]
-
-                leaf = cond_id_list[-1]
-
-                curr[leaf] = {
-                    'rule_id': rule_id,
-                    'action': action
-                }
+        report['kept'] = {key: [] for key in conditions_action}
+        for rule_id, action, _, condition in kept:
+            report['kept'][(rule_id, action)].append(condition)
+        report['kept'] = {key: v for key, v in report['kept'].items() if v}
+        return report
 
 
     
-    def build_rule_dict(self, curr_dict, cond_id):
-        cond_id_dict = curr_dict.setdefault(cond_id, {})
-        return cond_id_dict
+    def rules_hash(self, rulebook=None, rule_names=False):
+        """
+        sha256 of a compiled rulebook: every indexed condition path as axiom strings, with its
+        rule id and action, plus the priority relations. Rules that compile to the same index
+        hash the same, whatever their order in the file or metadata such as UKRuleid.
 
+        Args:
+            rule_names (bool): also hash the UKRuleid of every rule, for outputs that show them
+                (reasoning paths).
+        """
+        compiled = self.rulebooks[rulebook or self.rulebook]
+        names = compiled['id_axiom_conditions']
+        paths = sorted(
+            (sorted(names[i] for i in path), sorted(names[i] for i in negated), int(rule_id), action)
+            for path, negated, rule_id, action in compiled['rule_index'].rules()
+        )
+        priority = json.loads(json.dumps(compiled['priorities'], default=sorted))
+        hashed = [paths, priority]
+        if rule_names:
+            hashed.append(sorted((int(rule['id']), rule.get('UKRuleid')) for rule in compiled['rules']))
+        return hashlib.sha256(json.dumps(hashed).encode()).hexdigest()
+
+    def save_index(self, path):
+        # compiled index and axiom table, for load_index() in other processes
+        self.rule_index.save(path, axioms=[self.id_axiom_conditions[i] for i in range(len(self.id_axiom_conditions))])
+
+    def load_index(self, path, use_mmap=True):
+        rule_index, axioms = RuleIndex.load(path, use_mmap)
+        compiled = dict(self.compiled)
+        compiled['rule_index'] = rule_index
+        compiled['axiom_condition_id'] = {item: idx for idx, item in enumerate(axioms)}
+        compiled['id_axiom_conditions'] = {idx: item for idx, item in enumerate(axioms)}
+        self.rulebooks = {**self.rulebooks, self.rulebook: compiled}
 
     def taxonomy_reasoning(self, condition):
         # replace the general class ('vulnerable road users') by the child-classes ('pedestrain')
@@ -213,8 +587,29 @@ class DrivingLogicEngine:
 
     def print_rules(self):
         self.logger.info("\nFollowing are the rules")
-        for rule in self.rule_dict:
-            self.logger.info(f"{rule}, {self.rule_dict[rule]}")
+        for path, negated, rule_id, action in self.rule_index.rules():
+            negation = f" not {list(negated)}" if negated else ""
+            self.logger.info(f"{list(path)}{negation}, {{'rule_id': {rule_id}, 'action': '{action}'}}")
+        self.logger.info(f"{self.rule_index.n_nodes} nodes, {self.rule_index.nbytes()} bytes of index arrays")
+
+    def print_rule_analysis(self):
+        report = self.rule_analysis
+        self.logger.info("\nRule analysis")
+        for kind in ['unreachable', 'duplicate', 'subsumed', 'conflicting']:
+            rule_ids = sorted({item[0] for item in report[kind]})
+            if kind == 'unreachable' and rule_ids:
+                # the rules stay, they are reported so the conditions can be fixed
+                self.logger.warning(f"\t{kind}: {len(report[kind])} expansions use facts no scene produces, rules {rule_ids} (kept)")
+            else:
+                self.logger.info(f"\t{kind}: {len(report[kind])} expansions, rules {rule_ids}")
+            if self.verbose:
+                for item in report[kind]:
+                    self.logger.info(f"\t\t{item}")
+        before, after = report['size_before'], report['size_after']
+        self.logger.info(
+            f"\tindex size{' (pruned)' if self.prune else ''}: "
+            + ", ".join(f"{k} {before[k]} -> {after[k]}" for k in before)
+        )
 
     def print_axiom_conditions(self):
         self.logger.info("\nFollowing are the axiom_condition with ids")
@@ -222,13 +617,37 @@ class DrivingLogicEngine:
             self.logger.info(f"\t{c}: {self.id_axiom_conditions[c]}")
 
     
-    def reasoning(self, scene_id, scene_discription):
+    def vocabulary_slots(self, vocabulary):
+        # (subjects, relations, objects) a fact of build_facts() can take, from the vocabulary slots
+        pairs = [[p.strip() for p in item.strip('()').split(',')] for item in vocabulary['ego_situation']]
+        status = [s for v in vocabulary['status'].values() for s in v]
+        features = vocabulary['road_features'] + vocabulary['other_features']
+        users = ['road_user'] + list(self.class_hierarchy.index)
+        subjects = {'ego'} | set(users) | set(vocabulary['control_device']) | set(features)
+        relations = ({p[0] for p in pairs} | set(vocabulary['preposition']) | set(vocabulary['road_user_position'])
+                     | {'is', 'status', 'was', 'intend', 'approaching', 'same_lane_front_of', 'same_lane_front_relevant'})
+        objects = ({p[-1] for p in pairs} | set(features) | set(status) | set(users) | set(vocabulary['ego_intention'])
+                   | set(vocabulary['preposition']) | {'ego', 'exist', 'turn'})
+        return subjects, relations, objects
+
+    def derivable(self, fact, slots=None):
+        # whether a scene description can make reasoning() produce this fact, slots default to the vocabulary's
+        slots = slots or self.fact_slots
+        parts = [i.strip() for i in fact.split(',')]
+        if len(parts) != len(slots):
+            return False
+        return all(part in slot for part, slot in zip(parts, slots))
+
+    def build_facts(self, scene_discription, ends=None):
+        # ends, a list, gets the number of facts built after each ASD tuple, for fact_sources()
         situation = scene_discription["situation"]
         control_device = scene_discription['control_device']
         road_user = scene_discription['road_user']
         intention = scene_discription['intention']
 
         facts = [tri.strip('()') for tri in situation]
+        if ends is not None:
+            ends.extend(range(1, len(facts) + 1))
         for statement in control_device:
             device, _, previous_state, current_state = [i.strip() for i in statement.strip('()').split(',')]
 
@@ -237,8 +656,9 @@ class DrivingLogicEngine:
             facts.append(f"{device}, was, {previous_state}") 
             facts.append(f'{device}, is, {current_state}') # "traffic_light is green"
             facts.append(f'{device}, status, {current_state}') # "traffic_light is green"
+            if ends is not None:
+                ends.append(len(facts))
 
-        ego_being_overtaken = 0
         for statement in road_user:
             try:
                 user, position, previous_state, current_state = [i.strip() for i in statement.strip('()').split(',')]
@@ -259,10 +679,8 @@ class DrivingLogicEngine:
                 facts.append(f"ego, approaching, {user}")
                 facts.append(f"{user}, same_lane_front_of, ego")
                 facts.append(f"road_user, same_lane_front_relevant, ego")
-            if current_state == "overtake_ego":
-                ego_being_overtaken = 1
-        if not ego_being_overtaken:
-            facts.append(f"road_users, are, not_begin_overtake_ego")
+            if ends is not None:
+                ends.append(len(facts))
 
         intended_action = set()
         for statement in intention:
@@ -272,23 +690,129 @@ class DrivingLogicEngine:
             # else:
             facts.append(f"ego, intend, {intent}")
             intended_action.add(intent)
+            if ends is not None:
+                ends.append(len(facts))
 
-        if self.verbose:
-            self.logger.info(f"\n\nfacts for scene {scene_id}:")
-            for f in facts:
-                self.logger.info(f'\t{f}')
-            self.logger.info('\n')
-        
-        reasoning_result = self.infer_actions(facts)  
+        return facts, intended_action
+
+    def driving_facts(self, scene_discription, rulebook=None):
+        """
+        The facts of a scene that can change infer_actions(): those with an axiom id in the
+        rulebook and those read by priority resolution. Two scenes with the same driving facts
+        get the same actions, whatever else their descriptions differ in.
+        """
+        facts, _ = self.build_facts(scene_discription)
+        compiled = self.rulebooks[rulebook or self.rulebook]
+        axiom_condition_id, priority_facts = compiled['axiom_condition_id'], compiled['priorities']['facts']
+        return frozenset(f for f in facts if f in axiom_condition_id or f in priority_facts)
+
+    def fact_sources(self, facts, ends):
+        # fact -> positions in provenance.asd_tuples() of the ASD tuples that produce it, from build_facts(scene, ends)
+        sources = {}
+        start = 0
+        for position, end in enumerate(ends):
+            for fact in facts[start:end]:
+                sources.setdefault(fact, []).append(position)
+            start = end
+        return sources
+
+    def explain(self, scene_id, scene_discription, rulebook=None):
+        """
+        reasoning() that also records how every action was derived: the axiom ids of the matched
+        rule expansion, the ASD tuples behind them and the priority relations that suppressed other
+        rules. provenance.reasoning_path() renders the record.
+
+        Returns:
+            tuple: (actions_to_take, intended_action, Provenance)
+        """
+        compiled = self.rulebooks[rulebook or self.rulebook]
+        ends = []
+        with tracer.span('fact_building', scene_id, 'symbolic'):
+            facts, intended_action = self.build_facts(scene_discription, ends)
+        self.log_facts(scene_id, facts)
+        fact_cond = self.fact_ids(facts, compiled['axiom_condition_id'])
+        priorities = compiled['priorities']
+        provenance = Provenance(compiled['id_axiom_conditions'], priorities['facts'])
+        with tracer.span('rule_matching', scene_id, 'symbolic'):
+            ans = [{'rule_id': rule_id, 'action': action} for rule_id, action in compiled['rule_index'].match(fact_cond)]
+        with tracer.span('priority_resolution', scene_id, 'symbolic'):
+            ans = self.resolve_priorities(ans, facts, priorities, provenance)
+
+        present = set(fact_cond)
+        sources = self.fact_sources(facts, ends)
+        holding = {}
+        for item in ans:
+            rule_id, action = int(item['rule_id']), item['action']
+            axiom_ids, kind = [], item.get('kind', MATCHED)
+            if kind == DERIVED:
+                d = item['derived']
+                axiom_ids = [i for i, fact in enumerate(priorities['facts']) if fact in facts and fact in d['any'] + d['all']]
+                used = [priorities['facts'][i] for i in axiom_ids]
+            else:
+                if (rule_id, action) not in holding:
+                    # the trie yields a rule once per expansion that holds, in no particular order
+                    holding[rule_id, action] = list(dict.fromkeys(
+                        tuple(positive) + tuple(~cid for cid in negative)
+                        for expansion in compiled['action_conditions'].get(action, []) if expansion['rule_id'] == rule_id
+                        for positive, negative in zip(expansion['conditions'], expansion['negated'])
+                        if present.issuperset(positive) and present.isdisjoint(negative)
+                    ))[::-1]
+                if kind == MATCHED and holding[rule_id, action]:
+                    axiom_ids = holding[rule_id, action].pop()
+                used = [compiled['id_axiom_conditions'][cid] for cid in axiom_ids if cid >= 0]
+            provenance.add(rule_id, action, kind, axiom_ids, [p for fact in used for p in sources.get(fact, [])])
+
+        reasoning_result = [{'rule_id': i['rule_id'], 'action': i['action']} for i in ans]
+        self.log_results(scene_id, reasoning_result)
+        return reasoning_result, intended_action, provenance
+
+    def reasoning(self, scene_id, scene_discription):
+        with tracer.span('fact_building', scene_id, 'symbolic'):
+            facts, intended_action = self.build_facts(scene_discription)
+        self.log_facts(scene_id, facts)
+
+        reasoning_result = self.infer_actions(facts, scene_id)
 
         reasoning_result = [{'rule_id': i['rule_id'], 'action': i['action']} for i in reasoning_result if 'action' in i and 'rule_id' in i]
 
         # checked = self.check_intentions(intended_action)
 
         # logger.info(f'\nintention check: {checked}')
-        # if self.verbose:
+        self.log_results(scene_id, reasoning_result)
+
+        return reasoning_result, intended_action
+
+    def log_facts(self, scene_id, facts):
+        if self.verbose:
+            self.logger.info(f"\n\nfacts for scene {scene_id}:")
+            for f in facts:
+                self.logger.info(f'\t{f}')
+            self.logger.info('\n')
+
+    def log_results(self, scene_id, reasoning_result):
+        # shared by reasoning() and explain(), so --reasoning_path runs log the same
         self.logger.info(f"\n\nReasoning results for scene {scene_id}:")
         self.logger.info(f"\n\t\tActions: {reasoning_result}")
         self.logger.info(f"actions: {set([a['action'] for a in reasoning_result])}")
 
-        return reasoning_result, intended_action
\ No newline at end of file
+    def reasoning_all(self, scene_id, scene_discription, rulebooks=None):
+        """
+        Reasons over one scene with several rulebooks. The facts and their axiom ids are built once,
+        only rule matching and priority resolution run per rulebook.
+
+        Returns:
+            tuple: ({rulebook: actions_to_take}, intended_action)
+        """
+        with tracer.span('fact_building', scene_id, 'symbolic'):
+            facts, intended_action = self.build_facts(scene_discription)
+
+        compiled_books = self.rulebooks
+        # the shared table holds the ids of every rulebook and ids are never reassigned
+        fact_cond = self.fact_ids(facts, self.axiom_table)
+        results = {}
+        for name in (rulebooks or compiled_books):
+            reasoning_result = self.match_rules(fact_cond, facts, compiled_books[name], scene_id, f'symbolic:{name}')
+            results[name] = [{'rule_id': i['rule_id'], 'action': i['action']} for i in reasoning_result]
+            self.logger.info(f"Reasoning results for scene {scene_id} ({name}): {set([a['action'] for a in results[name]])}")
+
+        return results, intended_action
\ No newline at end of file
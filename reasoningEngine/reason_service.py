@@ -0,0 +1,239 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+from reason_engine import DrivingLogicEngine
+from metrics import tracer
+
+HTTP_STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+class ReasoningService:
+
+    def __init__(self, engine, batch_window=0.0005, max_batch=256, rules_path=None):
+        """
+        Keeps one compiled DrivingLogicEngine warm and answers reasoning requests from an asyncio loop.
+
+        Requests that arrive within `batch_window` seconds are processed as one batch, and identical
+        scenes in flight (same canonical JSON) are coalesced so the engine runs once for all of them.
+
+        Args:
+            engine (DrivingLogicEngine): compiled engine, shared by all requests.
+            batch_window (float): seconds to wait for more requests before running a batch.
+            max_batch (int): run the batch early once this many distinct scenes are queued.
+            rules_path (str): rules file re-read by POST /reload and by watch_rules.
+        """
+        self.engine = engine
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.tracer = tracer
+        self.pending = {}  # canonical scene -> (scene_id, scene, future)
+        self.flush_handle = None
+        self.coalesced = 0
+        self.rules_path = rules_path
+        self.rules_mtime = os.path.getmtime(rules_path) if rules_path else None
+
+    def reason_now(self, scene_id, scene):
+        actions_to_take, intended_action = self.engine.reasoning(scene_id, scene)
+        rule_ids = sorted({int(a['rule_id']) for a in actions_to_take})
+        return {
+            'actions_to_take': [{'rule_id': int(a['rule_id']), 'action': a['action']} for a in actions_to_take],
+            'actions': sorted({a['action'] for a in actions_to_take}),
+            'rule_ids': rule_ids,
+            'intention': sorted(intended_action),
+        }
+
+    async def reason(self, scene_id, scene):
+        key = json.dumps(scene, sort_keys=True)
+        if key in self.pending:
+            self.coalesced += 1
+            return await asyncio.shield(self.pending[key][2])
+        future = asyncio.get_running_loop().create_future()
+        self.pending[key] = (scene_id, scene, future)
+        if len(self.pending) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window, self.flush)
+        return await asyncio.shield(future)
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, {}
+        start = time.perf_counter()
+        for scene_id, scene, future in batch.values():
+            try:
+                result = self.reason_now(scene_id, scene)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            if not future.done():
+                future.set_result(result)
+        if batch:
+            self.tracer.record('batch', time.perf_counter() - start, None, 'service', size=len(batch))
+
+    async def reason_many(self, scenes):
+        results = await asyncio.gather(
+            *(self.reason(seg_id, scene) for seg_id, scene in scenes.items()),
+            return_exceptions=True,
+        )
+        return {
+            seg_id: ({'error': str(r)} if isinstance(r, Exception) else r)
+            for seg_id, r in zip(scenes, results)
+        }
+
+    async def reload(self, rules=None):
+        # compile in a worker thread, requests keep using the old index until the swap
+        if rules is None:
+            with open(self.rules_path, 'r') as f:
+                rules = json.load(f)
+        with self.tracer.span('reload', None, 'service'):
+            return await asyncio.get_running_loop().run_in_executor(None, self.engine.reload, rules)
+
+    async def watch_rules(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                mtime = os.path.getmtime(self.rules_path)
+                if mtime == self.rules_mtime:
+                    continue
+                self.rules_mtime = mtime
+                changes = await self.reload()
+                print(f"Reloaded {self.rules_path}: {changes}")
+            except (OSError, ValueError) as e:
+                # keep serving the last good rules while the file is missing or half written
+                print(f"Rule reload failed: {e}")
+
+    async def handle_request(self, method, path, body):
+        if path == '/health':
+            return 200, {'status': 'ok', 'axioms': len(self.engine.axiom_condition_id), 'nodes': self.engine.rule_index.n_nodes}
+        if path == '/metrics':
+            return 200, self.tracer.prometheus_text()
+        if path not in ('/reason', '/reload'):
+            return 404, {'error': f'unknown path {path}'}
+        if method != 'POST':
+            return 405, {'error': 'use POST'}
+        try:
+            request = json.loads(body or b'{}')
+        except json.JSONDecodeError as e:
+            return 400, {'error': f'invalid JSON: {e}'}
+
+        if path == '/reload':
+            # {"rules": [...]} compiles the given rules, an empty body re-reads the rules file
+            if 'rules' not in request and not self.rules_path:
+                return 400, {'error': "expected 'rules'"}
+            return 200, await self.reload(request.get('rules'))
+
+        # single scene: {"segment_id": ..., "scene": {...}}, batch: {"scenes": {segment_id: scene}}
+        if 'scenes' in request:
+            scenes = request['scenes']
+        elif 'scene' in request:
+            scenes = {request.get('segment_id', 'scene'): request['scene']}
+        else:
+            return 400, {'error': "expected 'scene' or 'scenes'"}
+        with self.tracer.span('request', None, 'service', size=len(scenes)):
+            results = await self.reason_many(scenes)
+        return 200, {'results': results}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                except ValueError:
+                    await self.respond(writer, 400, {'error': 'malformed request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                keep_alive = headers.get('connection', '').lower() != 'close'
+
+                try:
+                    status, payload = await self.handle_request(method, path.split('?', 1)[0], body)
+                except Exception as e:
+                    status, payload = 500, {'error': str(e)}
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        head = (
+            f"HTTP/1.1 {status} {HTTP_STATUS.get(status, '')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+    async def serve(self, host='127.0.0.1', port=8765, unix_socket=None):
+        if unix_socket:
+            if os.path.exists(unix_socket):
+                os.remove(unix_socket)
+            server = await asyncio.start_unix_server(self.handle_connection, path=unix_socket)
+            print(f"Reasoning service listening on unix socket {unix_socket}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Reasoning service listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    async def run(self, host='127.0.0.1', port=8765, unix_socket=None, watch=False):
+        if watch and self.rules_path:
+            watcher = asyncio.ensure_future(self.watch_rules())
+        try:
+            await self.serve(host, port, unix_socket)
+        finally:
+            if watch and self.rules_path:
+                watcher.cancel()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rules', type=str, default='uk_rules.json')
+    parser.add_argument('--vocabulary', type=str, default='../vocabulary.json')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix_socket', type=str, default=None)
+    parser.add_argument('--batch_window_ms', type=float, default=0.5)
+    parser.add_argument('--watch', action='store_true', help='recompile changed rules when the rules file is modified')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.rules, 'r') as f:
+        rules = json.load(f)
+    engine = DrivingLogicEngine(rules, args.verbose, vocabulary=args.vocabulary)
+    if not args.verbose:
+        # per-scene result logging dominates the matching time
+        engine.logger.setLevel(logging.WARNING)
+
+    service = ReasoningService(engine, batch_window=args.batch_window_ms / 1000, rules_path=args.rules)
+    try:
+        asyncio.run(service.run(args.host, args.port, args.unix_socket, args.watch))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
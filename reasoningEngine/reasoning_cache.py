@@ -0,0 +1,62 @@
+import os
+import json
+import hashlib
+from reason_engine import ENGINE_VERSION
+
+
+def canonical_hash(value):
+    # sha256 of a JSON value that does not depend on key order or on the order of the ASD tuples
+    if isinstance(value, dict):
+        value = {k: sorted(v, key=json.dumps) if isinstance(v, list) else v for k, v in value.items()}
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode()).hexdigest()
+
+
+class ReasoningCache:
+
+    def __init__(self, path, rules_hash, engine_version=ENGINE_VERSION, inputs=None):
+        """
+        Per-segment reasoning outputs in a JSON file, keyed by a fingerprint of everything the
+        output depends on: the compiled rules hash, the engine version, the segment id, the
+        canonical hash of its scene, and `inputs` (e.g. the model of the intention check).
+
+        An entry is reused only when its fingerprint matches, so after a change only the affected
+        segments are recomputed, as with make. Entries are content addressed: outputs of other
+        scene files or rule versions stay in the file and are reused when those come back.
+
+        Args:
+            path (str): JSON file of fingerprint -> output.
+            rules_hash (str | list): DrivingLogicEngine.rules_hash() of every rulebook in use.
+            engine_version (str): reason_engine.ENGINE_VERSION.
+            inputs: any other JSON value the outputs depend on.
+        """
+        self.path = path
+        self.base = [rules_hash, engine_version, inputs]
+        self.reused = 0
+        self.recomputed = 0
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def fingerprint(self, seg_id, scene):
+        return hashlib.sha256(json.dumps(self.base + [seg_id, canonical_hash(scene)]).encode()).hexdigest()
+
+    def get(self, seg_id, scene):
+        output = self.entries.get(self.fingerprint(seg_id, scene))
+        if output is None:
+            self.recomputed += 1
+        else:
+            self.reused += 1
+        return output
+
+    def put(self, seg_id, scene, output):
+        self.entries[self.fingerprint(seg_id, scene)] = output
+
+    def save(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
+
+    def print_summary(self, printer=print):
+        printer(f"Reasoning cache: {self.reused} segments reused, {self.recomputed} recomputed, {len(self.entries)} entries in {self.path}")
@@ -0,0 +1,198 @@
+import os
+import sys
+import json
+import time
+import argparse
+from reason_engine import DrivingLogicEngine, ENGINE_VERSION, VOCABULARY_PATH
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+
+# defaults written to a new manifest, edit them there
+BUDGETS = {'compile_ms': 100.0, 'scene_ms': 2.0}
+
+
+def quiet_engine(rules, vocabulary=VOCABULARY_PATH):
+    # engine without a log file or console output, the timings hold reasoning only and the report stays readable
+    return DrivingLogicEngine(rules, False, vocabulary=vocabulary, log_dir=None)
+
+
+def outcome(actions_to_take):
+    # what the corpus pins down: the action set and the ids of the rules that fired
+    return {
+        'actions': sorted({a['action'] for a in actions_to_take}),
+        'rule_ids': sorted({str(a['rule_id']) for a in actions_to_take}, key=int),
+    }
+
+
+def compile_ms(engine, rules, repeat):
+    # best of `repeat` full compiles into a scratch rulebook, no expansion is reused
+    best = float('inf')
+    for i in range(repeat):
+        name = f'__replay_{i}'
+        start = time.perf_counter()
+        engine.organise(rules, name)
+        best = min(best, time.perf_counter() - start)
+        engine.rulebooks = {k: v for k, v in engine.rulebooks.items() if k != name}
+    return best * 1e3
+
+
+def record(corpus_dir, rules_path, scene_path, perturb=False):
+    """
+    Writes a corpus: the rules, the scenes and the current engine's reasoning() outcome of every
+    scene, plus a manifest with the budgets. With perturb, the single edits of
+    counterfactual.default_perturbations() are added as scenes "<segment_id>~<n>".
+    """
+    with open(rules_path, 'r') as f:
+        rules = json.load(f)
+    with open(scene_path, 'r') as f:
+        scenes = json.load(f)
+    if perturb:
+        from counterfactual import default_perturbations
+        with open(VOCABULARY_PATH, 'r') as f:
+            vocabulary = json.load(f)
+        for seg_id, scene in list(scenes.items()):
+            for n, perturbation in enumerate(default_perturbations(scene, vocabulary)):
+                variant = {k: list(v) for k, v in scene.items()}
+                for key, old, new in perturbation:
+                    if old is not None:
+                        variant[key].remove(old)
+                    if new is not None:
+                        variant[key].append(new)
+                scenes[f'{seg_id}~{n}'] = variant
+
+    engine = quiet_engine(rules)
+    expected = {}
+    for seg_id, scene in scenes.items():
+        try:
+            expected[seg_id] = outcome(engine.reasoning(seg_id, scene)[0])
+        except ValueError:
+            # the engine cannot parse this ASD, it stays out of the corpus
+            continue
+    scenes = {seg_id: scenes[seg_id] for seg_id in expected}
+
+    os.makedirs(corpus_dir, exist_ok=True)
+    manifest_path = os.path.join(corpus_dir, 'manifest.json')
+    budgets = dict(BUDGETS)
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            budgets = json.load(f).get('budgets', budgets)
+    files = {'rules.json': rules, 'scenes.json': scenes, 'expected.json': expected, 'manifest.json': {
+        'engine_version': ENGINE_VERSION,
+        'rules_hash': engine.rules_hash(),
+        'scenes': len(scenes),
+        'budgets': budgets,
+    }}
+    for name, content in files.items():
+        with open(os.path.join(corpus_dir, name), 'w') as f:
+            if name in ('scenes.json', 'expected.json'):
+                # one line per scene keeps re-recordings reviewable as diffs
+                f.write('{\n' + ',\n'.join(f"{json.dumps(k)}: {json.dumps(v)}" for k, v in content.items()) + '\n}\n')
+            else:
+                json.dump(content, f, indent=4)
+    print(f"Recorded {len(scenes)} scenes in {corpus_dir}")
+
+
+def replay(corpus_dir, repeat=5, budgets=None):
+    """
+    Re-runs every corpus scene through the current engine and checks it against the recording.
+
+    Returns:
+        dict: report with the mismatches (missing and extra actions and rule ids per scene), the
+        compile time and per-scene latency (best of `repeat`) against the budgets, and 'passed'.
+    """
+    with open(os.path.join(corpus_dir, 'manifest.json'), 'r') as f:
+        manifest = json.load(f)
+    budgets = {**manifest['budgets'], **(budgets or {})}
+    with open(os.path.join(corpus_dir, 'rules.json'), 'r') as f:
+        rules = json.load(f)
+    with open(os.path.join(corpus_dir, 'scenes.json'), 'r') as f:
+        scenes = json.load(f)
+    with open(os.path.join(corpus_dir, 'expected.json'), 'r') as f:
+        expected = json.load(f)
+
+    engine = quiet_engine(rules)
+    # the first call pays for lazy setup (caches), keep it out of the timings
+    for seg_id, scene in list(scenes.items())[:1]:
+        engine.reasoning(seg_id, scene)
+    mismatches, latency = [], {}
+    for seg_id, scene in scenes.items():
+        best, got = float('inf'), None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            actions_to_take, _ = engine.reasoning(seg_id, scene)
+            best = min(best, time.perf_counter() - start)
+            got = outcome(actions_to_take)
+        latency[seg_id] = best * 1e3
+        want = expected[seg_id]
+        diff = {
+            f'{change}_{key}': sorted(set(a) - set(b))
+            for key in ('actions', 'rule_ids')
+            for change, a, b in (('missing', want[key], got[key]), ('extra', got[key], want[key]))
+        }
+        if any(diff.values()):
+            mismatches.append({'segment_id': seg_id, **diff})
+
+    times = sorted(latency.values())
+    compile_time = compile_ms(engine, rules, repeat)
+    violations = []
+    if compile_time > budgets['compile_ms']:
+        violations.append({'budget': 'compile_ms', 'limit': budgets['compile_ms'], 'value': round(compile_time, 3)})
+    for seg_id, ms in latency.items():
+        if ms > budgets['scene_ms']:
+            violations.append({'budget': 'scene_ms', 'limit': budgets['scene_ms'], 'value': round(ms, 3), 'segment_id': seg_id})
+
+    return {
+        'corpus': corpus_dir,
+        'engine_version': ENGINE_VERSION,
+        'recorded_engine_version': manifest['engine_version'],
+        'rules_hash_changed': engine.rules_hash() != manifest['rules_hash'],
+        'scenes': len(scenes),
+        'mismatches': mismatches,
+        'compile_ms': round(compile_time, 3),
+        'scene_ms': {
+            'p50': round(times[len(times) // 2], 3),
+            'p99': round(times[min(len(times) - 1, int(0.99 * len(times)))], 3),
+            'max': round(times[-1], 3),
+        },
+        'budgets': budgets,
+        'violations': violations,
+        'passed': not mismatches and not violations,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--corpus', default=CORPUS_DIR)
+    parser.add_argument('--record', action='store_true', help='(re)record the corpus from --rules and --scene with the current engine')
+    parser.add_argument('--rules', default='uk_rules.json')
+    parser.add_argument('--scene', default='lingoqa_gtasd.json')
+    parser.add_argument('--perturb', action='store_true', help='also record the single-edit variants of every scene')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per scene and compile, the best one counts')
+    parser.add_argument('--compile_ms', type=float, default=None, help='override the compile time budget of the manifest')
+    parser.add_argument('--scene_ms', type=float, default=None, help='override the per-scene latency budget of the manifest')
+    parser.add_argument('--report', type=str, default=None, help='write the JSON report here')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.corpus, args.rules, args.scene, args.perturb)
+        return
+
+    budgets = {k: v for k, v in (('compile_ms', args.compile_ms), ('scene_ms', args.scene_ms)) if v is not None}
+    report = replay(args.corpus, args.repeat, budgets)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    print(f"{report['scenes']} scenes, {len(report['mismatches'])} mismatches, compile {report['compile_ms']:.1f} ms, "
+          f"scene p50 {report['scene_ms']['p50']:.3f} ms p99 {report['scene_ms']['p99']:.3f} ms max {report['scene_ms']['max']:.3f} ms")
+    for m in report['mismatches'][:20]:
+        print(f"\t{m['segment_id']}: {', '.join(f'{k} {v}' for k, v in m.items() if k != 'segment_id' and v)}")
+    for v in report['violations'][:20]:
+        print(f"\tover budget {v['budget']} {v['value']} > {v['limit']}{' ' + v['segment_id'] if 'segment_id' in v else ''}")
+    print('passed' if report['passed'] else 'FAILED')
+    if not report['passed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+import os
+import json
+import uuid
+import argparse
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+PARTITIONS = ['stage', 'model', 'run']
+
+SCHEMA = pa.schema([
+    ('segment_id', pa.string()),
+    ('actions', pa.list_(pa.string())),
+    ('rule_ids', pa.list_(pa.int32())),
+    ('payload', pa.string()),
+])
+
+PARTITIONING = ds.partitioning(
+    pa.schema([(name, pa.string()) for name in PARTITIONS]), flavor='hive'
+)
+
+
+def _rule_id(step):
+    if isinstance(step, dict):
+        step = step.get('id', step.get('rule_id'))
+    try:
+        return int(step)
+    except (TypeError, ValueError):
+        return None
+
+
+def extract(record):
+    # (actions, rule ids) of a stage output: it_check results, experiment answers, or neither for ASDs
+    if not isinstance(record, dict):
+        return [], []
+    if 'actions_to_take' in record:
+        steps = record['actions_to_take']
+        actions = [d.get('action') for d in steps if isinstance(d, dict)]
+    else:
+        steps = record.get('reasoning_path') or []
+        actions = record.get('action') or []
+        if not isinstance(steps, list):
+            steps = [steps]
+        if not isinstance(actions, list):
+            actions = [actions]
+    rule_ids = [r for r in map(_rule_id, steps) if r is not None]
+    return [str(a) for a in actions if a], rule_ids
+
+
+class ResultStore:
+
+    def __init__(self, root):
+        """
+        Append-only Parquet store of per-segment outputs, partitioned as
+        root/stage=<stage>/model=<model>/run=<run>/part-<time_ns>-<id>.parquet.
+
+        Every row is one segment: the actions and rule ids pulled out of the output as typed
+        columns, and the full output as a JSON string in `payload`. Writes only ever add new files,
+        reads prune partitions and row groups with the given filters.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def append(self, stage, model, run, records):
+        """
+        Writes one batch of {segment_id: output} as a new part file.
+
+        Returns:
+            str: path of the part file, None for an empty batch.
+        """
+        if not records:
+            return None
+        segment_ids = sorted(records)
+        extracted = [extract(records[s]) for s in segment_ids]
+        table = pa.table({
+            'segment_id': segment_ids,
+            'actions': [e[0] for e in extracted],
+            'rule_ids': [e[1] for e in extracted],
+            'payload': [json.dumps(records[s]) for s in segment_ids],
+        }, schema=SCHEMA)
+        directory = os.path.join(self.root, f"stage={stage}", f"model={model}", f"run={run}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}.parquet")
+        # readers list the directory, only publish complete files
+        tmp = os.path.join(directory, '.' + os.path.basename(path))
+        pq.write_table(table, tmp)
+        os.replace(tmp, path)
+        return path
+
+    def dataset(self):
+        return ds.dataset(self.root, format='parquet', partitioning=PARTITIONING)
+
+    def read(self, columns=None, stage=None, model=None, run=None, segment_ids=None, latest=True):
+        """
+        Reads the matching rows as a pandas DataFrame. stage/model/run/segment_ids take a value
+        or a list of values and are pushed down to the Parquet scan.
+
+        With latest, a segment written several times to the same (stage, model, run) keeps only
+        its newest row.
+        """
+        columns = list(dict.fromkeys(['segment_id'] + PARTITIONS + list(columns or SCHEMA.names)))
+        dataset = self.dataset()
+        if not dataset.files:
+            return pd.DataFrame(columns=columns)
+
+        expression = None
+        for name, value in (('stage', stage), ('model', model), ('run', run), ('segment_id', segment_ids)):
+            if value is None:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            condition = ds.field(name).isin(list(values))
+            expression = condition if expression is None else expression & condition
+
+        df = dataset.to_table(columns=columns + ['__filename'], filter=expression).to_pandas()
+        if latest and not df.empty:
+            # part files are named by write time, the last one per key wins
+            df['__filename'] = df['__filename'].map(os.path.basename)
+            df = df.sort_values('__filename', kind='stable').drop_duplicates(['segment_id'] + PARTITIONS, keep='last')
+        return df[columns].reset_index(drop=True)
+
+    def join(self, left, right, columns=('actions', 'rule_ids'), how='inner', **filters):
+        """
+        Joins two stages on segment_id, e.g. join('symbolic', '6-asd_rulelmm') lines up the engine's
+        actions with the LLM answers. Column names get the stage names as suffixes.
+        """
+        frames = []
+        for stage in (left, right):
+            df = self.read(columns=columns, stage=stage, **filters).drop(columns='stage')
+            frames.append(df.rename(columns={c: f"{c}_{stage}" for c in df.columns if c != 'segment_id'}))
+        return frames[0].merge(frames[1], on='segment_id', how=how)
+
+
+class BatchWriter:
+
+    def __init__(self, store, stage, model, run, batch_size=50):
+        # buffers per-segment outputs and appends them to the store in batches
+        self.store = store
+        self.stage = stage
+        self.model = model
+        self.run = run
+        self.batch_size = batch_size
+        self.records = {}
+
+    def add(self, segment_id, record):
+        self.records[segment_id] = record
+        if len(self.records) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        records, self.records = self.records, {}
+        return self.store.append(self.stage, self.model, self.run, records)
+
+
+def main():
+    # load existing JSON result files into the store
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default='../results')
+    parser.add_argument('--path', nargs='+', required=True, help='JSON result files, {segment_id: output}')
+    parser.add_argument('--stage', required=True, help='asd, tkg, symbolic or the experiment folder, e.g. 6-asd_rulelmm')
+    parser.add_argument('--model', default='unknown')
+    parser.add_argument('--run', default=None, help='defaults to the file name')
+    args = parser.parse_args()
+
+    store = ResultStore(args.store)
+    for path in args.path:
+        with open(path, 'r') as f:
+            records = json.load(f)
+        run = args.run or os.path.splitext(os.path.basename(path))[0]
+        store.append(args.stage, args.model, run, records)
+        print(f"{path}: {len(records)} segments -> stage={args.stage}/model={args.model}/run={run}")
+
+
+if __name__ == '__main__':
+    main()
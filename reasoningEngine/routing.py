@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import wait
+import llm_client
+from prompt_format import estimate_tokens
+from metrics import tracer
+from action_lexicon import action_classes
+
+# USD per million (input, output) tokens, Gemini API list prices
+PRICES = {
+    'gemini-2.5-flash-lite': (0.10, 0.40),
+    'gemini-2.5-flash': (0.30, 2.50),
+    'gemini-2.5-pro': (1.25, 10.00),
+}
+# a Gemini image part counts as 258 input tokens
+IMAGE_TOKENS = 258
+
+CONFIDENCE_PROMPT = '\nAlso add a field "confidence" to the JSON: a number between 0 and 1, how sure you are that the actions are right.'
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uk_rules.json')
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def parse(text):
+    clean_text = text.strip('`').lstrip('json\n')
+    return json.loads(clean_text)
+
+
+class Cascade:
+
+    def __init__(self, models, min_confidence=0.7, samples=1, required=('action',), rules_path=RULES_PATH):
+        """
+        Sends each request to the first (cheapest) model and escalates to the next one when the
+        answer is not good enough:
+
+        - 'schema': no JSON object, or a required key is missing or empty;
+        - 'vocabulary': the reasoning path cites a rule, by id or else by UKRuleid, that is not in the rules;
+        - 'confidence': the self-reported "confidence" is below `min_confidence`, or the
+          `samples` answers of the cheap model fall into different action classes;
+        - 'engine': given the segment's ASD, no action of the answer is in an action class of
+          the DrivingLogicEngine actions.
+
+        The last model's answer is kept whatever it is. Cost uses estimate_tokens() of the prompt
+        and answer text at the PRICES of each model.
+
+        Args:
+            models (list[str]): model names, cheapest first.
+            min_confidence (float): self-reported confidence below which an answer escalates.
+            samples (int): answers drawn concurrently from every model but the last.
+            required (tuple): keys the answer JSON must have.
+            rules_path (str): rules for the vocabulary check and the engine.
+        """
+        self.models = models
+        self.min_confidence = min_confidence
+        self.samples = samples
+        self.required = required
+        self.rules_path = rules_path
+        with open(rules_path, 'r') as f:
+            rules = json.load(f)
+        self.rule_ids = {int(rule['id']) for rule in rules}
+        self.rule_names = {str(rule['UKRuleid']).lower() for rule in rules if rule.get('UKRuleid')}
+        self.engine = None
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {
+            'segments': 0, 'escalated': 0, 'reasons': Counter(), 'requests': Counter(),
+            'cost': 0.0, 'cost_last_only': 0.0, 'latency': [],
+        })
+
+    def engine_actions(self, scene):
+        if self.engine is None:
+            # only built for strategies that pass an ASD
+            from reason_engine import DrivingLogicEngine
+            with open(self.rules_path, 'r') as f:
+                # no log file and no console output inside the experiment scripts
+                self.engine = DrivingLogicEngine(json.load(f), False, log_dir=None)
+        actions, _ = self.engine.reasoning(None, scene)
+        return [a['action'] for a in actions]
+
+    def known_rule(self, step):
+        # a reasoning path step ({"id": N, "UKRuleid": "Rule X", ...} or a bare id) that cites a rule of the rulebook
+        rule_id, name = (step.get('id'), step.get('UKRuleid')) if isinstance(step, dict) else (step, None)
+        if rule_id is not None:
+            try:
+                return int(rule_id) in self.rule_ids
+            except (TypeError, ValueError):
+                name = name or rule_id
+        # answers that cite the Highway Code rule only
+        return name is not None and str(name).lower() in self.rule_names
+
+    def cost(self, model_name, tokens_in, tokens_out):
+        price_in, price_out = PRICES.get(model_name, (0.0, 0.0))
+        return (tokens_in * price_in + tokens_out * price_out) / 1e6
+
+    def check(self, answers, expected):
+        # reason to escalate, None when the first answer is good enough
+        answer = answers[0]
+        if not isinstance(answer, dict) or any(not answer.get(key) for key in self.required):
+            return 'schema'
+        for step in _as_list(answer.get('reasoning_path')):
+            if not self.known_rule(step):
+                return 'vocabulary'
+        confidence = answer.get('confidence')
+        if isinstance(confidence, (int, float)) and confidence < self.min_confidence:
+            return 'confidence'
+        classes = action_classes(_as_list(answer.get('action')))
+        if any(not isinstance(a, dict) or action_classes(_as_list(a.get('action'))) != classes for a in answers[1:]):
+            return 'confidence'
+        if expected is not None:
+            expected_classes = action_classes(expected)
+            if expected_classes and not classes & expected_classes:
+                return 'engine'
+        return None
+
+    def ask(self, model_name, contents, segment_id, strategy, n):
+        model = llm_client.model(model_name)
+        futures = [llm_client.spawn(model.generate_content, contents) for _ in range(n)]
+        with tracer.span('llm', segment_id, strategy, model=model_name):
+            wait(futures)
+        answers, tokens_out = [], 0
+        for future in futures:
+            try:
+                text = future.result().text
+                tokens_out += estimate_tokens(text)
+                answers.append(parse(text))
+            except Exception as e:
+                print(f"An error occurred: {e}")
+                answers.append(None)
+        return answers, tokens_out
+
+    def generate(self, contents, segment_id=None, strategy=None, scene=None):
+        """
+        Answer of the cascade for one request, contents as for generate_content. `scene` is the
+        segment's ASD for the engine check, None to skip it.
+
+        Returns:
+            dict: parsed JSON answer of the model that was kept, None if it could not be parsed.
+        """
+        contents = [c + CONFIDENCE_PROMPT if i == 0 and isinstance(c, str) else c for i, c in enumerate(contents)]
+        tokens_in = sum(estimate_tokens(c) if isinstance(c, str) else IMAGE_TOKENS for c in contents)
+        expected = self.engine_actions(scene) if scene is not None else None
+
+        start = time.perf_counter()
+        requests, cost, reasons = Counter(), 0.0, []
+        for tier, model_name in enumerate(self.models):
+            last = tier == len(self.models) - 1
+            n = 1 if last else self.samples
+            answers, tokens_out = self.ask(model_name, contents, segment_id, strategy, n)
+            requests[model_name] += n
+            cost += self.cost(model_name, n * tokens_in, tokens_out)
+            reason = None if last else self.check(answers, expected)
+            if reason is None:
+                break
+            reasons.append(reason)
+            print(f"Escalating {segment_id} from {model_name}: {reason}")
+
+        with self.lock:
+            s = self.stats[strategy]
+            s['segments'] += 1
+            s['escalated'] += bool(reasons)
+            s['reasons'].update(reasons)
+            s['requests'].update(requests)
+            s['cost'] += cost
+            s['cost_last_only'] += self.cost(self.models[-1], tokens_in, tokens_out / n)
+            s['latency'].append(time.perf_counter() - start)
+        return answers[0]
+
+    def print_summary(self, printer=print):
+        for strategy, s in self.stats.items():
+            latency = sorted(s['latency'])
+            p50 = latency[len(latency) // 2]
+            p99 = latency[min(len(latency) - 1, int(0.99 * len(latency)))]
+            printer(
+                f"Cascade {strategy}: {s['segments']} segments, {s['escalated']} escalated ({s['escalated'] / s['segments']:.0%}) "
+                f"{dict(s['reasons'])}, requests {dict(s['requests'])}, cost ${s['cost']:.4f} "
+                f"(${s['cost_last_only']:.4f} with {self.models[-1]} only), latency p50 {p50:.2f}s p99 {p99:.2f}s"
+            )
+
+
+# shared by the scripts of one process, None sends every request to --model_name
+router = None
+
+
+def configure(models=None, min_confidence=0.7, samples=1, rules_path=RULES_PATH):
+    global router
+    router = Cascade(models, min_confidence, samples, rules_path=rules_path) if models else None
+    return router
+
+
+def print_summary(printer=print):
+    if router is not None:
+        router.print_summary(printer)
@@ -0,0 +1,230 @@
+import json
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+MAGIC = b'RIDX0002'
+
+
+class _Node:
+    # build-time trie node, flattened into arrays by RuleIndex.build
+    __slots__ = ('children', 'rules')
+
+    def __init__(self):
+        self.children = {}
+        self.rules = []
+
+
+class RuleIndex:
+
+    ARRAYS = ('child_start', 'child_key', 'child_node', 'rule_start', 'rule_ids', 'rule_actions', 'rule_neg')
+
+    def __init__(self, actions, negations=(), **arrays):
+        """
+        Compiled rule trie in CSR form.
+
+        Node n has its children in child_key/child_node[child_start[n]:child_start[n+1]], sorted by
+        axiom id, and the rules ending at it in rule_ids/rule_actions/rule_neg[rule_start[n]:rule_start[n+1]].
+        Actions are interned, rule_actions holds indices into `actions`. Node 0 is the root.
+
+        The trie path holds the positive conditions of a rule. Negated conditions (negation as
+        failure) are a must-be-zero bitmask over axiom ids, rule_neg holds its index into
+        `negations` or -1 when the rule has none.
+
+        Args:
+            actions (list[str]): interned action strings.
+            negations (list[int]): interned must-be-zero masks.
+            arrays: the int32 arrays named in ARRAYS, as array('i') or memoryviews of a mapped file.
+        """
+        self.actions = actions
+        self.negations = list(negations)
+        for name in self.ARRAYS:
+            setattr(self, name, arrays[name])
+        self.n_nodes = len(self.child_start) - 1
+
+    @classmethod
+    def build(cls, entries):
+        """
+        Args:
+            entries: iterable of (sorted axiom id list, rule_id, action, negated axiom id list).
+        """
+        root = _Node()
+        actions, action_id = [], {}
+        negations, negation_id = [], {}
+        for cond_id_list, rule_id, action, neg_id_list in entries:
+            if not cond_id_list and not neg_id_list:
+                continue
+            node = root
+            for cid in cond_id_list:
+                child = node.children.get(cid)
+                if child is None:
+                    child = node.children[cid] = _Node()
+                node = child
+            if action not in action_id:
+                action_id[action] = len(actions)
+                actions.append(action)
+            neg = -1
+            if neg_id_list:
+                mask = 0
+                for cid in neg_id_list:
+                    mask |= 1 << cid
+                if mask not in negation_id:
+                    negation_id[mask] = len(negations)
+                    negations.append(mask)
+                neg = negation_id[mask]
+            rule = (rule_id, action_id[action], neg)
+            if rule not in node.rules:
+                node.rules.append(rule)
+
+        arrays = {name: array('i') for name in cls.ARRAYS}
+        # breadth first, so each node's children get consecutive numbers
+        order = [root]
+        for node in order:
+            arrays['child_start'].append(len(arrays['child_key']))
+            arrays['rule_start'].append(len(arrays['rule_ids']))
+            for cid in sorted(node.children):
+                arrays['child_key'].append(cid)
+                arrays['child_node'].append(len(order))
+                order.append(node.children[cid])
+            for rule_id, aid, neg in node.rules:
+                arrays['rule_ids'].append(rule_id)
+                arrays['rule_actions'].append(aid)
+                arrays['rule_neg'].append(neg)
+        arrays['child_start'].append(len(arrays['child_key']))
+        arrays['rule_start'].append(len(arrays['rule_ids']))
+        return cls(actions, negations, **arrays)
+
+    def child(self, node, cid):
+        lo, hi = self.child_start[node], self.child_start[node + 1]
+        i = bisect_left(self.child_key, cid, lo, hi)
+        if i < hi and self.child_key[i] == cid:
+            return self.child_node[i]
+        return -1
+
+    def match(self, fact_ids):
+        """
+        Returns (rule_id, action) for every rule whose conditions are all in fact_ids
+        and whose negated conditions are all absent from them.
+        """
+        frontier = [0]
+        fact_mask = 0
+        for cid in sorted(set(fact_ids)):
+            # nodes reached with this fact are only extended by larger ids
+            frontier.extend([c for c in (self.child(n, cid) for n in frontier) if c >= 0])
+            fact_mask |= 1 << cid
+        fired = []
+        for n in frontier:
+            for i in range(self.rule_start[n], self.rule_start[n + 1]):
+                neg = self.rule_neg[i]
+                if neg >= 0 and fact_mask & self.negations[neg]:
+                    continue
+                fired.append((self.rule_ids[i], self.actions[self.rule_actions[i]]))
+        return fired
+
+    def match_batch(self, columns, variants):
+        """
+        Matches many fact sets in one walk of the trie. Fact sets are numbered 0..n-1 and
+        columns[cid] is the bitset of the fact sets that hold axiom cid. Each node carries the
+        bitset of the fact sets that reach it, a branch is left as soon as that set is empty.
+
+        Args:
+            columns (dict): axiom id -> int bitset over fact sets.
+            variants (int): bitset of all fact sets, (1 << n) - 1.
+
+        Returns:
+            list: (rule_id, action, bitset of the fact sets the rule fires in).
+        """
+        fired = []
+        negated = {}
+        stack = [(0, variants)]
+        while stack:
+            n, live = stack.pop()
+            for i in range(self.rule_start[n], self.rule_start[n + 1]):
+                neg = self.rule_neg[i]
+                fires = live
+                if neg >= 0:
+                    if neg not in negated:
+                        negated[neg] = 0
+                        for cid in self.negated_ids(i):
+                            negated[neg] |= columns.get(cid, 0)
+                    fires &= ~negated[neg]
+                if fires:
+                    fired.append((self.rule_ids[i], self.actions[self.rule_actions[i]], fires))
+            for j in range(self.child_start[n], self.child_start[n + 1]):
+                reached = live & columns.get(self.child_key[j], 0)
+                if reached:
+                    stack.append((self.child_node[j], reached))
+        return fired
+
+    def negated_ids(self, i):
+        # axiom ids of the must-be-zero mask of rule entry i
+        if self.rule_neg[i] < 0:
+            return ()
+        mask = self.negations[self.rule_neg[i]]
+        return tuple(cid for cid in range(mask.bit_length()) if mask >> cid & 1)
+
+    def rules(self, node=0, path=()):
+        # (path of axiom ids, negated axiom ids, rule_id, action) for every rule, depth first
+        for i in range(self.rule_start[node], self.rule_start[node + 1]):
+            yield path, self.negated_ids(i), self.rule_ids[i], self.actions[self.rule_actions[i]]
+        for i in range(self.child_start[node], self.child_start[node + 1]):
+            yield from self.rules(self.child_node[i], path + (self.child_key[i],))
+
+    def nbytes(self):
+        return sum(len(getattr(self, name)) * 4 for name in self.ARRAYS) + sum((m.bit_length() + 7) // 8 for m in self.negations)
+
+    def save(self, path, axioms=None):
+        """
+        Writes the index to one file: magic, header length, JSON header (actions, negation masks
+        as hex, array lengths, optional axiom table), then the int32 arrays back to back, 4-byte aligned.
+        """
+        header = {
+            'actions': self.actions,
+            'negations': [format(m, 'x') for m in self.negations],
+            'lengths': {name: len(getattr(self, name)) for name in self.ARRAYS},
+            'axioms': axioms,
+        }
+        header = json.dumps(header).encode('utf-8')
+        header += b' ' * (-len(header) % 4)
+        with open(path, 'wb') as f:
+            f.write(MAGIC)
+            f.write(struct.pack('<I', len(header)))
+            f.write(header)
+            for name in self.ARRAYS:
+                arr = getattr(self, name)
+                f.write(arr.tobytes() if isinstance(arr, array) else bytes(arr))
+
+    @classmethod
+    def load(cls, path, use_mmap=True):
+        """
+        Reads an index written by save(). With use_mmap the arrays are read-only views of the
+        mapped file, so forked workers share the same pages.
+
+        Returns:
+            tuple: (RuleIndex, axiom table or None)
+        """
+        with open(path, 'rb') as f:
+            if use_mmap:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        if bytes(buf[:len(MAGIC)]) != MAGIC:
+            raise ValueError(f"{path} is not a rule index file")
+        offset = len(MAGIC)
+        (header_len,) = struct.unpack_from('<I', buf, offset)
+        offset += 4
+        header = json.loads(bytes(buf[offset:offset + header_len]))
+        offset += header_len
+
+        view = memoryview(buf)
+        arrays = {}
+        for name in cls.ARRAYS:
+            n = header['lengths'][name]
+            if use_mmap:
+                arrays[name] = view[offset:offset + 4 * n].cast('i')
+            else:
+                arrays[name] = array('i', bytes(view[offset:offset + 4 * n]))
+            offset += 4 * n
+        negations = [int(m, 16) for m in header['negations']]
+        return cls(header['actions'], negations, **arrays), header['axioms']
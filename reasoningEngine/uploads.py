@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import hashlib
+import mimetypes
+import threading
+from concurrent.futures import Future
+import llm_client
+
+# Gemini keeps uploaded files for 48 hours
+DEFAULT_TTL = 48 * 3600
+
+
+class GeminiUploader:
+    # uploads through the Gemini Files API
+    kind = 'gemini'
+
+    def upload(self, path, mime_type):
+        f = llm_client.gemini().upload_file(path, mime_type=mime_type)
+        expires = f.expiration_time.timestamp() if f.expiration_time else time.time() + DEFAULT_TTL
+        return {'name': f.name, 'uri': f.uri, 'mime_type': mime_type, 'expires': expires}
+
+
+class LocalUploader:
+
+    kind = 'local'
+
+    def __init__(self, root, ttl=DEFAULT_TTL):
+        """
+        Local stand-in for the Files API: copies each upload into `root`, named by its content hash
+        so processes sharing `root` never overwrite each other's files, and returns a file:// handle
+        that expires after `ttl` seconds. `uploads` counts the calls, for checking reuse offline.
+        """
+        self.root = root
+        self.ttl = ttl
+        self.uploads = 0
+        os.makedirs(root, exist_ok=True)
+
+    def upload(self, path, mime_type):
+        self.uploads += 1
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        target = os.path.join(self.root, digest + os.path.splitext(path)[1])
+        tmp = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(path, tmp)
+        os.replace(tmp, target)
+        return {
+            'name': f"files/{digest}",
+            'uri': 'file://' + os.path.abspath(target),
+            'mime_type': mime_type,
+            'expires': time.time() + self.ttl,
+        }
+
+
+class UploadRegistry:
+
+    def __init__(self, uploader, path=None, margin=3600):
+        """
+        Uploads every image once per content hash and reuses the handle until it is about to expire.
+
+        Handles are kept in a JSON file when `path` is set, so they are shared by the strategies,
+        scripts and runs that use the same file. Concurrent processes merge their handles into it
+        under a lock file, and a handle missing from memory is looked up in the file before uploading.
+
+        Args:
+            uploader: GeminiUploader or LocalUploader.
+            path (str): JSON file of "<uploader kind>:<sha256>" -> handle, None to keep handles in memory only.
+            margin (int): seconds before expiry after which a handle is uploaded again.
+        """
+        self.uploader = uploader
+        self.path = path
+        self.margin = margin
+        self.lock = threading.Lock()
+        self.uploaded = 0
+        self.reused = 0
+        self.handles = {}
+        # key -> Future of an upload in progress
+        self.pending = {}
+        if path:
+            self.merge()
+
+    def valid(self, handle):
+        return handle is not None and handle['expires'] - time.time() > self.margin
+
+    def handle(self, file_path, mime_type=None):
+        with open(file_path, 'rb') as f:
+            # handles of the local stand-in are file:// URIs, they must never reach the Files API
+            key = f"{self.uploader.kind}:{hashlib.sha256(f.read()).hexdigest()}"
+        with self.lock:
+            if not self.valid(self.handles.get(key)) and self.path:
+                # another process may have uploaded it since we last read the file
+                self.merge()
+            handle = self.handles.get(key)
+            if self.valid(handle):
+                self.reused += 1
+                return handle
+            # a thread already uploading this image shares its result
+            pending = self.pending.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.pending[key] = Future()
+        if not owner:
+            handle = pending.result()
+            with self.lock:
+                self.reused += 1
+            return handle
+
+        # the upload runs without the lock, other threads keep resolving their images meanwhile
+        try:
+            mime_type = mime_type or mimetypes.guess_type(file_path)[0] or 'application/octet-stream'
+            handle = self.uploader.upload(file_path, mime_type)
+        except BaseException as e:
+            with self.lock:
+                del self.pending[key]
+            pending.set_exception(e)
+            raise
+        with self.lock:
+            self.uploaded += 1
+            self.merge({key: handle})
+            del self.pending[key]
+        pending.set_result(handle)
+        return handle
+
+    def part(self, file_path):
+        # content part for generate_content, in place of the inline PIL image
+        handle = self.handle(file_path)
+        return {'file_data': {'mime_type': handle['mime_type'], 'file_uri': handle['uri']}}
+
+    def merge(self, new=None):
+        """
+        Merges the handles in the file, ours and `new` (the latest expiry wins for each key), and
+        writes the live ones back. The read-merge-replace runs under an exclusive lock on
+        "<path>.lock", so processes sharing the file do not drop each other's handles.
+        """
+        self.handles.update(new or {})
+        if not self.path:
+            return
+        with open(f"{self.path}.lock", 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.path):
+                    with open(self.path, 'r') as f:
+                        stored = json.load(f)
+                    for key, handle in stored.items():
+                        if key not in self.handles or handle['expires'] > self.handles[key]['expires']:
+                            self.handles[key] = handle
+                now = time.time()
+                self.handles = {k: v for k, v in self.handles.items() if v['expires'] > now}
+                if new is None:
+                    return
+                # readers that do not take the lock still see a whole file
+                tmp = f"{self.path}.{os.getpid()}.tmp"
+                with open(tmp, 'w') as f:
+                    json.dump(self.handles, f, indent=1)
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def save(self):
+        self.merge({})
+
+
+# shared by the scripts of one process, None sends images inline
+registry = None
+
+
+def configure(path=None, local_dir=None):
+    """
+    Enables the upload registry for image_part(). `local_dir` uses the local stand-in instead of the Files API.
+    """
+    global registry
+    if path is None and local_dir is None:
+        registry = None
+        return None
+    uploader = LocalUploader(local_dir) if local_dir else GeminiUploader()
+    registry = UploadRegistry(uploader, path)
+    return registry
+
+
+def image_part(path):
+    if registry is None:
+        import PIL.Image
+        return PIL.Image.open(path)
+    return registry.part(path)
+
+
+def print_summary(printer=print):
+    if registry is not None:
+        printer(f"Uploads: {registry.uploaded} images uploaded, {registry.reused} reused handles")
@@ -0,0 +1,246 @@
+import os
+import json
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from reason_engine import VOCABULARY_PATH, NEGATION
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'uk_rules.json')
+
+
+def levenshtein(a, b, limit=None):
+    # edit distance, gives up with limit + 1 once every path is longer than limit
+    if len(a) < len(b):
+        a, b = b, a
+    if limit is not None and len(a) - len(b) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class BKTree:
+
+    def __init__(self, words):
+        """
+        Burkhard-Keller tree over edit distance. A query within distance d of a node only has to
+        visit the children whose edge distance lies in [dist - d, dist + d].
+        """
+        self.root = None
+        for word in sorted(set(words)):
+            self.add(word)
+
+    def add(self, word):
+        if self.root is None:
+            self.root = (word, {})
+            return
+        node = self.root
+        while True:
+            d = levenshtein(word, node[0])
+            if d == 0:
+                return
+            if d not in node[1]:
+                node[1][d] = (word, {})
+                return
+            node = node[1][d]
+
+    def search(self, word, max_distance):
+        # [(distance, term)] of every term within max_distance, nearest first
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            term, children = stack.pop()
+            d = levenshtein(word, term)
+            if d <= max_distance:
+                found.append((d, term))
+            stack.extend(child for edge, child in children.items() if d - max_distance <= edge <= d + max_distance)
+        return sorted(found)
+
+
+def _terms(items, position=None):
+    # vocabulary entries, or one element of the "(a, b)" pairs
+    terms = []
+    for item in items:
+        parts = [p.strip() for p in str(item).strip('()').split(',')]
+        terms.append(parts[position] if position is not None and position < len(parts) else parts[-1])
+    return terms
+
+
+def _leaves(value):
+    if isinstance(value, dict):
+        return list(value) + [t for v in value.values() for t in _leaves(v)]
+    return list(value)
+
+
+class VocabularyNormalizer:
+
+    def __init__(self, vocabulary=VOCABULARY_PATH, rules=RULES_PATH, max_distance=2, ratio=0.25):
+        """
+        Maps off-vocabulary terms of an ASD to the nearest term allowed in their slot, e.g.
+        road_user "(red bus, left_lane, invisible, overtak_ego)" -> status overtake_ego.
+
+        Every (ASD key, tuple position) slot gets a BK-tree over its terms from vocabulary.json.
+        A term already in the vocabulary or in any rule condition is kept as is. Any other term
+        is replaced by its nearest slot term within min(max_distance, ratio * len(term)) edits,
+        ties going to terms the rules use. For road users only the last word is checked, so
+        descriptions such as "red van" keep their colour.
+
+        Args:
+            vocabulary (str | dict): vocabulary.json path or content.
+            rules (str | list): rules json path or content.
+        """
+        if isinstance(vocabulary, str):
+            with open(vocabulary, 'r') as f:
+                vocabulary = json.load(f)
+        if isinstance(rules, str):
+            with open(rules, 'r') as f:
+                rules = json.load(f)
+        self.max_distance = max_distance
+        self.ratio = ratio
+
+        status = vocabulary['status']
+        features = vocabulary['road_features'] + vocabulary['other_features'] + vocabulary['preposition']
+        slots = {
+            ('situation', 1): _terms(vocabulary['ego_situation'], 0) + vocabulary['preposition'],
+            ('situation', 2): _terms(vocabulary['ego_situation'], 1) + features + status['features_device_status'],
+            ('control_device', 0): vocabulary['control_device'],
+            ('control_device', 2): status['control_device_status'],
+            ('control_device', 3): status['control_device_status'],
+            ('road_user', 0): _leaves(vocabulary['road user']),
+            ('road_user', 1): vocabulary['road_user_position'],
+            ('road_user', 2): status['road_user_status'],
+            ('road_user', 3): status['road_user_status'],
+            ('intention', 1): vocabulary['ego_intention'],
+        }
+        self.rule_terms = set()
+        for rule in rules:
+            for condition in rule.get('conditions', []):
+                if condition.startswith(NEGATION):
+                    condition = condition[len(NEGATION):]
+                self.rule_terms.update(p.strip() for p in condition.split(','))
+        self.known = self.rule_terms | {t for terms in slots.values() for t in terms}
+        self.trees = {slot: BKTree(terms) for slot, terms in slots.items()}
+        self.memo = {}
+
+    def nearest(self, slot, term):
+        # replacement for an unknown term, None when nothing is close enough
+        if (slot, term) not in self.memo:
+            limit = min(self.max_distance, int(len(term) * self.ratio))
+            found = self.trees[slot].search(term, limit) if limit > 0 else []
+            found.sort(key=lambda m: (m[0], m[1] not in self.rule_terms, m[1]))
+            self.memo[slot, term] = found[0][1] if found else None
+        return self.memo[slot, term]
+
+    def normalize_term(self, slot, term):
+        """
+        Returns:
+            tuple: (term to use, (old, new) when it was replaced, the term when it is unknown and
+            nothing is close, else None)
+        """
+        words = term.split(' ')
+        # only the last word of a road user names its class
+        head = words[-1] if slot == ('road_user', 0) else term.replace(' ', '_')
+        if head in self.known or slot not in self.trees:
+            return term, None, None
+        new = self.nearest(slot, head)
+        if new is None:
+            return term, None, head
+        if slot == ('road_user', 0):
+            new = ' '.join(words[:-1] + [new])
+        return new, (term, new), None
+
+    def normalize_statement(self, key, statement):
+        parts = [p.strip() for p in str(statement).strip('()').split(',')]
+        corrections, unknown = [], []
+        for i, part in enumerate(parts):
+            parts[i], corrected, missing = self.normalize_term((key, i), part)
+            if corrected:
+                corrections.append(corrected)
+            if missing:
+                unknown.append(missing)
+        return f"({', '.join(parts)})", corrections, unknown
+
+    def normalize_asd(self, asd):
+        """
+        Returns:
+            tuple: (normalized ASD, [(old, new)] replacements, [terms left unknown])
+        """
+        if not isinstance(asd, dict):
+            return asd, [], []
+        normalized, corrections, unknown = dict(asd), [], []
+        for key, statements in asd.items():
+            if not isinstance(statements, list):
+                continue
+            normalized[key] = []
+            for statement in statements:
+                new, c, u = self.normalize_statement(key, statement)
+                normalized[key].append(new)
+                corrections += c
+                unknown += u
+        return normalized, corrections, unknown
+
+
+# one normalizer per worker process, built by the pool initializer
+_worker = None
+
+
+def _init_worker(vocabulary, rules, max_distance):
+    global _worker
+    _worker = VocabularyNormalizer(vocabulary, rules, max_distance)
+
+
+def _normalize_chunk(items):
+    return [(seg_id, *_worker.normalize_asd(asd)) for seg_id, asd in items]
+
+
+def normalize_scenes(scenes, vocabulary=VOCABULARY_PATH, rules=RULES_PATH, max_distance=2, workers=None, chunk_size=256):
+    """
+    Normalizes a whole {segment_id: ASD} dict on a process pool, in chunks of chunk_size scenes.
+
+    Returns:
+        tuple: ({segment_id: normalized ASD}, Counter of (old, new), Counter of unknown terms)
+    """
+    items = list(scenes.items())
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    normalized, corrections, unknown = {}, Counter(), Counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(vocabulary, rules, max_distance)) as pool:
+        for chunk in pool.map(_normalize_chunk, chunks):
+            for seg_id, asd, c, u in chunk:
+                normalized[seg_id] = asd
+                corrections.update(c)
+                unknown.update(u)
+    return normalized, corrections, unknown
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scene', default='lingoqa_gtasd.json')
+    parser.add_argument('--save_path', type=str, default=None, help='defaults to <scene>-normalized.json')
+    parser.add_argument('--vocabulary', default=VOCABULARY_PATH)
+    parser.add_argument('--rules', default=RULES_PATH)
+    parser.add_argument('--max_distance', type=int, default=2)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with open(args.scene, 'r') as f:
+        scenes = json.load(f)
+    normalized, corrections, unknown = normalize_scenes(scenes, args.vocabulary, args.rules, args.max_distance, args.workers)
+    save_path = args.save_path or args.scene.replace('.json', '-normalized.json')
+    with open(save_path, 'w') as f:
+        json.dump(normalized, f, indent=4)
+
+    print(f"{len(normalized)} scenes, {sum(corrections.values())} terms replaced, {sum(unknown.values())} left unknown -> {save_path}")
+    for (old, new), n in corrections.most_common(20):
+        print(f"\t{old} -> {new}: {n}")
+    if unknown:
+        print(f"\tunknown: {', '.join(t for t, _ in unknown.most_common(20))}")
+
+
+if __name__ == '__main__':
+    main()
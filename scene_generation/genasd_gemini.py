@@ -1,21 +1,18 @@
 import os, sys
 import json
 import re
-import google.generativeai as genai
-import PIL.Image
-from dotenv import load_dotenv
 import argparse
 import pandas as pd
 project_root = os.path.abspath(os.path.join(os.getcwd(), '..'))
 if project_root not in sys.path:
     sys.path.append(project_root)
 from models.generate_scene import Scene
+import metrics
+import uploads
+import llm_client
 
 
 def main():
-    load_dotenv()
-    os.getenv("GOOGLE_API_KEY")
-    genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
     parser = argparse.ArgumentParser()
     parser.add_argument('--image_dir', default='../images/path')
@@ -23,7 +20,19 @@ def main():
     parser.add_argument('--vocabulary', default='vocabulary.json')
     parser.add_argument('--model_name', default="gemini-2.5-pro")
     parser.add_argument('--save_path', type=str, default=None)
+    parser.add_argument('--trace_path', type=str, default=None, help='append stage spans to this JSON-lines file')
+    parser.add_argument('--metrics_port', type=int, default=None, help='serve Prometheus metrics on this port')
+    parser.add_argument('--upload_registry', type=str, default=None, help='upload each image once and reuse the handles stored in this JSON file')
+    parser.add_argument('--upload_local_dir', type=str, default=None, help='use a local stand-in for the Files API, for offline runs')
+    parser.add_argument('--samples', type=int, default=1, help='concurrent ASD samples per segment, the majority is kept')
+    parser.add_argument('--quorum', type=int, default=None, help='agreeing samples that end the vote early, a majority by default')
+    parser.add_argument('--rules', type=str, default=None, help='vote on the facts that drive these rules instead of on all tuples')
+    parser.add_argument('--deadline', type=float, default=120.0, help='seconds before a model request is given up')
+    parser.add_argument('--stand_in', type=str, default=None, help='JSON options of a local stand-in model, e.g. \'{"slow_rate": 0.1, "fail_rate": 0.05}\'')
     args = parser.parse_args()
+    tracer = metrics.configure(args.trace_path, args.metrics_port)
+    uploads.configure(args.upload_registry, args.upload_local_dir)
+    llm_client.configure(args.deadline, args.stand_in)
 
     image_dir = args.image_dir
     save_path = args.save_path
@@ -41,8 +50,19 @@ def main():
     videos = os.listdir(image_dir) 
     video_ids = [os.path.splitext(f)[0] for f in videos if f.endswith('.jpg')] # get all existent image ids
 
-    generate_scene = Scene(model_name, vocab_path) # initialise scene generation model
-    generate_scene.get_scene(image_dir, video_ids, unique_video, save_path) # generate scene for all images and save to save_path
+    engine = None
+    if args.rules:
+        from reason_engine import DrivingLogicEngine
+        with open(args.rules, 'r') as f:
+            # a quiet engine: no log file, no rule dump on stdout, the facts checked against --vocabulary
+            engine = DrivingLogicEngine(json.load(f), False, vocabulary=vocab_path, log_dir=None)
+
+    generate_scene = Scene(model_name, vocab_path, engine) # initialise scene generation model
+    generate_scene.get_scene(image_dir, video_ids, unique_video, save_path, args.samples, args.quorum) # generate scene for all images and save to save_path
+    uploads.print_summary()
+    llm_client.print_summary()
+    tracer.print_summary()
+    tracer.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
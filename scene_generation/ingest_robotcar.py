@@ -0,0 +1,136 @@
+import os, sys
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import PIL.Image
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine'))
+from frames import N_FRAMES, GAP
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_frames(source):
+    # (timestamp in microseconds, path) of every frame below source, RobotCar names frames by timestamp
+    found = []
+    for dirpath, _, filenames in os.walk(source):
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTENSIONS and stem.isdigit():
+                found.append((int(stem), os.path.join(dirpath, name)))
+    return sorted(found)
+
+
+def plan_segments(frames, frame_interval=0.35, n_frames=N_FRAMES):
+    """
+    Samples one frame every `frame_interval` seconds and groups the samples into non-overlapping
+    segments of n_frames. The segment id is the timestamp of its first frame, as for the
+    composites in dataset/Robotcar/videos.
+    """
+    step = int(frame_interval * 1e6)
+    sampled, next_ts = [], None
+    for ts, path in frames:
+        if next_ts is None or ts >= next_ts:
+            sampled.append((ts, path))
+            next_ts = ts + step
+    return [
+        {'segment_id': str(group[0][0]), 'frame_timestamps': [ts for ts, _ in group], 'frame_paths': [p for _, p in group]}
+        for group in (sampled[i:i + n_frames] for i in range(0, len(sampled) - n_frames + 1, n_frames))
+    ]
+
+
+def debayer(raw):
+    # RobotCar stereo images are raw GBRG Bayer, bin each 2x2 block into one RGB pixel
+    g1, b = raw[0::2, 0::2].astype(np.uint16), raw[0::2, 1::2]
+    r, g2 = raw[1::2, 0::2], raw[1::2, 1::2]
+    return np.dstack([r, ((g1 + g2) // 2).astype(np.uint8), b])
+
+
+def load_frame(path, bayer=False):
+    with PIL.Image.open(path) as img:
+        if bayer:
+            return PIL.Image.fromarray(debayer(np.asarray(img.convert('L'))))
+        return img.convert('RGB')
+
+
+def build_composite(segment, out_path, frame_width=1280, bayer=False, quality=95):
+    # five frames side by side with white separators, the layout of the LingoQA composites
+    frames = [load_frame(p, bayer) for p in segment['frame_paths']]
+    frame_height = round(frames[0].height * frame_width / frames[0].width)
+    composite = PIL.Image.new('RGB', (len(frames) * frame_width + (len(frames) - 1) * GAP, frame_height), 'white')
+    for i, frame in enumerate(frames):
+        composite.paste(frame.resize((frame_width, frame_height), PIL.Image.BILINEAR), (i * (frame_width + GAP), 0))
+    # renamed into place, so a killed run never leaves a truncated composite that looks finished
+    tmp = out_path + '.tmp'
+    composite.save(tmp, format='JPEG', quality=quality)
+    os.replace(tmp, out_path)
+    return segment['segment_id']
+
+
+def index_segments(segments, image_dir, source):
+    rows = []
+    for segment in segments:
+        image = os.path.join(image_dir, segment['segment_id'] + '.jpg')
+        if not os.path.exists(image):
+            continue
+        timestamps = segment.get('frame_timestamps') or [int(segment['segment_id'])]
+        rows.append({
+            'segment_id': segment['segment_id'],
+            'start_ts': timestamps[0],
+            'end_ts': timestamps[-1],
+            'frame_timestamps': timestamps,
+            'source': source,
+            'image': os.path.basename(image),
+        })
+    return pd.DataFrame(rows, columns=['segment_id', 'start_ts', 'end_ts', 'frame_timestamps', 'source', 'image'])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--source', default=None, help='RobotCar sequence, e.g. 2014-05-14-13-59-05/stereo/centre')
+    parser.add_argument('--output', default='../dataset/Robotcar')
+    parser.add_argument('--frame_interval', type=float, default=0.35, help='seconds between sampled frames')
+    parser.add_argument('--frame_width', type=int, default=1280)
+    parser.add_argument('--bayer', action='store_true', help='frames are raw Bayer images, as in the RobotCar stereo folders')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--index_only', action='store_true', help='only index the composites already in <output>/videos')
+    args = parser.parse_args()
+
+    image_dir = os.path.join(args.output, 'videos')
+    os.makedirs(image_dir, exist_ok=True)
+    index_path = os.path.join(args.output, 'segments.parquet')
+
+    if args.index_only or not args.source:
+        segments = [{'segment_id': os.path.splitext(f)[0]} for f in sorted(os.listdir(image_dir)) if f.endswith('.jpg')]
+        source = None
+    else:
+        segments = plan_segments(list_frames(args.source), args.frame_interval)
+        source = os.path.abspath(args.source)
+        # composites already written by an earlier run are kept, so an interrupted ingestion resumes
+        todo = [s for s in segments if not os.path.exists(os.path.join(image_dir, s['segment_id'] + '.jpg'))]
+        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {len(segments)} segments, {len(segments) - len(todo)} already done")
+        with ProcessPoolExecutor(max_workers=args.workers) as pool:
+            futures = [
+                pool.submit(build_composite, s, os.path.join(image_dir, s['segment_id'] + '.jpg'), args.frame_width, args.bayer)
+                for s in todo
+            ]
+            for n, future in enumerate(as_completed(futures), 1):
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"An error occurred: {e}")
+                if n % 50 == 0 or n == len(futures):
+                    print(f"{datetime.now():%Y-%m-%d %H:%M:%S} {n}/{len(futures)} composites written")
+
+    index = index_segments(segments, image_dir, source)
+    if os.path.exists(index_path) and not args.index_only:
+        # segments of other sequences ingested into the same output stay in the index
+        previous = pd.read_parquet(index_path)
+        index = pd.concat([previous[~previous['segment_id'].isin(index['segment_id'])], index], ignore_index=True)
+    index.to_parquet(index_path, index=False)
+    print(f"{len(index)} segments indexed in {index_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,42 @@
-import os
+import os, sys
 import json
 import re
-import google.generativeai as genai
-import PIL.Image
-from dotenv import load_dotenv
+import time
+from collections import Counter
+from concurrent.futures import wait, FIRST_COMPLETED
 from datetime import datetime
-import argparse
-import pandas as pd
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'reasoningEngine'))
+from metrics import tracer
+import uploads
+import llm_client
+from prompt_format import encode_vocabulary, estimate_tokens
+from vocab_normalizer import VocabularyNormalizer
+
+ASD_KEYS = ['situation', 'control_device', 'road_user', 'intention']
+
+
+def normalize_tuple(statement):
+    # "( Red Van,left_lane ,  moving_forward )" -> "(red van, left_lane, moving_forward)"
+    parts = [re.sub(r'\s+', ' ', p.strip().lower()) for p in str(statement).strip().strip('()').split(',')]
+    return '(' + ', '.join(parts) + ')'
+
+
+def normalize_asd(asd):
+    # the four ASD lists with normalized, deduplicated and sorted tuples, None for a malformed response
+    if not isinstance(asd, dict):
+        return None
+    asd = {str(k).strip().lower(): v for k, v in asd.items()}
+    normalized = {}
+    for key in ASD_KEYS:
+        statements = asd.get(key) or []
+        if not isinstance(statements, list):
+            statements = [statements]
+        normalized[key] = sorted(set(normalize_tuple(s) for s in statements))
+    return normalized
+
 
 class Scene:
-    def __init__(self, model_name, vocab_path):
+    def __init__(self, model_name, vocab_path, engine=None):
         self.example_change_description = {
             "situation": [
                 "(ego, in, residential_area)",
@@ -23,7 +50,7 @@ class Scene:
                 "(silver car, same_lane_front_of, stopped, moving_forward)",
                 "(red van, left_lane, moving_forward, moving_forward)",
                 "(pedestrian, left_sidewalk, walk_away, walk_away)",
-                "(red bus, left_lane, invisible, overtak_ego)",
+                "(red bus, left_lane, invisible, overtake_ego)",
                 "(oncoming_traffic, different_lane_front_of, exist, invisible)",
                 "(black car, very_close_to, crossing, crossing)",
                 "(white car, far_way, moving_forward, moving_forward)"
@@ -62,11 +89,14 @@ class Scene:
 
         with open(vocab_path, 'r') as f:
             self.vocabulary = json.load(f)
+        # encoded once, every prompt gets the same compact vocabulary text
+        self.vocabulary_prompt = encode_vocabulary(self.vocabulary)
+        # near misses such as overtak_ego are mapped back onto the vocabulary
+        self.normalizer = VocabularyNormalizer(self.vocabulary)
 
         self.model_name = model_name
-        load_dotenv()
-        os.getenv("GOOGLE_API_KEY")
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        # with an engine, self-consistency samples vote on the facts that drive its rules
+        self.engine = engine
 
     def extract_words(self, vocab):
         words = set()
@@ -84,24 +114,27 @@ class Scene:
             words.add(vocab)
         return words
 
-    def generate(self, query, img=None):
+    def generate(self, query, img=None, video=None, strategy='asd'):
         try:
         # Initialize the generative model
-            model = genai.GenerativeModel(self.model_name) 
-            if img:
-                response = model.generate_content([query, img])
-            else:
-                response = model.generate_content([query])
+            model = llm_client.model(self.model_name)
+            with tracer.span('llm', video, strategy, model=self.model_name):
+                if img:
+                    response = model.generate_content([query, img])
+                else:
+                    response = model.generate_content([query])
 
             # --- Output and Validation ---
-            response_words = response.text.lower()
-            clean_text = response_words.strip('`').lstrip('json\n')
-            res_words = json.loads(clean_text)
-            res_set = self.extract_words(res_words)
-            vocab_set = self.extract_words(self.vocabulary)
-
-            for word in ['ego', 'relevant']:
-                res_set.discard(word)
+            with tracer.span('response_parse', video, strategy):
+                response_words = response.text.lower()
+                clean_text = response_words.strip('`').lstrip('json\n')
+                res_words = json.loads(clean_text)
+            with tracer.span('vocab_validation', video, strategy):
+                res_set = self.extract_words(res_words)
+                vocab_set = self.extract_words(self.vocabulary)
+
+                for word in ['ego', 'relevant']:
+                    res_set.discard(word)
             # res_set.discard('ego')
             print("Validation Check:")
             if res_set.issubset(vocab_set):
@@ -110,12 +143,79 @@ class Scene:
             else:
                 invalid_words = res_set - vocab_set
                 print(f"Warning! The response contains words not in the vocabulary: {', '.join(invalid_words)}")
+                if strategy == 'asd':
+                    with tracer.span('vocab_normalization', video, strategy):
+                        res_words, corrections, _ = self.normalizer.normalize_asd(res_words)
+                    if corrections:
+                        print(f"Normalized: {', '.join(f'{old} -> {new}' for old, new in corrections)}")
                 return res_words
             
         except Exception as e:
             print(f"An error occurred: {e}")
 
-    def get_scene(self, image_dir, video_ids, ref_video_ids, save_path):
+    def vote_key(self, asd):
+        # what samples have to agree on: the engine's driving facts, or all tuples without an engine
+        if self.engine is None:
+            return frozenset((key, t) for key in ASD_KEYS for t in asd[key])
+        try:
+            return self.engine.driving_facts(asd)
+        except (ValueError, AttributeError):
+            # tuples of the wrong arity, the engine could not use this sample
+            return None
+
+    def sample_scene(self, query, img, video, samples, quorum=None, strategy='asd'):
+        """
+        Self-consistency: sends `samples` concurrent requests for the same ASD and returns as soon
+        as `quorum` of them (a majority by default) agree on vote_key(). Requests still running then
+        are abandoned, their responses are dropped.
+
+        Returns:
+            tuple: (majority ASD, vote summary), the ASD is None when no sample was usable.
+        """
+        quorum = quorum or samples // 2 + 1
+        start = time.perf_counter()
+        pending = {llm_client.spawn(self.generate, query, img, video, strategy) for _ in range(samples)}
+        votes, first, valid = Counter(), {}, 0
+        winner = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                asd = normalize_asd(future.result())
+                key = self.vote_key(asd) if asd is not None else None
+                if key is None:
+                    continue
+                valid += 1
+                votes[key] += 1
+                first.setdefault(key, asd)
+                if votes[key] >= quorum:
+                    winner = key
+        for future in pending:
+            future.cancel()
+        if winner is None and votes:
+            # no quorum, fall back to the plurality, ties go to the first answer
+            winner = max(votes, key=lambda k: (votes[k], -list(first).index(k)))
+        summary = {
+            'samples': samples,
+            'quorum': quorum,
+            'answered': samples - len(pending),
+            'valid': valid,
+            'abandoned': len(pending),
+            'votes': votes[winner] if winner is not None else 0,
+            'agreement': votes[winner] / valid if valid else 0.0,
+            'early_exit': winner is not None and votes[winner] >= quorum and len(pending) > 0,
+            'seconds': round(time.perf_counter() - start, 3),
+        }
+        tracer.record('self_consistency', summary['seconds'], video, strategy, agreement=summary['agreement'])
+        return (first[winner] if winner is not None else None), summary
+
+    def get_scene(self, image_dir, video_ids, ref_video_ids, save_path, samples=1, quorum=None):
+        """
+        Generates the ASD of every segment in both video_ids and ref_video_ids into save_path.
+
+        With samples > 1 each ASD is the majority of that many concurrent samples (see sample_scene),
+        the vote summaries with the agreement scores go to <save_path>-votes.json.
+        """
+        votes_path = save_path.replace('.json', '-votes.json')
         for video in video_ids:
             if video in ref_video_ids:
                 try:
@@ -129,12 +229,14 @@ class Scene:
                     video_name = video + '.jpg'
                     video_path = os.path.join(image_dir, video_name)
                     try:
-                        img = PIL.Image.open(video_path)
+                        with tracer.span('image_load', video, 'asd'):
+                            img = uploads.image_part(video_path)
                     except FileNotFoundError:
                         print(f"Error: The image file was not found at '{video_path}'.")
                         exit() 
                         
                     
+                    prompt_start = time.perf_counter()
                     query = f"""
                     Please describe the scene of a driving video (five frames) from four perspectives: **Situation, Control_device, Road_user, and Intention**.  
 
@@ -161,7 +263,7 @@ class Scene:
                     - All turning directions (left/right) must be from the **ego car’s perspective** and decided carefully based on surrounding reference objects.  
 
                     5. **Vocabulary constraint**:  
-                    - Use **only** words and combinations of words from the vocabulary: {self.vocabulary}.  
+                    - Use **only** words and combinations of words from the vocabulary: {self.vocabulary_prompt}.  
                     - Do not introduce new objects, relations, or movements not present in the video.  
 
                     6. **Output format**:  
@@ -169,9 +271,15 @@ class Scene:
                     - Follow the example structure exactly: {self.example_change_description}.  
 
                     """
+                    tracer.record('prompt_build', time.perf_counter() - prompt_start, video, 'asd', tokens=estimate_tokens(query))
  
                     print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Generating ASD for video: {video}")
-                    result = self.generate(query, img) # json
+                    if samples > 1:
+                        result, vote = self.sample_scene(query, img, video, samples, quorum)
+                        print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Video: {video} {vote['votes']}/{vote['valid']} samples agree, {vote['abandoned']} abandoned")
+                        self.save_vote(votes_path, video, vote)
+                    else:
+                        result = self.generate(query, img, video, 'asd') # json
                     print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Video: {video} aggregated scene description generated")
 
                     scene_item = {video: result}
@@ -179,11 +287,22 @@ class Scene:
                     # save to json file
                     scene_data.update(scene_item)
 
-                    with open(save_path, "w") as f_log:
-                        json.dump(scene_data, f_log, indent=4)
+                    with tracer.span('result_write', video, 'asd'):
+                        with open(save_path, "w") as f_log:
+                            json.dump(scene_data, f_log, indent=4)
                     
                     print(f'{video} done')
 
+    def save_vote(self, votes_path, video, vote):
+        try:
+            with open(votes_path, 'r') as f_votes:
+                votes = json.load(f_votes)
+        except (FileNotFoundError, json.JSONDecodeError):
+            votes = {}
+        votes[video] = vote
+        with open(votes_path, 'w') as f_votes:
+            json.dump(votes, f_votes, indent=4)
+
     def get_tkg(self, image_dir, video_ids, ref_video_ids, save_path):
         for video in video_ids:
             if video in ref_video_ids:
@@ -202,12 +321,14 @@ class Scene:
                     video_name = video + '.jpg'
                     video_path = os.path.join(image_dir, video_name)
                     try:
-                        img = PIL.Image.open(video_path)
+                        with tracer.span('image_load', video, 'tkg'):
+                            img = uploads.image_part(video_path)
                     except FileNotFoundError:
                         print(f"Error: The image file was not found at '{video_path}'.")
                         exit() 
                         
 
+                    prompt_start = time.perf_counter()
                     query = f"""
                     You are a professional driving assistant. Given a sequence of five consecutive frames extracted from a driving video.
                     Your task is to generate **five scene graphs** in **JSON format**, one per frame, capturing the dynamic spatial and temporal relations relevant for driving decisions.
@@ -219,7 +340,7 @@ class Scene:
                     Ensure your scene graphs show small, realistic temporal differences between frames (e.g., a car approaching, pedestrian starting to cross, light turning green).
                     3. **Directional reference:** All directions (e.g., left, right, front, behind) must be described **from the ego car’s perspective**. Determine turning directions carefully using spatial references (e.g., lanes, intersections, other vehicles).
                     4. **Vocabulary constraint:** You must **only use words or word combinations** from the following controlled vocabulary:
-                    {self.vocabulary}
+                    {self.vocabulary_prompt}
                     Do **not** invent new objects, attributes, or relations not included in the vocabulary.
                     5. **Output format:** Provide the output as valid JSON with one list entry per frame.
                     Each frame should be a scene graph following the structure shown below:
@@ -232,16 +353,18 @@ class Scene:
 
                     Now, generate the five scene graphs in JSON format.
                     """
+                    tracer.record('prompt_build', time.perf_counter() - prompt_start, video, 'tkg', tokens=estimate_tokens(query))
 
-                    result = self.generate(query, img) # json
+                    result = self.generate(query, img, video, 'tkg') # json
                     tkg_item = {video: result}
                     ctkg_data = tkg_item[video]
                     # save to json file
                     tkg_data.update(tkg_item)
                     # self.tkg_data = tkg_data
 
-                    with open(tkgpath, "w") as tkg_log:
-                        json.dump(tkg_data, tkg_log, indent=4)
+                    with tracer.span('result_write', video, 'tkg'):
+                        with open(tkgpath, "w") as tkg_log:
+                            json.dump(tkg_data, tkg_log, indent=4)
 
                     print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Video: {video} TKG generated")
 
@@ -258,6 +381,7 @@ class Scene:
                     video_path = os.path.join(image_dir, video_name)
 
 
+                    prompt_start = time.perf_counter()
                     query = f"""
                     You are a professional driving assistant. Based on the five scene graphs here {ctkg_data}, please summarise the scene of a driving video (five frames) from four perspectives: **Situation, Control_device, Road_user, and Intention**.  
 
@@ -284,7 +408,7 @@ class Scene:
                     - All turning directions (left/right) must be from the **ego car’s perspective** and decided carefully based on surrounding reference objects.  
 
                     5. **Vocabulary constraint**:  
-                    - Use **only** words and combinations of words from the vocabulary: {self.vocabulary}.  
+                    - Use **only** words and combinations of words from the vocabulary: {self.vocabulary_prompt}.  
                     - Do not introduce new objects, relations, or movements not present in the video.  
 
                     6. **Output format**:  
@@ -292,12 +416,14 @@ class Scene:
                     - Follow the example structure exactly: {self.example_change_description}.  
 
                     """
+                    tracer.record('prompt_build', time.perf_counter() - prompt_start, video, 'tkg_asd', tokens=estimate_tokens(query))
 
-                    result = self.generate(query) # json
+                    result = self.generate(query, video=video, strategy='tkg_asd') # json
                     scene_item = {video: result}
                     # save to json file
                     scene_data.update(scene_item)
-                    with open(save_path, "w") as f_log:
-                        json.dump(scene_data, f_log, indent=4)
+                    with tracer.span('result_write', video, 'tkg_asd'):
+                        with open(save_path, "w") as f_log:
+                            json.dump(scene_data, f_log, indent=4)
                     
                     print(f"{datetime.now():%Y-%m-%d %H:%M:%S} Video: {video} aggregated scene description generated")
\ No newline at end of file
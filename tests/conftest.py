@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# the modules are scripts that import each other by name, as when run from their directories
+for d in ('reasoningEngine', 'experiments'):
+    sys.path.insert(0, os.path.join(ROOT, d))
@@ -0,0 +1,42 @@
+import os
+import json
+import pytest
+from reason_engine import DrivingLogicEngine, VOCABULARY_PATH
+from counterfactual import WhatIf, default_perturbations
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine')
+
+
+@pytest.fixture(scope='module')
+def engine():
+    with open(os.path.join(ENGINE_DIR, 'uk_rules.json'), 'r') as f:
+        return DrivingLogicEngine(json.load(f), False, log_dir=None)
+
+
+def edited(scene, perturbation):
+    variant = {k: list(v) for k, v in scene.items()}
+    for key, old, new in perturbation:
+        if old is not None:
+            variant[key].remove(old)
+        if new is not None:
+            variant[key].append(new)
+    return variant
+
+
+def test_variant_actions_match_reasoning_on_the_edited_scene(engine):
+    with open(os.path.join(ENGINE_DIR, 'lingoqa_gtasd.json'), 'r') as f:
+        scenes = json.load(f)
+    with open(VOCABULARY_PATH, 'r') as f:
+        vocabulary = json.load(f)
+    what_if = WhatIf(engine)
+    checked = 0
+    for seg_id, scene in scenes.items():
+        result = what_if.evaluate(scene, default_perturbations(scene, vocabulary))
+        assert result['actions'] == sorted({a['action'] for a in engine.reasoning(seg_id, scene)[0]})
+        for variant in result['variants']:
+            if 'error' in variant:
+                continue
+            actions, _ = engine.reasoning(seg_id, edited(scene, variant['perturbation']))
+            assert variant['actions'] == sorted({a['action'] for a in actions}), (seg_id, variant['perturbation'])
+            checked += 1
+    assert checked > 1000
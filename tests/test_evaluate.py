@@ -0,0 +1,17 @@
+import pandas as pd
+from evaluate import KEY, action_metrics
+
+
+def test_unclassified_actions_count_as_misses():
+    actions = pd.DataFrame([
+        ("1-naive", "run", "a", "keep_safe_distance"),
+        ("1-naive", "run", "b", "stop"),
+    ], columns=KEY + ["segment_id", "action"])
+    gt = pd.DataFrame({"segment_id": ["a", "b"], "cls": ["stop", "stop"]})
+
+    table = action_metrics(actions, gt, ["a", "b"])
+    row = table.loc[("1-naive", "run")]
+    assert row["segments"] == 2
+    assert row["action_match"] == 0.5
+    assert row["action_jaccard"] == 0.5
+    assert row["coverage"] == 1.0
@@ -0,0 +1,42 @@
+import os
+import json
+import pytest
+from it_check import gate_intention
+
+RELATION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine', 'synonym_action.json')
+
+
+@pytest.fixture(scope='module')
+def it_relation():
+    with open(RELATION_PATH, 'r') as f:
+        return json.load(f)
+
+
+def test_prohibitions_do_not_contradict(it_relation):
+    for action in ('not_enter_box_junction', 'cannot_park_on_zig-zag lines', 'not_drive_or_park_in_cycle_lane'):
+        assert gate_intention('turn_right', [{'rule_id': 5, 'action': action}], it_relation) == 'check'
+
+
+def test_default_rule_neither_covers_nor_contradicts(it_relation):
+    default = [{'rule_id': '70', 'action': 'maintain_speed'}]
+    assert gate_intention('moving_forward', default, it_relation) == 'check'
+    assert gate_intention('stop', default, it_relation) == 'check'
+
+
+def test_slowing_down_needs_a_check(it_relation):
+    for action in ('reduce_speed', 'drive_carefully_and_slowly', 'slow_down_and_not_overtaking', 'maintain_speed'):
+        slowing = [{'rule_id': 9, 'action': action}]
+        assert gate_intention('stop', slowing, it_relation) == 'check'
+        assert gate_intention('moving_forward', slowing, it_relation) == 'check'
+
+
+def test_explicit_stop_and_go_contradict(it_relation):
+    stop = [{'rule_id': 2, 'action': 'stop_behind_white_line'}]
+    assert gate_intention('turn_right', stop, it_relation) == 'contradicted'
+    assert gate_intention('moving_forward', stop, it_relation) == 'contradicted'
+    assert gate_intention('stop', stop, it_relation) == 'covered'
+    go = [{'rule_id': '58', 'action': 'start'}]
+    assert gate_intention('stop', go, it_relation) == 'contradicted'
+    assert gate_intention('park', go, it_relation) == 'contradicted'
+    assert gate_intention('move_off', go, it_relation) == 'covered'
+    assert gate_intention('moving_forward', [{'rule_id': 17, 'action': 'proceed'}], it_relation) == 'covered'
@@ -0,0 +1,61 @@
+import os
+import json
+import pytest
+from json_stream import iter_items, ItemWriter
+
+ITEMS = {'a': {'actions_to_take': [{'rule_id': '70', 'action': 'maintain_speed'}]}, 'b': {'intention': ['stop']}, 'c': {}}
+
+
+@pytest.fixture(params=['result.json', 'result.jsonl'])
+def path(request, tmp_path):
+    return str(tmp_path / request.param)
+
+
+def crash(path, n):
+    # a run that wrote n items and died before close()
+    writer = ItemWriter(path)
+    for key in list(ITEMS)[:n]:
+        writer.add(key, ITEMS[key])
+    writer.f.close()
+
+
+def test_output_appears_only_on_close(path):
+    writer = ItemWriter(path)
+    writer.add('a', ITEMS['a'])
+    assert not os.path.exists(path)
+    writer.close()
+    assert dict(iter_items(path)) == {'a': ITEMS['a']}
+    assert not os.path.exists(f"{path}.partial")
+
+
+def test_json_layout_matches_json_dump(tmp_path):
+    path = str(tmp_path / 'result.json')
+    writer = ItemWriter(path)
+    for key, value in ITEMS.items():
+        writer.add(key, value)
+    writer.close()
+    with open(path, 'r') as f:
+        assert f.read() == json.dumps(ITEMS, indent=4)
+
+
+def test_truncated_stream_yields_its_complete_items(path):
+    crash(path, 2)
+    partial = f"{path}.partial"
+    with open(partial, 'r') as f:
+        text = f.read()
+    with open(partial, 'w') as f:
+        # cut inside the second item
+        f.write(text[:-5])
+    with pytest.raises(ValueError):
+        list(iter_items(partial, jsonl=path.endswith('.jsonl')))
+    assert dict(iter_items(partial, jsonl=path.endswith('.jsonl'), truncated=True)) == {'a': ITEMS['a']}
+
+
+def test_resume_recovers_the_partial_stream(path):
+    crash(path, 2)
+    writer = ItemWriter(path, resume=True)
+    assert writer.done == {'a', 'b'}
+    writer.add('c', ITEMS['c'])
+    writer.close()
+    assert dict(iter_items(path)) == ITEMS
+    assert not os.path.exists(f"{path}.resume")
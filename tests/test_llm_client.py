@@ -0,0 +1,103 @@
+import time
+import threading
+import pytest
+from llm_client import CircuitBreaker, HedgedModel, LocalModel
+
+# the seeds fix which draws of LocalModel are slow or fail, see the comment of each test
+
+
+def test_hedge_fires_after_the_p95_delay():
+    model = LocalModel(latency=0.02, slow_latency=2.0, seed=0)
+    hedged = HedgedModel(model, deadline=5.0, min_samples=5)
+    for _ in range(5):
+        hedged.generate_content('q')
+    delay = hedged.hedge_delay()
+    assert delay < 0.5
+    # seed 0: the 6th draw is slow, the 7th (the hedge) is not
+    model.slow_rate = 0.5
+    start = time.monotonic()
+    assert hedged.generate_content('q').text == '{}'
+    elapsed = time.monotonic() - start
+    assert delay <= elapsed < 1.0
+    assert (hedged.hedged, hedged.hedge_wins, model.calls) == (1, 1, 7)
+
+
+def test_failure_is_retried_once():
+    # seed 1: the first draw fails, the second succeeds
+    model = LocalModel(latency=0.01, fail_rate=0.5, seed=1)
+    hedged = HedgedModel(model, deadline=5.0)
+    assert hedged.generate_content('q').text == '{}'
+    assert (hedged.hedged, model.calls) == (1, 2)
+
+    # seed 4: the first two draws fail, there is no third attempt
+    model = LocalModel(latency=0.01, fail_rate=0.5, seed=4)
+    hedged = HedgedModel(model, deadline=5.0)
+    with pytest.raises(RuntimeError):
+        hedged.generate_content('q')
+    assert (hedged.hedged, hedged.failures, model.calls) == (1, 1, 2)
+
+
+def test_deadline_raises_timeout():
+    model = LocalModel(latency=2.0, seed=0)
+    hedged = HedgedModel(model, deadline=0.2)
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        hedged.generate_content('q')
+    assert time.monotonic() - start < 1.0
+    assert hedged.timeouts == 1
+
+
+def test_breaker_opens_admits_one_probe_and_closes():
+    breaker = CircuitBreaker(window=4, min_calls=2, cooldown=0.2)
+    assert breaker.before_call() == 0
+    breaker.record(False)
+    breaker.record(False)
+    assert (breaker.state, breaker.opened) == ('open', 1)
+
+    admitted = []
+    threads = [threading.Thread(target=lambda: admitted.append(breaker.before_call())) for _ in range(3)]
+    for t in threads:
+        t.start()
+    time.sleep(0.4)
+    # after the cooldown a single probe goes through half-open, the others wait for its result
+    assert (breaker.state, admitted) == ('half_open', [1])
+
+    # a request sent before the breaker opened does not decide
+    breaker.record(True)
+    time.sleep(0.05)
+    assert (breaker.state, admitted) == ('half_open', [1])
+
+    breaker.record(True, probe=1)
+    for t in threads:
+        t.join(1.0)
+    assert (breaker.state, sorted(admitted)) == ('closed', [0, 0, 1])
+
+
+def test_failed_probe_opens_the_breaker_again():
+    breaker = CircuitBreaker(window=4, min_calls=2, cooldown=0.1)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.15)
+    probe = breaker.before_call()
+    assert probe == 1
+    breaker.record(False, probe)
+    assert (breaker.state, breaker.opened) == ('open', 2)
+
+
+def test_silent_probe_times_out_and_reopens_the_breaker():
+    breaker = CircuitBreaker(window=4, min_calls=2, cooldown=0.1, probe_timeout=0.2)
+    breaker.record(False)
+    breaker.record(False)
+    time.sleep(0.15)
+    assert breaker.before_call() == 1
+    # the probe never records, the next caller is held for probe_timeout, then the cooldown,
+    # and becomes the next probe
+    start = time.monotonic()
+    assert breaker.before_call() == 2
+    assert time.monotonic() - start >= 0.25
+    assert breaker.opened == 2
+    # a late result of the first probe does not decide
+    breaker.record(True, 1)
+    assert breaker.state == 'half_open'
+    breaker.record(True, 2)
+    assert breaker.state == 'closed'
@@ -0,0 +1,148 @@
+import os
+import json
+import pytest
+from reason_engine import DrivingLogicEngine, Taxonomy
+from provenance import DERIVED
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine', 'uk_rules.json')
+SCENES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine', 'lingoqa_gtasd.json')
+
+
+@pytest.fixture(scope='module')
+def rules():
+    with open(RULES_PATH, 'r') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def engine(rules, tmp_path, monkeypatch):
+    # the engine writes its log file under ./logs
+    monkeypatch.chdir(tmp_path)
+    return DrivingLogicEngine(rules, False)
+
+
+def scene(situation=(), control_device=(), road_user=(), intention=()):
+    return {'situation': list(situation), 'control_device': list(control_device), 'road_user': list(road_user), 'intention': list(intention)}
+
+
+def fired(engine, asd):
+    return {(int(a['rule_id']), a['action']) for a in engine.reasoning(None, asd)[0]}
+
+
+def test_situation_rules_outside_subject_types_stay_indexed(engine):
+    assert (43, 'cannot_park_on_zig-zag lines') in fired(engine, scene(situation=['(zig-zag_lines, are, nearby)']))
+
+
+def test_subsumed_rules_report_their_own_id(engine):
+    asd = scene(situation=['(ego, approaching, crossing)'], road_user=['(pedestrian, left_sidewalk, has_passed_crossing, has_passed_crossing)'])
+    assert {57, 61} <= {rule_id for rule_id, _ in fired(engine, asd)}
+    assert any(item[0] == 61 for item in engine.rule_analysis['subsumed'])
+
+
+def test_priorities_belong_to_their_rulebook(engine, rules):
+    engine.add_rulebook('no_priorities', rules)
+    quiet = scene(situation=['(ego, on, motorway)'])
+    assert {'70'} <= {str(a['rule_id']) for a in engine.reasoning(None, quiet)[0]}
+    results, _ = engine.reasoning_all(None, quiet, ['no_priorities'])
+    assert '70' not in {str(a['rule_id']) for a in results['no_priorities']}
+
+
+def test_explain_tags_derived_actions_and_their_sources(engine):
+    asd = scene(situation=['(ego, on, road)'], control_device=['(traffic_light, ego, red, green)'])
+    actions, _, provenance = engine.explain(None, asd)
+    assert actions == engine.reasoning(None, asd)[0]
+    i = list(provenance.actions).index('start')
+    assert provenance.kinds[i] == DERIVED
+    assert provenance.rule_ids[i] == 58
+    assert set(provenance.condition_strings(i)) == {'traffic_light, was, red', 'traffic_light, is, green'}
+    # position 1 of asd_tuples(): the control_device tuple after the one situation tuple
+    assert provenance.sources(i) == [1]
+
+
+def test_index_size_is_counted_the_same_before_and_after_pruning(engine):
+    # nothing of uk_rules is pruned, so the sizes must agree
+    report = engine.rule_analysis
+    assert report['size_before'] == report['size_after']
+
+
+def test_only_malformed_conditions_are_unreachable(engine):
+    unreachable = {item[0] for item in engine.rule_analysis['unreachable']}
+    # is_crossing and has_passed_crossing are only written in the rules, and these rules fire on ground truth
+    assert not unreachable & {6, 7, 61}
+    # 'no_condition' and 'Rule A IS Traffic_Light_Rule' are not facts
+    assert {64, 67} <= unreachable
+
+
+def test_negated_condition_holds_only_without_the_fact(engine):
+    # rule 36: can overtake unless a road user is overtaking the ego
+    overtake = scene(
+        situation=['(road, status, clear)', '(suitable_gap, in_front_of, road_user_you_plan_to_overtake)'],
+        intention=['(ego, overtake)'],
+    )
+    assert (36, 'can_overtake') in fired(engine, overtake)
+    following = dict(overtake, road_user=['(car, behind, moving, moving)'])
+    assert (36, 'can_overtake') in fired(engine, following)
+    overtaken = dict(overtake, road_user=['(car, behind, overtake_ego, overtake_ego)'])
+    assert (36, 'can_overtake') not in fired(engine, overtaken)
+
+
+def test_taxonomy_closure_over_several_parents():
+    taxonomy = Taxonomy({'vehicle': ['car', 'van'], 'vulnerable': {'two_wheeler': ['cyclist']}, 'slow': ['cyclist']}, 'road_user')
+    assert taxonomy.is_a('cyclist', 'two_wheeler')
+    assert taxonomy.is_a('cyclist', 'vulnerable')
+    assert taxonomy.is_a('cyclist', 'slow')
+    assert taxonomy.is_a('car', 'road_user')
+    assert taxonomy.is_a('car', 'car')
+    assert not taxonomy.is_a('car', 'vulnerable')
+    assert not taxonomy.is_a('vehicle', 'car')
+    assert taxonomy.is_a('tram', 'tram') and not taxonomy.is_a('tram', 'vehicle')
+    assert sorted(taxonomy.as_dict()['vulnerable']) == ['cyclist', 'two_wheeler', 'vulnerable']
+
+
+def test_taxonomy_rejects_cycles():
+    with pytest.raises(ValueError):
+        Taxonomy({'a': {'b': ['a']}}, 'root')
+
+
+@pytest.mark.parametrize('rule_id, segment_id', [
+    (4, '990fbf8f0b48da3a82613643b3827aa4'),
+    (6, '0f54dedab4ab997e8cdf97c570146292'),
+    (7, '3561e15b7feb2e922e9c962754f75dde'),
+])
+def test_rules_on_general_classes_fire_for_subclasses(engine, rule_id, segment_id):
+    # the rules name vulnerable_road_user, the scenes name a cyclist or a pedestrian
+    with open(SCENES_PATH, 'r') as f:
+        asd = json.load(f)[segment_id]
+    assert rule_id in {r for r, _ in fired(engine, asd)}
+
+
+def test_reload_recompiles_only_the_edited_rule_and_keeps_axiom_ids(engine, rules):
+    zig_zag = scene(situation=['(zig-zag_lines, are, nearby)'])
+    ids = dict(engine.compiled['axiom_condition_id'])
+    edited = [dict(r) for r in rules]
+    rule = next(r for r in edited if int(r['id']) == 43)
+    rule['action'] = 'cannot_stop_on_zig-zag lines'
+    rule['conditions'] = rule['conditions'] + ['ego, is, driving']
+
+    changes = engine.reload(edited)
+    assert (changes['added'], changes['removed'], changes['updated']) == ([], [], [43])
+    assert changes['unchanged'] == len(rules) - 1
+    new_ids = engine.compiled['axiom_condition_id']
+    assert all(new_ids[axiom] == i for axiom, i in ids.items())
+    assert new_ids['ego, is, driving'] == len(ids)
+
+    assert (43, 'cannot_park_on_zig-zag lines') not in fired(engine, zig_zag)
+    assert (43, 'cannot_stop_on_zig-zag lines') not in fired(engine, zig_zag)
+    assert (43, 'cannot_stop_on_zig-zag lines') in fired(engine, dict(zig_zag, situation=zig_zag['situation'] + ['(ego, is, driving)']))
+
+
+def test_explain_logs_like_reasoning(engine, monkeypatch):
+    asd = scene(situation=['(ego, on, road)'], control_device=['(traffic_light, ego, red, green)'])
+    logged = []
+    monkeypatch.setattr(engine.logger, 'info', logged.append)
+    engine.verbose = True
+    engine.reasoning('seg', asd)
+    by_reasoning = list(logged)
+    logged.clear()
+    engine.explain('seg', asd)
+    assert logged == by_reasoning
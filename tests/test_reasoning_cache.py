@@ -0,0 +1,55 @@
+import os
+import json
+import pytest
+from reason_engine import DrivingLogicEngine
+from reasoning_cache import ReasoningCache
+
+RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine', 'uk_rules.json')
+
+SCENE = {
+    'situation': ['(zig-zag_lines, are, nearby)', '(ego, on, road)'],
+    'control_device': [], 'road_user': [], 'intention': [],
+}
+
+
+@pytest.fixture(scope='module')
+def rules():
+    with open(RULES_PATH, 'r') as f:
+        return json.load(f)
+
+
+def rules_hash(rules, rule_names=False):
+    return DrivingLogicEngine(rules, False, log_dir=None).rules_hash(rule_names=rule_names)
+
+
+def test_unchanged_segment_is_reused_across_runs(tmp_path, rules):
+    path = str(tmp_path / 'cache.json')
+    cache = ReasoningCache(path, rules_hash(rules))
+    assert cache.get('seg', SCENE) is None
+    cache.put('seg', SCENE, {'actions_to_take': []})
+    cache.save()
+
+    cache = ReasoningCache(path, rules_hash(rules))
+    # the order of the ASD tuples does not matter
+    reordered = dict(SCENE, situation=SCENE['situation'][::-1])
+    assert cache.get('seg', reordered) == {'actions_to_take': []}
+    assert (cache.reused, cache.recomputed) == (1, 0)
+
+
+def test_scene_or_rule_edits_force_a_recompute(tmp_path, rules):
+    path = str(tmp_path / 'cache.json')
+    cache = ReasoningCache(path, rules_hash(rules))
+    cache.put('seg', SCENE, {'actions_to_take': []})
+    cache.save()
+
+    edited_scene = dict(SCENE, situation=SCENE['situation'] + ['(ego, approaching, crossing)'])
+    assert ReasoningCache(path, rules_hash(rules)).get('seg', edited_scene) is None
+
+    edited_rules = [dict(r, action='cannot_stop_on_zig-zag lines') if int(r['id']) == 43 else r for r in rules]
+    assert ReasoningCache(path, rules_hash(edited_rules)).get('seg', SCENE) is None
+
+
+def test_rule_names_only_count_when_outputs_show_them(rules):
+    renamed = [dict(r, UKRuleid='Rule 999') if int(r['id']) == 43 else r for r in rules]
+    assert rules_hash(renamed) == rules_hash(rules)
+    assert rules_hash(renamed, rule_names=True) != rules_hash(rules, rule_names=True)
@@ -0,0 +1,8 @@
+from replay import replay, CORPUS_DIR
+
+
+def test_golden_corpus_has_no_mismatches():
+    # latency budgets depend on the machine, the recorded outcomes do not
+    report = replay(CORPUS_DIR, repeat=1)
+    assert report['scenes'] > 0
+    assert report['mismatches'] == []
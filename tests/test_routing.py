@@ -0,0 +1,23 @@
+import os
+import logging
+from routing import Cascade
+
+
+def test_rules_cited_by_name_only_are_known():
+    cascade = Cascade(['cheap', 'strong'])
+    answer = {'action': ['stop'], 'reasoning_path': [{'UKRuleid': 'Rule 109', 'conditions': [], 'action': 'stop'}]}
+    assert cascade.check([answer], None) is None
+    answer['reasoning_path'] = [{'UKRuleid': 'Rule 9999'}]
+    assert cascade.check([answer], None) == 'vocabulary'
+    answer['reasoning_path'] = [{'id': 9999}]
+    assert cascade.check([answer], None) == 'vocabulary'
+
+
+def test_engine_check_logs_nothing(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    handlers = list(logging.getLogger().handlers)
+    scene = {'situation': ['(ego, approaching, crossing)'], 'control_device': [], 'road_user': [], 'intention': ['(ego, stop)']}
+    assert 'drive_carefully_and_slowly' in Cascade(['cheap', 'strong']).engine_actions(scene)
+    assert not os.path.exists(tmp_path / 'logs')
+    assert logging.getLogger().handlers == handlers
+    assert capsys.readouterr().out == ''
@@ -0,0 +1,40 @@
+import os
+import json
+import pytest
+from rule_index import RuleIndex
+from reason_engine import DrivingLogicEngine
+
+ENGINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'reasoningEngine')
+
+
+@pytest.fixture(scope='module')
+def engine():
+    with open(os.path.join(ENGINE_DIR, 'uk_rules.json'), 'r') as f:
+        return DrivingLogicEngine(json.load(f), False, log_dir=None)
+
+
+@pytest.fixture(scope='module')
+def scenes():
+    with open(os.path.join(ENGINE_DIR, 'golden', 'scenes.json'), 'r') as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize('use_mmap', [True, False])
+def test_save_load_round_trip(engine, scenes, tmp_path, use_mmap):
+    path = str(tmp_path / 'uk_rules.idx')
+    engine.save_index(path)
+    loaded, axioms = RuleIndex.load(path, use_mmap)
+    compiled = engine.compiled
+    assert axioms == [compiled['id_axiom_conditions'][i] for i in range(len(axioms))]
+    assert list(loaded.rules()) == list(compiled['rule_index'].rules())
+    for scene in scenes.values():
+        facts, _ = engine.build_facts(scene)
+        fact_ids = engine.fact_ids(facts, compiled['axiom_condition_id'])
+        assert loaded.match(fact_ids) == compiled['rule_index'].match(fact_ids)
+
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'rules.json'
+    path.write_text('[]')
+    with pytest.raises(ValueError):
+        RuleIndex.load(str(path))
@@ -0,0 +1,106 @@
+import json
+import threading
+import pytest
+from uploads import LocalUploader, UploadRegistry
+
+
+@pytest.fixture
+def images(tmp_path):
+    paths = []
+    for i in range(2):
+        path = tmp_path / f"frame_{i}.jpg"
+        path.write_bytes(bytes([i]) * 64)
+        paths.append(str(path))
+    return paths
+
+
+def test_uploads_once_and_reuses(tmp_path, images):
+    uploader = LocalUploader(str(tmp_path / 'files'))
+    registry = UploadRegistry(uploader, str(tmp_path / 'uploads.json'))
+    first = registry.handle(images[0])
+    assert registry.handle(images[0]) == first
+    assert (uploader.uploads, registry.uploaded, registry.reused) == (1, 1, 1)
+
+    # a new run over the same file reuses the stored handle
+    uploader = LocalUploader(str(tmp_path / 'files'))
+    assert UploadRegistry(uploader, str(tmp_path / 'uploads.json')).handle(images[0]) == first
+    assert uploader.uploads == 0
+
+
+def test_reuploads_within_margin_of_expiry(tmp_path, images):
+    uploader = LocalUploader(str(tmp_path / 'files'), ttl=60)
+    registry = UploadRegistry(uploader, margin=120)
+    registry.handle(images[0])
+    registry.handle(images[0])
+    assert uploader.uploads == 2
+
+    registry = UploadRegistry(uploader, margin=30)
+    registry.handle(images[0])
+    registry.handle(images[0])
+    assert uploader.uploads == 3
+
+
+def test_registries_sharing_a_file_merge(tmp_path, images):
+    path = str(tmp_path / 'uploads.json')
+    uploader = LocalUploader(str(tmp_path / 'files'))
+    a, b = UploadRegistry(uploader, path), UploadRegistry(uploader, path)
+    a.handle(images[0])
+    b.handle(images[1])
+    # b read the file before a wrote it, it still finds a's handle instead of uploading again
+    b.handle(images[0])
+    assert uploader.uploads == 2
+    with open(path, 'r') as f:
+        assert len(json.load(f)) == 2
+
+
+def test_handles_are_not_shared_across_uploader_kinds(tmp_path, images):
+    class OtherUploader(LocalUploader):
+        kind = 'other'
+
+    path = str(tmp_path / 'uploads.json')
+    UploadRegistry(LocalUploader(str(tmp_path / 'files')), path).handle(images[0])
+    other = OtherUploader(str(tmp_path / 'other'))
+    UploadRegistry(other, path).handle(images[0])
+    assert other.uploads == 1
+
+
+def test_local_files_sharing_a_root_do_not_collide(tmp_path):
+    root = str(tmp_path / 'files')
+    images = []
+    for i in range(2):
+        # same file name in two runs, different content
+        (tmp_path / f'run_{i}').mkdir()
+        path = tmp_path / f'run_{i}' / 'frame.jpg'
+        path.write_bytes(bytes([i]) * 64)
+        images.append(str(path))
+    # two processes each on their first upload
+    a = LocalUploader(root).upload(images[0], 'image/jpeg')
+    b = LocalUploader(root).upload(images[1], 'image/jpeg')
+    assert a['uri'] != b['uri']
+    for handle, image in ((a, images[0]), (b, images[1])):
+        with open(handle['uri'][len('file://'):], 'rb') as f, open(image, 'rb') as g:
+            assert f.read() == g.read()
+
+
+def test_uploads_run_outside_the_lock(tmp_path, images):
+    release = threading.Event()
+
+    class SlowUploader(LocalUploader):
+        def upload(self, path, mime_type):
+            if path == images[0]:
+                release.wait(5)
+            return super().upload(path, mime_type)
+
+    uploader = SlowUploader(str(tmp_path / 'files'))
+    registry = UploadRegistry(uploader, str(tmp_path / 'uploads.json'))
+    slow = [threading.Thread(target=registry.handle, args=(images[0],)) for _ in range(2)]
+    for t in slow:
+        t.start()
+    # image 1 is not held up by the upload of image 0
+    registry.handle(images[1])
+    assert registry.uploaded == 1
+    release.set()
+    for t in slow:
+        t.join(5)
+    # the second thread waited for the first one's upload instead of uploading again
+    assert (uploader.uploads, registry.uploaded, registry.reused) == (2, 2, 1)